@@ -0,0 +1,250 @@
+import os
+
+import numpy as np
+
+from matcher import normalize_rows
+
+# ------------------------------
+# APPROXIMATE NEAREST-NEIGHBOUR INDEX (IVF / IVF-PQ)
+# ------------------------------
+# Rows are clustered with spherical k-means; a query only scans the rows
+# of its `nprobe` closest clusters. With PQ the scan uses 1-byte codes per
+# sub-vector and only the best `rerank` candidates are scored exactly
+# against the float32 gallery matrix. Row ids are GalleryStore rows, so
+# the index can be extended after /train without rebuilding it.
+INDEX_FILE = "ivf.npz"
+KINDS = ("exact", "ivf", "ivfpq")
+
+
+def kmeans(x, k, iters=20, spherical=True, seed=0):
+    """Lloyd's k-means; `spherical` keeps centroids on the unit sphere (cosine)."""
+    rng = np.random.default_rng(seed)
+    k = min(k, x.shape[0])
+    centroids = x[rng.choice(x.shape[0], k, replace=False)].copy()
+    for _ in range(iters):
+        if spherical:
+            assign = np.argmax(x @ centroids.T, axis=1)
+        else:
+            d = (centroids ** 2).sum(1)[None, :] - 2.0 * (x @ centroids.T)
+            assign = np.argmin(d, axis=1)
+        counts = np.bincount(assign, minlength=k)
+        order = np.argsort(assign, kind="stable")
+        present = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(x[order], (np.cumsum(counts) - counts)[present], axis=0)
+        empty = counts == 0
+        # re-seed empty clusters from random points
+        sums[empty] = x[rng.choice(x.shape[0], int(empty.sum()))]
+        counts[empty] = 1
+        centroids = (sums / counts[:, None]).astype(np.float32)
+        if spherical:
+            centroids = normalize_rows(centroids)
+    return centroids.astype(np.float32)
+
+
+def default_nlist(n_rows):
+    return int(max(1, min(4096, round(4 * np.sqrt(n_rows)))))
+
+
+class IVFIndex:
+    def __init__(self, centroids, assign, pq_codebooks=None, codes=None,
+                 trained_rows=0, generation=0, nprobe=8, rerank=64):
+        self.centroids = centroids            # (nlist, dim) unit rows
+        self.assign = assign                  # (rows,) int32 list id per row, -1 = not indexed
+        self.pq_codebooks = pq_codebooks      # (m, 256, dim/m) or None
+        self.codes = codes                    # (rows, m) uint8 or None
+        self.trained_rows = trained_rows
+        self.generation = generation
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self._build_lists()
+
+    @property
+    def kind(self):
+        return "ivfpq" if self.pq_codebooks is not None else "ivf"
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    def _build_lists(self):
+        indexed = np.flatnonzero(self.assign >= 0)
+        order = np.argsort(self.assign[indexed], kind="stable")
+        self.list_rows = indexed[order].astype(np.int64)
+        counts = np.bincount(self.assign[indexed], minlength=self.nlist)
+        self.list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    # ------------------------------
+    # build / update
+    # ------------------------------
+    @classmethod
+    def build(cls, matrix, live_rows, kind="ivf", nlist=None, pq_m=16,
+              generation=0, sample=50000, seed=0, **params):
+        """Train on the `live_rows` of `matrix` and index them."""
+        rng = np.random.default_rng(seed)
+        live_rows = np.asarray(live_rows, dtype=np.int64)
+        nlist = nlist or default_nlist(live_rows.size)
+        # ~30 points per cluster (and enough for the 256 PQ centroids) train well
+        sample = min(sample, max(30 * nlist, 256 * 30))
+        train_rows = live_rows
+        if live_rows.size > sample:
+            train_rows = np.sort(rng.choice(live_rows, sample, replace=False))
+        train = np.asarray(matrix[train_rows], dtype=np.float32)
+        centroids = kmeans(train, nlist, iters=10, seed=seed)
+
+        pq_codebooks = None
+        if kind == "ivfpq":
+            dim = train.shape[1]
+            if dim % pq_m:
+                raise ValueError(f"pq_m={pq_m} must divide the embedding dim {dim}")
+            sub = dim // pq_m
+            pq_codebooks = np.stack([
+                kmeans(np.ascontiguousarray(train[:, j * sub:(j + 1) * sub]), 256, iters=15, spherical=False, seed=seed + j)
+                for j in range(pq_m)])
+
+        index = cls(centroids, np.full(matrix.shape[0], -1, dtype=np.int32), pq_codebooks,
+                    None if pq_codebooks is None else np.zeros((matrix.shape[0], pq_m), np.uint8),
+                    trained_rows=int(live_rows.size), generation=generation, **params)
+        index.add(matrix, live_rows)
+        return index
+
+    def _encode(self, vecs):
+        m, _, sub = self.pq_codebooks.shape
+        codes = np.empty((vecs.shape[0], m), dtype=np.uint8)
+        for j in range(m):
+            part = np.ascontiguousarray(vecs[:, j * sub:(j + 1) * sub])
+            cb = self.pq_codebooks[j]
+            d = (cb ** 2).sum(1)[None, :] - 2.0 * (part @ cb.T)
+            codes[:, j] = np.argmin(d, axis=1)
+        return codes
+
+    def add(self, matrix, rows, chunk=65536):
+        """Index `rows` of `matrix` against the existing clusters (no retraining)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if matrix.shape[0] > self.assign.shape[0]:
+            grow = matrix.shape[0] - self.assign.shape[0]
+            self.assign = np.concatenate([self.assign, np.full(grow, -1, np.int32)])
+            if self.codes is not None:
+                self.codes = np.concatenate([self.codes, np.zeros((grow, self.codes.shape[1]), np.uint8)])
+        for start in range(0, rows.size, chunk):
+            part = rows[start:start + chunk]
+            vecs = np.asarray(matrix[part], dtype=np.float32)
+            self.assign[part] = np.argmax(vecs @ self.centroids.T, axis=1)
+            if self.codes is not None:
+                self.codes[part] = self._encode(vecs)
+        self._build_lists()
+
+    # ------------------------------
+    # search
+    # ------------------------------
+    def probe(self, queries):
+        """The `nprobe` closest clusters of every unit query, (queries, nprobe)."""
+        nprobe = min(self.nprobe, self.nlist)
+        return np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+    def candidates(self, probe):
+        """Gallery rows in the given clusters."""
+        parts = [self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe]
+        return np.concatenate(parts) if parts else np.zeros(0, np.int64)
+
+    def search(self, queries, matrix, valid=None):
+        """Per query: (rows, exact float32 scores) over its probed candidates.
+
+        `valid(rows) -> bool mask` drops rows that should not be matched
+        (dead rows, other sections) before scoring.
+        """
+        queries = normalize_rows(queries)
+        out = []
+        for q, probe in zip(queries, self.probe(queries)):
+            rows = self.candidates(probe)
+            if valid is not None and rows.size:
+                rows = rows[valid(rows)]
+            if self.codes is not None and rows.size > self.rerank:
+                m, _, sub = self.pq_codebooks.shape
+                table = np.einsum("mkd,md->mk", self.pq_codebooks, q.reshape(m, sub))
+                approx = table[np.arange(m)[None, :], self.codes[rows]].sum(axis=1)
+                keep = np.argpartition(-approx, self.rerank - 1)[:self.rerank]
+                rows = rows[keep]
+            rows = np.sort(rows)
+            sims = np.asarray(matrix[rows], dtype=np.float32) @ q if rows.size else np.zeros(0, np.float32)
+            out.append((rows, sims))
+        return out
+
+    # ------------------------------
+    # persistence
+    # ------------------------------
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        arrays = {"centroids": self.centroids, "assign": self.assign,
+                  "meta": np.array([self.trained_rows, self.generation], np.int64)}
+        if self.pq_codebooks is not None:
+            arrays["pq_codebooks"] = self.pq_codebooks
+            arrays["codes"] = self.codes
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, **params):
+        with np.load(path) as data:
+            trained_rows, generation = (int(v) for v in data["meta"])
+            return cls(data["centroids"], data["assign"],
+                       data["pq_codebooks"] if "pq_codebooks" in data else None,
+                       data["codes"] if "codes" in data else None,
+                       trained_rows=trained_rows, generation=generation, **params)
+
+
+def _live_rows(store):
+    if not len(store):
+        return np.zeros(0, np.int64)
+    return np.concatenate([np.arange(e["offset"], e["offset"] + e["count"])
+                           for e in store.students.values()])
+
+
+def update_store_index(store, kind, nprobe=8, rerank=64, retrain_growth=2.0):
+    """Bring `<store>/ivf.npz` up to date after /train; returns the index or None for exact.
+
+    New rows are added to the existing clusters. The index is retrained
+    from scratch when there is none, when its kind changed, when the store
+    was compacted (row ids moved) or when the live gallery grew more than
+    `retrain_growth` times since training.
+    """
+    if kind == "exact":
+        return None
+    path = os.path.join(store.root, INDEX_FILE)
+    live = _live_rows(store)
+    if live.size == 0:
+        return None
+    matrix = store.matrix()
+    index = None
+    if os.path.exists(path):
+        index = IVFIndex.load(path, nprobe=nprobe, rerank=rerank)
+        stale = (index.kind != kind or index.generation != store.index["generation"]
+                 or live.size > retrain_growth * max(index.trained_rows, 1))
+        if stale:
+            index = None
+    if index is None:
+        index = IVFIndex.build(matrix, live, kind=kind, generation=store.index["generation"],
+                               nprobe=nprobe, rerank=rerank)
+    else:
+        indexed = index.assign[live[live < index.assign.shape[0]]] >= 0
+        new_rows = np.concatenate([live[live >= index.assign.shape[0]],
+                                   live[live < index.assign.shape[0]][~indexed]])
+        if new_rows.size:
+            index.add(matrix, new_rows)
+    index.save(path)
+    return index
+
+
+def load_store_index(store, kind, nprobe=8, rerank=64):
+    """Index saved next to the store, or None for exact search / no index yet."""
+    path = os.path.join(store.root, INDEX_FILE)
+    if kind == "exact" or not os.path.exists(path):
+        return None
+    index = IVFIndex.load(path, nprobe=nprobe, rerank=rerank)
+    if index.kind != kind or index.generation != store.index["generation"]:
+        return None
+    live = _live_rows(store)
+    if live.size and (live.max() >= index.assign.shape[0] or (index.assign[live] < 0).any()):
+        print(f"⚠️ {path} does not cover the whole gallery; using exact search until /train")
+        return None
+    return index
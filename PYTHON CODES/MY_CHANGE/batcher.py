@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# ------------------------------
+# CROSS-REQUEST EMBEDDING BATCHES
+# ------------------------------
+# Concurrent requests hand their aligned crops to one EmbedBatcher; its
+# thread waits at most `max_wait_ms` after the first pending request for
+# others to arrive, runs up to `max_batch` crops through `embed_fn` in one
+# call and hands each request back its own rows. A request with more
+# crops than max_batch still runs as one call, on its own.
+
+class EmbedBatcher:
+    def __init__(self, embed_fn, max_batch=64, max_wait_ms=5.0):
+        self.embed_fn = embed_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._held = None  # request that didn't fit the previous batch
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "requests": 0, "crops": 0, "max_crops": 0,
+                       "embed_seconds": 0.0, "wait_seconds": 0.0}
+        self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, crops):
+        """Future resolving to the (len(crops), dim) embeddings of `crops`."""
+        future = Future()
+        if len(crops) == 0:
+            future.set_result(self.embed_fn([]))
+            return future
+        self._queue.put((list(crops), future, time.perf_counter()))
+        return future
+
+    def embed(self, crops):
+        return self.submit(crops).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next(self, timeout=None):
+        if self._held is not None:
+            item, self._held = self._held, None
+            return item
+        return self._queue.get(timeout=timeout) if timeout is not None else self._queue.get()
+
+    def _loop(self):
+        while True:
+            first = self._next()
+            if first is None:
+                return
+            batch, count = [first], len(first[0])
+            deadline = time.perf_counter() + self.max_wait
+            while count < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._next(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # stop after this batch
+                    break
+                if count + len(item[0]) > self.max_batch:
+                    self._held = item
+                    break
+                batch.append(item)
+                count += len(item[0])
+            self._run(batch, count)
+
+    def _run(self, batch, count):
+        started = time.perf_counter()
+        try:
+            embs = self.embed_fn([crop for crops, _, _ in batch for crop in crops])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+        start = 0
+        for crops, future, _ in batch:
+            future.set_result(embs[start:start + len(crops)])
+            start += len(crops)
+        with self._lock:
+            s = self._stats
+            s["batches"] += 1
+            s["requests"] += len(batch)
+            s["crops"] += count
+            s["max_crops"] = max(s["max_crops"], count)
+            s["embed_seconds"] += elapsed
+            s["wait_seconds"] += sum(started - queued for _, _, queued in batch)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s["mean_crops"] = round(s["crops"] / s["batches"], 2) if s["batches"] else 0.0
+        s["mean_requests"] = round(s["requests"] / s["batches"], 2) if s["batches"] else 0.0
+        s["embed_seconds"] = round(s["embed_seconds"], 3)
+        s["wait_seconds"] = round(s["wait_seconds"], 3)
+        return s
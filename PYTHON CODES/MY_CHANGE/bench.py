@@ -0,0 +1,450 @@
+"""Offline benchmark of the attendance hot paths with a stub face model.
+
+Runs the real matcher, gallery store, enrollment pipeline, decode, crop
+writing, YOLO extraction (process.py) and ledger code, with a
+deterministic stub in place of FaceAnalysis / YOLO, so it needs no model
+files or GPU. Results are JSON; --compare flags regressions against the
+JSON of an earlier commit.
+
+    python bench.py --json bench.json
+    python bench.py --quick --compare bench.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from batcher import EmbedBatcher
+from embedding_cache import EmbeddingCache
+from enroll import Enroller
+from face_embed import detect, embed_aligned, embed_crops, write_crop
+from gallery_store import GalleryStore
+from image_io import decode_image
+from ledger import Ledger
+from sections import Sections
+
+# process.py (YOLO extraction) lives one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import process  # noqa: E402
+
+try:
+    import insightface.utils.face_align  # noqa: F401
+    HAVE_ALIGN = True
+except ImportError:
+    HAVE_ALIGN = False
+
+
+# ------------------------------
+# deterministic stubs
+# ------------------------------
+# 5-point ArcFace template on a 112x112 crop, used to place stub landmarks
+_TEMPLATE = np.array([[38.29, 51.70], [73.53, 51.50], [56.03, 71.74],
+                      [41.55, 92.37], [70.73, 92.20]], dtype=np.float32) / 112.0
+
+
+class StubDetector:
+    """`faces` boxes on a regular grid, like a seated class; no model cost."""
+    input_size = (640, 640)
+
+    def __init__(self, faces=10):
+        self.faces = faces
+
+    def detect(self, img, max_num=0, metric="default", input_size=None):
+        h, w = img.shape[:2]
+        n = self.faces if not max_num else min(self.faces, max_num)
+        cols = max(1, math.ceil(math.sqrt(n * w / h)))
+        rows = max(1, math.ceil(n / cols))
+        cw, ch = w / cols, h / rows
+        side = 0.6 * min(cw, ch)
+        bboxes = np.zeros((n, 5), np.float32)
+        kpss = np.zeros((n, 5, 2), np.float32)
+        for i in range(n):
+            r, c = divmod(i, cols)
+            x1, y1 = c * cw + (cw - side) / 2, r * ch + (ch - side) / 2
+            bboxes[i] = [x1, y1, x1 + side, y1 + side, 0.9 - 0.001 * i]
+            kpss[i] = _TEMPLATE * side + [x1, y1]
+        return bboxes, kpss
+
+
+class StubRecognizer:
+    """Embeddings from a fixed projection of a 4x4 thumbnail: cheap and deterministic."""
+    input_size = (112, 112)
+
+    def __init__(self, dim=512, seed=0):
+        self.proj = np.random.default_rng(seed).normal(size=(48, dim)).astype(np.float32)
+
+    def get_feat(self, crops):
+        thumbs = np.stack([cv2.resize(c, (4, 4), interpolation=cv2.INTER_AREA).reshape(-1) for c in crops])
+        return thumbs.astype(np.float32) @ self.proj
+
+
+class StubFaceApp:
+    """The parts of FaceAnalysis the code uses: det_model, models["recognition"], get()."""
+
+    def __init__(self, faces=10, dim=512):
+        self.det_model = StubDetector(faces)
+        self.models = {"detection": self.det_model, "recognition": StubRecognizer(dim)}
+
+    def get(self, img):
+        bboxes, kpss = self.det_model.detect(img)
+        crops = [img[int(b[1]):int(b[3]), int(b[0]):int(b[2])] for b in bboxes]
+        embs = self.models["recognition"].get_feat(crops) if crops else []
+        return [SimpleNamespace(bbox=b[:4], det_score=float(b[4]), kps=k, embedding=e,
+                                normed_embedding=e / np.linalg.norm(e))
+                for b, k, e in zip(bboxes, kpss, embs)]
+
+
+def crop_embed(app, img, bboxes, kpss):
+    """Aligned embeddings; without insightface, the bbox crops in one batch instead."""
+    if HAVE_ALIGN:
+        return embed_aligned(app, img, kpss)
+    return embed_crops(app, [img[int(b[1]):int(b[3]), int(b[0]):int(b[2])] for b in bboxes])
+
+
+class CropEnroller(Enroller):
+    """Enroller whose in-process embed step goes through crop_embed, so the
+    train group runs without insightface (the stub photos have one face)."""
+
+    def _embed_local(self, img):
+        started = time.perf_counter()
+        bboxes, kpss = detect(self.face_app, img)
+        return list(crop_embed(self.face_app, img, bboxes, kpss)), time.perf_counter() - started, {}
+
+
+class DeviceRecognizer:
+    """Recognition cost model for batching: `call_ms` per inference call plus
+    `crop_ms` per crop, one call at a time (ORT's intra-op threads already
+    use every core, so concurrent calls queue up rather than overlap)."""
+
+    def __init__(self, call_ms, crop_ms, dim=512):
+        self.call_ms, self.crop_ms, self.dim = call_ms, crop_ms, dim
+        self._device = threading.Lock()
+
+    def __call__(self, crops):
+        with self._device:
+            time.sleep((self.call_ms + self.crop_ms * len(crops)) / 1000.0)
+        return np.zeros((len(crops), self.dim), np.float32)
+
+
+class StubYOLO:
+    def __init__(self, faces=10):
+        self.det = StubDetector(faces)
+
+    def predict(self, image, conf=0.4, verbose=False):
+        bboxes, _ = self.det.detect(image)
+        return [SimpleNamespace(boxes=SimpleNamespace(xyxy=bboxes[:, :4]))]
+
+
+# ------------------------------
+# helpers
+# ------------------------------
+def synthetic_photo(width, height, seed=0):
+    """Smooth pattern plus mild noise, so the JPEG compresses like a real photo."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([np.sin(xx / 37.0), np.cos(yy / 23.0), np.sin((xx + yy) / 51.0)], axis=-1)
+    img = (base * 80 + 128 + rng.normal(scale=6, size=(height, width, 3))).clip(0, 255).astype(np.uint8)
+    return img, cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def timed(fn, repeats):
+    fn()  # warm up caches / page cache
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return {"median_ms": round(1000 * float(np.median(times)), 3), "min_ms": round(1000 * min(times), 3)}
+
+
+def build_store(root, rows, templates=5, dim=512, seed=0):
+    rng = np.random.default_rng(seed)
+    store = GalleryStore(root)
+    students = max(1, rows // templates)
+    started = time.perf_counter()
+    for i in range(students):
+        store.put(f"AD{i + 1:05d}", rng.normal(size=(templates, dim)).astype(np.float32), "bench", commit=False)
+    store.commit()
+    return store, time.perf_counter() - started
+
+
+# ------------------------------
+# benchmarks
+# ------------------------------
+def bench_gallery(tmp, sizes, faces_list, repeats, dim):
+    """recognize_face / Gallery.match and gallery store I/O per gallery size."""
+    out = {}
+    rng = np.random.default_rng(1)
+    for size in sizes:
+        root = os.path.join(tmp, f"gallery_{size}")
+        store, build_s = build_store(root, size, dim=dim)
+        out[f"gallery/{size}/build"] = {"median_ms": round(1000 * build_s, 3),
+                                        "rows_per_s": round(store.rows / build_s, 1)}
+        out[f"gallery/{size}/open"] = timed(lambda: GalleryStore(root).to_gallery(), repeats)
+        gallery = store.to_gallery()
+        for faces in faces_list:
+            queries = rng.normal(size=(faces, dim)).astype(np.float32)
+            out[f"match/{size}/{faces}"] = timed(lambda: gallery.match(queries), repeats)
+            out[f"match_unique/{size}/{faces}"] = timed(lambda: gallery.match(queries, unique=True), repeats)
+        shutil.rmtree(root, ignore_errors=True)
+    return out
+
+
+def bench_decode(tmp, photo, data, repeats, min_side):
+    path = os.path.join(tmp, "photo.jpg")
+    with open(path, "wb") as f:
+        f.write(data)
+    return {
+        "decode/imread_disk": timed(lambda: cv2.imread(path), repeats),
+        "decode/imdecode_full": timed(lambda: decode_image(data), repeats),
+        f"decode/imdecode_reduced_{min_side}": timed(lambda: decode_image(data, min_side), repeats),
+        "decode/save_and_imread": timed(lambda: (open(path, "wb").write(data), cv2.imread(path)), repeats),
+    }
+
+
+def bench_recognize(tmp, data, gallery_size, faces_list, repeats, min_side, dim):
+    """/recognize without Flask: decode, detect, align+embed, match, crop writes, ledger."""
+    store, _ = build_store(os.path.join(tmp, "recognize_gallery"), gallery_size, dim=dim)
+    gallery = store.to_gallery()
+    ledger = Ledger(os.path.join(tmp, "recognize.db"), Sections.load("sections.json"))
+    crops_dir = os.path.join(tmp, "crops")
+    os.makedirs(crops_dir, exist_ok=True)
+    out = {}
+    for faces in faces_list:
+        app = StubFaceApp(faces, dim)
+        stages = {k: [] for k in ("decode", "detect", "embed", "match", "crops", "ledger", "total")}
+
+        def once():
+            t0 = time.perf_counter()
+            img, _ = decode_image(data, min_side)
+            t1 = time.perf_counter()
+            bboxes, kpss = detect(app, img)
+            t2 = time.perf_counter()
+            embs = crop_embed(app, img, bboxes, kpss)
+            t3 = time.perf_counter()
+            matches = gallery.match(embs)
+            t4 = time.perf_counter()
+            for i, (bbox, kps) in enumerate(zip(bboxes, kpss)):
+                write_crop(os.path.join(crops_dir, f"face{i}.jpg"), img, bbox, kps)
+            t5 = time.perf_counter()
+            ledger.record("ALL", "bench", [(i + 1, label, score) for i, (label, score) in enumerate(matches)])
+            t6 = time.perf_counter()
+            for stage, a, b in (("decode", t0, t1), ("detect", t1, t2), ("embed", t2, t3), ("match", t3, t4),
+                                ("crops", t4, t5), ("ledger", t5, t6), ("total", t0, t6)):
+                stages[stage].append(b - a)
+
+        once()
+        for stage in stages:
+            stages[stage].clear()
+        for _ in range(repeats):
+            once()
+        for stage, times in stages.items():
+            out[f"recognize/{faces}/{stage}"] = {"median_ms": round(1000 * float(np.median(times)), 3),
+                                                 "min_ms": round(1000 * min(times), 3)}
+    return out
+
+
+def bench_train(tmp, students, images, repeats, dim):
+    """Enroller over synthetic student folders, cold and warm embedding cache."""
+    enroller = Enroller if HAVE_ALIGN else CropEnroller
+    root = os.path.join(tmp, "train")
+    todo = []
+    for s in range(students):
+        folder = os.path.join(root, f"AD{s + 1:03d}")
+        os.makedirs(folder)
+        paths = []
+        for i in range(images):
+            img, data = synthetic_photo(480, 640, seed=1000 * s + i)
+            paths.append(os.path.join(folder, f"{i}.jpg"))
+            with open(paths[-1], "wb") as f:
+                f.write(data)
+        todo.append((f"AD{s + 1:03d}", paths))
+    app = StubFaceApp(1, dim)
+    out = {}
+    stats = enroller(app, workers=0, mode="main").run(todo, lambda sid, embs: None)
+    out["train/no_cache"] = {"median_ms": round(1000 * stats["elapsed_seconds"], 3),
+                             "images_per_s": stats["images_per_second"]}
+    cache_dir = os.path.join(tmp, "emb_cache")
+    cache = EmbeddingCache(cache_dir, "stub", (640, 640), mode="main")
+    cold = enroller(app, workers=0, mode="main", cache=cache).run(todo, lambda sid, embs: None)
+    out["train/cache_cold"] = {"median_ms": round(1000 * cold["elapsed_seconds"], 3),
+                               "images_per_s": cold["images_per_second"]}
+    out["train/cache_warm"] = timed(
+        lambda: enroller(app, workers=0, mode="main", cache=cache).run(todo, lambda sid, embs: None), repeats)
+    return out
+
+
+def bench_extract(tmp, data, faces_list, repeats):
+    """process.extract_faces (YOLO worker path) from bytes, with a stub detector."""
+    out = {}
+    for faces in faces_list:
+        model = StubYOLO(faces)
+        target = os.path.join(tmp, f"extract_{faces}")
+        out[f"extract/{faces}"] = timed(lambda: process.extract_faces(model, data, target), repeats)
+    return out
+
+
+def bench_batching(concurrency_list, faces, requests_per_client, max_batch, max_wait_ms, call_ms, crop_ms):
+    """Concurrent requests embedding `faces` crops each: direct calls vs one EmbedBatcher."""
+    out = {}
+    crops = [np.zeros((112, 112, 3), np.uint8)] * faces
+    for concurrency in concurrency_list:
+        for mode in ("unbatched", "batched"):
+            recognizer = DeviceRecognizer(call_ms, crop_ms)
+            batcher = EmbedBatcher(recognizer, max_batch, max_wait_ms) if mode == "batched" else None
+            embed = batcher.embed if batcher else recognizer
+            latencies, lock = [], threading.Lock()
+
+            def client():
+                for _ in range(requests_per_client):
+                    t = time.perf_counter()
+                    embed(crops)
+                    with lock:
+                        latencies.append(time.perf_counter() - t)
+
+            threads = [threading.Thread(target=client) for _ in range(concurrency)]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+            ms = 1000 * np.array(latencies)
+            result = {"median_ms": round(float(np.percentile(ms, 50)), 3),
+                      "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                      "requests_per_s": round(len(latencies) / elapsed, 1),
+                      "faces_per_s": round(len(latencies) * faces / elapsed, 1)}
+            if batcher:
+                result["mean_batch_crops"] = batcher.stats()["mean_crops"]
+                batcher.close()
+            out[f"batching/{mode}/c{concurrency}"] = result
+    return out
+
+
+def bench_ledger(tmp, sessions, per_session, repeats):
+    ledger = Ledger(os.path.join(tmp, "ledger.db"), Sections.load("sections.json"))
+    marks = [(r, f"AD{r:03d}", 0.5) for r in range(1, per_session + 1)]
+    started = time.perf_counter()
+    for _ in range(sessions):
+        ledger.record("A", "bench", marks)
+    record_s = time.perf_counter() - started
+    rows = sessions * per_session
+    return {
+        "ledger/record": {"median_ms": round(1000 * record_s / sessions, 3),
+                          "marks_per_s": round(rows / record_s, 1)},
+        "ledger/export_csv": timed(lambda: sum(len(chunk) for chunk in ledger.export_csv()), repeats),
+        "ledger/report_csv": timed(lambda: sum(len(chunk) for chunk in ledger.report_csv()), repeats),
+        "ledger/student_summary": timed(lambda: ledger.student_summary(7), repeats),
+    }
+
+
+# ------------------------------
+# compare
+# ------------------------------
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"\n{'benchmark':<44}{'before ms':>12}{'after ms':>12}{'ratio':>8}")
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        before, after = baseline[key]["median_ms"], results[key]["median_ms"]
+        ratio = after / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance and after - before > 0.05:  # ignore sub-50us noise
+            flag = "  ⚠️ regression"
+            regressions.append(key)
+        print(f"{key:<44}{before:>12.3f}{after:>12.3f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+FULL_DEFAULTS = {"sizes": [100, 1000, 10000, 100000], "faces": [1, 10, 30, 60], "repeats": 5}
+QUICK_DEFAULTS = {"sizes": [100, 1000, 10000], "faces": [1, 30], "repeats": 3}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", help="gallery sizes in embeddings")
+    parser.add_argument("--faces", type=int, nargs="+", help="faces per photo")
+    parser.add_argument("--photo", default="4000x3000", help="synthetic photo WxH")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--repeats", type=int)
+    parser.add_argument("--min-side", type=int, default=1280, help="reduced-decode long side (DECODE_MIN_SIDE)")
+    parser.add_argument("--quick", action="store_true",
+                        help="small sweep for a fast check (only for --sizes/--faces/--repeats not given)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="concurrent requests for the batching benchmark")
+    parser.add_argument("--batch-faces", type=int, default=5, help="faces per request (batching)")
+    parser.add_argument("--max-batch", type=int, default=64, help="EMBED_BATCH")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="EMBED_BATCH_WAIT_MS")
+    parser.add_argument("--call-ms", type=float, default=6, help="modelled cost of one recognition call")
+    parser.add_argument("--crop-ms", type=float, default=1.5, help="modelled cost per crop in a call")
+    args = parser.parse_args()
+    defaults = QUICK_DEFAULTS if args.quick else FULL_DEFAULTS
+    for name, value in defaults.items():
+        if getattr(args, name) is None:  # explicit flags win over --quick
+            setattr(args, name, value)
+
+    width, height = (int(v) for v in args.photo.lower().split("x"))
+    photo, data = synthetic_photo(width, height)
+    tmp = tempfile.mkdtemp(prefix="bench_")
+    results = {}
+    try:
+        for name, run in (
+            ("gallery", lambda: bench_gallery(tmp, args.sizes, args.faces, args.repeats, args.dim)),
+            ("decode", lambda: bench_decode(tmp, photo, data, args.repeats, args.min_side)),
+            ("recognize", lambda: bench_recognize(tmp, data, 10000, args.faces, args.repeats,
+                                                  args.min_side, args.dim)),
+            ("train", lambda: bench_train(tmp, 10 if args.quick else 40, 5, args.repeats, args.dim)),
+            ("extract", lambda: bench_extract(tmp, data, args.faces, args.repeats)),
+            ("ledger", lambda: bench_ledger(tmp, 200 if args.quick else 2000, 60, args.repeats)),
+            ("batching", lambda: bench_batching(args.concurrency, args.batch_faces, 10 if args.quick else 40,
+                                                args.max_batch, args.max_wait_ms, args.call_ms, args.crop_ms)),
+        ):
+            started = time.perf_counter()
+            part = run()
+            results.update(part)
+            print(f"✅ {name}: {len(part)} results in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"{'benchmark':<44}{'median ms':>12}{'min ms':>12}")
+    for key in sorted(results):
+        r = results[key]
+        print(f"{key:<44}{r['median_ms']:>12.3f}{r.get('min_ms', r['median_ms']):>12.3f}")
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    meta = {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "opencv": cv2.__version__, "cpus": os.cpu_count(), "aligned_embedding": HAVE_ALIGN,
+            "args": vars(args)}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n⚠️ {len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Recall vs latency of the IVF / IVF-PQ index against exact search.
+
+Builds a synthetic gallery shaped like enrolled students (several noisy
+templates around one identity vector each), queries it with fresh noisy
+samples, and reports top-1 agreement with exact search plus per-photo
+latency for a sweep of nprobe values.
+
+    python bench_ann.py --students 20000 --templates 5 --faces 60
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex, default_nlist
+from gallery_store import GalleryStore
+
+
+def synthetic_store(root, students, templates, dim, noise, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(students, dim)).astype(np.float32)
+    store = GalleryStore(root)
+    for i in range(students):
+        embs = centers[i] + noise * rng.normal(size=(templates, dim)).astype(np.float32)
+        store.put(f"S{i:06d}", embs, commit=False)
+    store.commit()
+    return store, centers
+
+
+def timed_match(gallery, queries, repeats):
+    gallery.match(queries)  # warm up page cache
+    started = time.perf_counter()
+    for _ in range(repeats):
+        labels = [label for label, _ in gallery.match(queries, threshold=-1.0)]
+    return labels, (time.perf_counter() - started) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--templates", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--faces", type=int, default=60, help="queries per photo")
+    parser.add_argument("--noise", type=float, default=0.6)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--kinds", nargs="+", default=["ivf", "ivfpq"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench_ann_")
+    try:
+        store, centers = synthetic_store(root, args.students, args.templates,
+                                         args.dim, args.noise, args.seed)
+        rng = np.random.default_rng(args.seed + 1)
+        who = rng.choice(args.students, args.faces, replace=False)
+        queries = centers[who] + args.noise * rng.normal(size=(args.faces, args.dim)).astype(np.float32)
+
+        gallery = store.to_gallery()
+        exact_labels, exact_s = timed_match(gallery, queries, args.repeats)
+        rows = [{"kind": "exact", "nprobe": None, "recall": 1.0,
+                 "ms_per_photo": round(exact_s * 1000, 3), "build_s": 0.0}]
+        print(f"{store.rows} embeddings, {args.students} students, nlist={default_nlist(store.rows)}")
+        print(f"{'kind':<7}{'nprobe':>7}{'recall@1':>10}{'ms/photo':>11}{'speedup':>9}")
+        print(f"{'exact':<7}{'-':>7}{1.0:>10.3f}{exact_s * 1000:>11.2f}{1.0:>9.1f}")
+
+        live = np.arange(store.rows)
+        for kind in args.kinds:
+            started = time.perf_counter()
+            index = IVFIndex.build(store.matrix(), live, kind=kind)
+            build_s = time.perf_counter() - started
+            for nprobe in args.nprobe:
+                index.nprobe = nprobe
+                gallery.index = index
+                labels, secs = timed_match(gallery, queries, args.repeats)
+                recall = float(np.mean([a == b for a, b in zip(labels, exact_labels)]))
+                rows.append({"kind": kind, "nprobe": nprobe, "recall": round(recall, 4),
+                             "ms_per_photo": round(secs * 1000, 3), "build_s": round(build_s, 2)})
+                print(f"{kind:<7}{nprobe:>7}{recall:>10.3f}{secs * 1000:>11.2f}{exact_s / secs:>9.1f}")
+            gallery.index = None
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "results": rows}, f, indent=2)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Memory and recognize_face decisions of float16 / int8 gallery scans vs float32.
+
+Embeds the main face of every train/ image (through the embedding cache,
+so a second run doesn't touch the model), matches each one against the
+existing gallery/ shards exactly as recognize_face does, once per codec
+and rerank width, and counts decisions (label at the threshold) that
+differ from the float32 scan. Nothing under gallery/ is written.
+
+    python bench_codec.py                                   # train/ against gallery/
+    python bench_codec.py --rerank 0 16 64 --json codec.json
+    python bench_codec.py --synthetic 20000                 # no model: synthetic students
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from gallery_codec import CODECS, CoarseRows
+from gallery_store import INDEX_FILE, GalleryStore
+from matcher import Gallery, MultiGallery
+from sections import Sections
+
+DB_FOLDER = "train"
+GALLERY_DIR = "gallery"
+EMB_CACHE_DIR = "emb_cache"
+SECTIONS_FILE = "sections.json"
+MODEL_NAME = "buffalo_l"
+DET_SIZE = (640, 640)
+
+
+def train_queries(folder):
+    """(embeddings, student of each) for the main face of every image under `folder`."""
+    from embedding_cache import EmbeddingCache
+    from enroll import Enroller, list_images
+    from face_model import FACE_INT8, load_face_app, pack_name
+
+    todo = [(sid, list_images(os.path.join(folder, sid))) for sid in sorted(os.listdir(folder))
+            if os.path.isdir(os.path.join(folder, sid))]
+    cache = EmbeddingCache(EMB_CACHE_DIR, pack_name(MODEL_NAME, FACE_INT8), DET_SIZE, mode="main")
+    enroller = Enroller(load_face_app(MODEL_NAME, det_size=DET_SIZE), mode="main",
+                        model_name=MODEL_NAME, det_size=DET_SIZE, cache=cache)
+    embs, truth = [], []
+
+    def on_student(student_id, student_embeddings):
+        embs.extend(student_embeddings)
+        truth.extend([student_id] * len(student_embeddings))
+
+    stats = enroller.run(todo, on_student)
+    print(f"✅ {len(embs)} faces from {stats['images_total']} images (cache {stats['cache']})")
+    return np.asarray(embs, dtype=np.float32).reshape(len(embs), -1), truth
+
+
+def gallery_stores(root, sections):
+    stores = [GalleryStore(os.path.join(root, name)) for name in sections.names
+              if os.path.exists(os.path.join(root, name, INDEX_FILE))]
+    return [store for store in stores if len(store)]
+
+
+def synthetic(students, templates, dim, noise, queries, seed):
+    """In-memory store-like galleries and queries shaped like bench_ann's."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(students, dim)).astype(np.float32)
+    db = {f"S{i:06d}": list(centers[i] + noise * rng.normal(size=(templates, dim)).astype(np.float32))
+          for i in range(students)}
+    who = rng.choice(students, queries)
+    embs = centers[who] + noise * rng.normal(size=(queries, dim)).astype(np.float32)
+    return [Gallery.from_db(db)], embs, [f"S{i:06d}" for i in who]
+
+
+def run(galleries, queries, threshold, faces, repeats):
+    """recognize_face over every query, plus per-photo latency of `faces` queries at a time."""
+    multi = MultiGallery(galleries)
+    # per face this is recognize_face's answer; photo-sized batches only share the scan
+    results = [r for i in range(0, len(queries), faces) for r in multi.match(queries[i:i + faces], threshold)]
+    photo = queries[:faces]
+    multi.match(photo, threshold)  # warm up page cache
+    started = time.perf_counter()
+    for _ in range(repeats):
+        multi.match(photo, threshold)
+    return results, 1000 * (time.perf_counter() - started) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS[1:]), choices=CODECS[1:])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 64],
+                        help="rows per face re-scored in float32 (0 = coarse scores only)")
+    parser.add_argument("--threshold", type=float, default=0.35, help="recognize_face's threshold")
+    parser.add_argument("--faces", type=int, default=60, help="queries per photo, for latency")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--train", default=DB_FOLDER)
+    parser.add_argument("--gallery", default=GALLERY_DIR)
+    parser.add_argument("--synthetic", type=int, metavar="STUDENTS",
+                        help="synthetic gallery of this many students instead of train/ + gallery/")
+    parser.add_argument("--templates", type=int, default=5, help="--synthetic: rows per student")
+    parser.add_argument("--json", help="also write the rows to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        galleries, queries, truth = synthetic(args.synthetic, args.templates, 512, 0.6, 1000, 0)
+    else:
+        galleries = [store.to_gallery() for store in gallery_stores(args.gallery, Sections.load(SECTIONS_FILE))]
+        if not galleries:
+            raise SystemExit(f"No gallery under {args.gallery}; run /train first")
+        queries, truth = train_queries(args.train)
+    if not len(queries):
+        raise SystemExit("No faces to match")
+
+    f32_bytes = sum(g.matrix.nbytes for g in galleries)
+    reference, f32_ms = run(galleries, queries, args.threshold, args.faces, args.repeats)
+    rows = [{"codec": "float32", "rerank": None, "gallery_mb": round(f32_bytes / 1e6, 2), "saved_pct": 0.0,
+             "ms_per_photo": round(f32_ms, 2), "changed": 0, "max_score_drift": 0.0,
+             "top1": round(float(np.mean([label == t for (label, _), t in zip(reference, truth)])), 4)}]
+    for codec in args.codecs:
+        for g in galleries:
+            g.coarse = CoarseRows.from_matrix(g.matrix, codec)
+        coarse_bytes = sum(g.coarse.nbytes for g in galleries)
+        for rerank in args.rerank:
+            for g in galleries:
+                g.rerank = rerank
+            results, ms = run(galleries, queries, args.threshold, args.faces, args.repeats)
+            rows.append({"codec": codec, "rerank": rerank, "gallery_mb": round(coarse_bytes / 1e6, 2),
+                         "saved_pct": round(100 * (1 - coarse_bytes / f32_bytes), 1),
+                         "ms_per_photo": round(ms, 2),
+                         "changed": sum(a[0] != b[0] for a, b in zip(results, reference)),
+                         "max_score_drift": round(max(abs(a[1] - b[1]) for a, b in zip(results, reference)), 5),
+                         "top1": round(float(np.mean([label == t for (label, _), t in zip(results, truth)])), 4)})
+        for g in galleries:
+            g.coarse = None
+
+    print(f"{sum(g.size for g in galleries)} gallery embeddings, {len(queries)} queries, "
+          f"threshold {args.threshold}")
+    cols = ["codec", "rerank", "gallery_mb", "saved_pct", "ms_per_photo", "changed", "max_score_drift", "top1"]
+    print("".join(f"{c:>16}" for c in cols))
+    for row in rows:
+        print("".join(f"{str(row[c]):>16}" for c in cols))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Gallery size, match latency and top-1 accuracy across template counts K.
+
+Each student is enrolled from many embeddings spread over a few "modes"
+(lighting, pose, glasses), with uneven photo counts per mode; queries are
+fresh samples from the same modes, plus faces of people who were never
+enrolled (they should come back "Unknown"). Every K value compacts the
+enrollment embeddings with templates.select_templates and matches the
+same queries. K=0 is the uncompacted gallery.
+
+    python bench_templates.py --students 2000 --photos 30 --k 0 1 3 5 8
+    python bench_templates.py --gallery gallery/A     # hold out rows of a real gallery instead
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from gallery_store import GalleryStore
+from matcher import Gallery
+from templates import METHODS, select_templates
+
+
+def synthetic_students(students, photos, modes, dim, spread, noise, queries, strangers, seed):
+    """({student: enrollment embeddings}, query embeddings, true label of each query).
+
+    The last `strangers` identities are not enrolled; their queries are labelled "Unknown".
+    """
+    rng = np.random.default_rng(seed)
+    enrolled, query_embs, truth = {}, [], []
+    for i in range(students + strangers):
+        sid = f"S{i:06d}"
+        center = rng.normal(size=dim)
+        mode_centers = center + spread * rng.normal(size=(modes, dim))
+        q_modes = rng.choice(modes, queries)  # recognition photos hit every mode evenly
+        query_embs.append(mode_centers[q_modes] + noise * rng.normal(size=(queries, dim)))
+        if i >= students:
+            truth += ["Unknown"] * queries
+            continue
+        weights = rng.dirichlet(np.ones(modes))  # a few photos in some modes, many in others
+        which = rng.choice(modes, photos, p=weights)
+        enrolled[sid] = (mode_centers[which] + noise * rng.normal(size=(photos, dim))).astype(np.float32)
+        truth += [sid] * queries
+    return enrolled, np.vstack(query_embs).astype(np.float32), truth
+
+
+def held_out_students(root, holdout, seed):
+    """Queries from a GalleryStore: 1 in `holdout` rows of each student with 2+ rows, and
+    every row of 1 in `holdout` students, who are left out of enrollment as strangers."""
+    store = GalleryStore(root)
+    rng = np.random.default_rng(seed)
+    enrolled, query_embs, truth = {}, [], []
+    for i, sid in enumerate(sorted(store.students)):
+        embs = store.get(sid)
+        if i % holdout == holdout - 1:
+            query_embs.append(embs)
+            truth += ["Unknown"] * len(embs)
+            continue
+        if len(embs) < 2:
+            enrolled[sid] = embs
+            continue
+        is_query = np.zeros(len(embs), dtype=bool)
+        is_query[rng.permutation(len(embs))[:max(1, len(embs) // holdout)]] = True
+        enrolled[sid] = embs[~is_query]
+        query_embs.append(embs[is_query])
+        truth += [sid] * int(is_query.sum())
+    if not query_embs:
+        raise SystemExit(f"No student in {root} has 2+ embeddings to hold out")
+    return enrolled, np.vstack(query_embs), truth
+
+
+def evaluate(enrolled, queries, truth, k, method, faces, threshold, repeats):
+    started = time.perf_counter()
+    db = {sid: list(select_templates(embs, k, method)) for sid, embs in enrolled.items()}
+    compact_s = time.perf_counter() - started
+    gallery = Gallery.from_db(db)
+
+    truth = np.array(truth)
+    known = truth != "Unknown"
+    labels = np.array([label for label, _ in gallery.match(queries, threshold=-1.0)])
+    top1 = float(np.mean(labels[known] == truth[known]))
+    # at the serving threshold: enrolled faces must get their own name, strangers "Unknown"
+    accepted = np.array([label for label, _ in gallery.match(queries, threshold=threshold)])
+    top1_thr = float(np.mean(accepted[known] == truth[known]))
+    false_accept = float(np.mean(accepted[~known] != "Unknown")) if (~known).any() else None
+
+    photos = [queries[i:i + faces] for i in range(0, len(queries), faces)][:20]
+    gallery.match(photos[0])  # warm up
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for photo in photos:
+            gallery.match(photo, threshold)
+    ms = 1000 * (time.perf_counter() - started) / (repeats * len(photos))
+    rows = gallery.matrix.shape[0]
+    return {"k": k, "method": method, "rows": rows, "rows_per_student": round(rows / len(db), 2),
+            "gallery_mb": round(gallery.matrix.nbytes / 1e6, 2), "compact_s": round(compact_s, 2),
+            "ms_per_photo": round(ms, 3), "top1": round(top1, 4), "top1_at_threshold": round(top1_thr, 4),
+            "false_accept": None if false_accept is None else round(false_accept, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=int, nargs="+", default=[0, 1, 2, 3, 5, 8])
+    parser.add_argument("--methods", nargs="+", default=list(METHODS), choices=METHODS)
+    parser.add_argument("--gallery", help="GalleryStore directory to hold queries out of (default: synthetic)")
+    parser.add_argument("--holdout", type=int, default=5, help="--gallery: 1 in this many rows is a query")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--photos", type=int, default=30, help="enrollment embeddings per student")
+    parser.add_argument("--modes", type=int, default=4, help="appearance modes per student")
+    parser.add_argument("--queries", type=int, default=2, help="queries per student")
+    parser.add_argument("--strangers", type=int, default=200, help="identities queried but never enrolled")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--spread", type=float, default=1.5, help="mode offset from the identity")
+    parser.add_argument("--noise", type=float, default=2.0, help="per-photo noise around a mode")
+    parser.add_argument("--faces", type=int, default=60, help="queries per photo, for latency")
+    parser.add_argument("--threshold", type=float, default=0.35)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.gallery:
+        enrolled, queries, truth = held_out_students(args.gallery, args.holdout, args.seed)
+    else:
+        enrolled, queries, truth = synthetic_students(args.students, args.photos, args.modes, args.dim,
+                                                      args.spread, args.noise, args.queries, args.strangers,
+                                                      args.seed)
+    print(f"{len(enrolled)} students, {sum(len(e) for e in enrolled.values())} enrollment embeddings, "
+          f"{len(queries)} queries ({truth.count('Unknown')} of strangers)")
+
+    cols = ["k", "method", "rows", "gallery_mb", "compact_s", "ms_per_photo", "top1", "top1_at_threshold",
+            "false_accept"]
+    print("".join(f"{c:>18}" for c in cols))
+    rows = []
+    for method in args.methods:
+        for k in args.k:
+            if k == 0 and method != args.methods[0]:
+                continue  # uncompacted is the same for every method
+            row = evaluate(enrolled, queries, truth, k, method, args.faces, args.threshold, args.repeats)
+            if k == 0:
+                row["method"] = "all"
+            rows.append(row)
+            print("".join(f"{str(row[c]):>18}" for c in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import hashlib
+import os
+
+import numpy as np
+
+# ------------------------------
+# PER-IMAGE EMBEDDING CACHE
+# ------------------------------
+# Entries are keyed by the image bytes plus everything that changes the
+# result (model, det_size, face selection mode, quality gate), so renames,
+# copies and reset mtimes still hit, and the same photo in two folders is
+# one entry.
+# <root>/<key[:2]>/<key>.npy holds a (faces, dim) float32 array; images
+# with no face are cached as an empty array.
+
+class EmbeddingCache:
+    def __init__(self, root, model_name, det_size, mode="all", extra=""):
+        self.root = root
+        self.salt = f"{model_name}|{det_size[0]}x{det_size[1]}|{mode}".encode()
+        if extra:  # e.g. QualityGate.signature(); empty keeps keys of older entries valid
+            self.salt += f"|{extra}".encode()
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, data: bytes) -> str:
+        h = hashlib.sha1(data)
+        h.update(self.salt)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + ".npy")
+
+    def get(self, key):
+        """Cached embeddings as a list, or None on a miss."""
+        try:
+            return list(np.load(self._path(key)))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, embeddings):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if len(embeddings):
+            arr = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        else:
+            arr = np.zeros((0, 0), dtype=np.float32)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Could not write embedding cache entry {key} ({e})")
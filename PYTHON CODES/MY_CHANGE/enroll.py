@@ -0,0 +1,334 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+import numpy as np
+
+from face_embed import detect, embed_aligned
+
+# ------------------------------
+# PARALLEL ENROLLMENT PIPELINE
+# ------------------------------
+# decode (thread pool) -> detect + embed (worker processes, one model each)
+# -> per-student callback as soon as all of that student's images are done.
+#
+# Students are only handed to `on_student` once complete, and nothing is
+# handed over after cancel(), so a cancelled run never leaves a student
+# half-written in the gallery.
+
+def pick_main_face(faces):
+    """Pick face with best combination of detection score and area."""
+    if not faces:
+        return None
+    def score(f):
+        x1, y1, x2, y2 = f.bbox
+        area = max(0, (x2-x1)) * max(0, (y2-y1))
+        return (getattr(f, "det_score", 0.0), area)
+    return max(faces, key=score)
+
+
+def embed_image(face_app, img, mode, gate=None):
+    """Detect, drop faces failing `gate`, embed the ones `mode` keeps: 'all'
+    every face (hi5), 'main' the best by det_score then area (hi4_buffalo,
+    as pick_main_face). Returns (unit embeddings, {skip reason: count})."""
+    bboxes, kpss = detect(face_app, img)
+    skipped = {}
+    if gate is not None:
+        keep, skipped = gate.filter(img, bboxes, kpss)
+        bboxes, kpss = bboxes[keep], kpss[keep]
+    if mode == "main" and len(bboxes) > 1:
+        areas = np.maximum(0, bboxes[:, 2] - bboxes[:, 0]) * np.maximum(0, bboxes[:, 3] - bboxes[:, 1])
+        best = max(range(len(bboxes)), key=lambda i: (bboxes[i, 4], areas[i]))
+        kpss = kpss[best:best + 1]
+    return list(embed_aligned(face_app, img, kpss)), skipped
+
+
+# ------------------------------
+# worker process side
+# ------------------------------
+_worker_app = None
+_worker_gate = None
+
+def _init_worker(model_name, det_size, gate):
+    global _worker_app, _worker_gate
+    from face_model import load_face_app  # same FACE_PROFILE / FACE_INT8 / ORT_THREADS as the parent
+    _worker_app = load_face_app(model_name, det_size=det_size)
+    _worker_gate = gate
+
+def _embed_in_worker(img, mode):
+    started = time.perf_counter()
+    embs, skipped = embed_image(_worker_app, img, mode, _worker_gate)
+    return embs, time.perf_counter() - started, skipped
+
+
+def _mp_context():
+    # forkserver/spawn children start clean instead of inheriting the
+    # parent's loaded ONNX sessions and server threads; don't preload
+    # __main__ (hi5 / hi4_buffalo do real work at import time)
+    methods = multiprocessing.get_all_start_methods()
+    if "forkserver" in methods:
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["enroll"])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+
+# ------------------------------
+# parent side
+# ------------------------------
+class EnrollStats:
+    def __init__(self, students_total, images_total):
+        self.started = time.perf_counter()
+        self.students_total = students_total
+        self.images_total = images_total
+        self.students_done = 0
+        self.images_decoded = 0
+        self.images_done = 0
+        self.images_embedded = 0
+        self.decode_failed = 0
+        self.faces = 0
+        self.decode_seconds = 0.0
+        self.embed_seconds = 0.0
+        self.cancelled = False
+        self.cache = {"hits": 0, "misses": 0, "shared": 0}
+        self.quality_skipped = {}
+        self._lock = threading.Lock()
+
+    def add_cache(self, outcome):
+        with self._lock:
+            self.cache[outcome] += 1
+
+    def add_decode(self, seconds, ok):
+        with self._lock:
+            self.decode_seconds += seconds
+            if ok:
+                self.images_decoded += 1
+            else:
+                self.decode_failed += 1
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        def rate(n, s):
+            return round(n / s, 2) if s > 0 else None
+        return {
+            "students_done": self.students_done,
+            "students_total": self.students_total,
+            "images_done": self.images_done,
+            "images_embedded": self.images_embedded,
+            "images_total": self.images_total,
+            "decode_failed": self.decode_failed,
+            "faces": self.faces,
+            "cancelled": self.cancelled,
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": rate(self.images_done, elapsed),
+            "decode": {"busy_seconds": round(self.decode_seconds, 3),
+                       "images_per_busy_second": rate(self.images_decoded, self.decode_seconds)},
+            "embed": {"busy_seconds": round(self.embed_seconds, 3),
+                      "images_per_busy_second": rate(self.images_embedded, self.embed_seconds)},
+            "cache": dict(self.cache),
+            "quality_skipped": dict(self.quality_skipped),
+        }
+
+
+class Enroller:
+    """Runs detection + embedding for many student folders in parallel.
+
+    workers=0 embeds in-process with `face_app`; workers>0 starts that many
+    processes, each loading its own `model_name` model. Faces failing
+    `gate` (a quality.QualityGate) are skipped before embedding; a cache
+    should then be built with extra=gate.signature().
+    """
+
+    def __init__(self, face_app=None, workers=0, decode_threads=4, mode="all",
+                 model_name="buffalo_l", det_size=(640, 640), max_inflight=None,
+                 cache=None, gate=None):
+        if workers <= 0 and face_app is None:
+            raise ValueError("face_app is required when workers=0")
+        self.face_app = face_app
+        self.workers = workers
+        self.decode_threads = decode_threads
+        self.mode = mode
+        self.model_name = model_name
+        self.det_size = det_size
+        self.max_inflight = max_inflight or max(8, 4 * max(workers, 1))
+        self.cache = cache
+        self.gate = gate
+        self._cancel = threading.Event()
+        self._by_key = {}
+        self._by_key_lock = threading.Lock()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def _decode(self, path, stats):
+        """Returns ("cache", embs), ("shared", key_future) or ("img", img, key_future)."""
+        started = time.perf_counter()
+        key_future = None
+        if self.cache is not None:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = b""
+            key = self.cache.key(data)
+            embs = self.cache.get(key)
+            if embs is not None:
+                stats.add_cache("hits")
+                return ("cache", embs)
+            with self._by_key_lock:
+                key_future = self._by_key.get(key)
+                if key_future is not None:
+                    # identical photo already queued (e.g. shared between folders)
+                    stats.add_cache("shared")
+                    return ("shared", key_future)
+                key_future = self._by_key[key] = Future()
+                key_future.key = key
+            stats.add_cache("misses")
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+        else:
+            img = cv2.imread(path)
+        stats.add_decode(time.perf_counter() - started, img is not None)
+        if img is None and key_future is not None:
+            key_future.set_result(None)
+        return ("img", img, key_future)
+
+    def _embed_local(self, img):
+        started = time.perf_counter()
+        embs, skipped = embed_image(self.face_app, img, self.mode, self.gate)
+        return embs, time.perf_counter() - started, skipped
+
+    def run(self, students, on_student, progress=None):
+        """Enroll `students` = [(student_id, [image paths]), ...].
+
+        Calls `on_student(student_id, embeddings)` from this thread as each
+        student completes (embeddings may be empty if no face was found)
+        and `progress(stats_dict)` after each student. Returns the final
+        stats dict.
+        """
+        self._cancel.clear()
+        self._by_key = {}
+        stats = EnrollStats(len(students), sum(len(p) for _, p in students))
+
+        decode_pool = ThreadPoolExecutor(self.decode_threads)
+        if self.workers > 0:
+            embed_pool = ProcessPoolExecutor(self.workers, mp_context=_mp_context(),
+                                             initializer=_init_worker,
+                                             initargs=(self.model_name, self.det_size, self.gate))
+            embed_call = lambda img: embed_pool.submit(_embed_in_worker, img, self.mode)
+        else:
+            # one model instance; calls into it are serialised on one thread
+            embed_pool = ThreadPoolExecutor(1)
+            embed_call = lambda img: embed_pool.submit(self._embed_local, img)
+
+        remaining = {sid: len(paths) for sid, paths in students}
+        results = {sid: [None] * len(paths) for sid, paths in students}
+        inflight = set()
+
+        def chain(sid, idx, path):
+            # resolves to None (unreadable) or (embs, embed_seconds, source, skipped)
+            done = Future()
+            done.sid, done.idx = sid, idx
+
+            def after_embed(ef, key_future):
+                if ef.exception() is not None:
+                    if key_future is not None:
+                        key_future.set_result(None)
+                    done.set_exception(ef.exception())
+                    return
+                embs, seconds, skipped = ef.result()
+                if key_future is not None:
+                    self.cache.put(key_future.key, embs)
+                    key_future.set_result(embs)
+                done.set_result((embs, seconds, "embedded", skipped))
+
+            def after_decode(dec):
+                if dec.exception() is not None:
+                    done.set_exception(dec.exception())
+                    return
+                kind = dec.result()
+                if kind[0] == "cache":
+                    done.set_result((kind[1], 0.0, "cache", {}))
+                    return
+                if kind[0] == "shared":
+                    kind[1].add_done_callback(
+                        lambda kf: done.set_result(None if kf.result() is None
+                                                   else (kf.result(), 0.0, "shared", {})))
+                    return
+                _, img, key_future = kind
+                if img is None or self._cancel.is_set():
+                    if key_future is not None and not key_future.done():
+                        key_future.set_result(None)
+                    done.set_result(None)
+                    return
+                try:
+                    emb_future = embed_call(img)
+                except RuntimeError as e:  # pool already shut down by cancel
+                    done.set_exception(e)
+                    return
+                emb_future.add_done_callback(lambda ef: after_embed(ef, key_future))
+
+            decode_pool.submit(self._decode, path, stats).add_done_callback(after_decode)
+            return done
+
+        def finish(fut):
+            sid = fut.sid
+            embs = []
+            if fut.exception() is not None:
+                if not self._cancel.is_set():
+                    print(f"⚠️ Embedding failed for an image of {sid}: {fut.exception()}")
+            elif fut.result() is not None:
+                embs, seconds, source, skipped = fut.result()
+                if source == "embedded":
+                    stats.embed_seconds += seconds
+                    stats.images_embedded += 1
+                for reason, n in skipped.items():
+                    stats.quality_skipped[reason] = stats.quality_skipped.get(reason, 0) + n
+                stats.faces += len(embs)
+            stats.images_done += 1
+            results[sid][fut.idx] = embs
+            remaining[sid] -= 1
+            if remaining[sid] == 0 and not self._cancel.is_set():
+                embeddings = [e for per_img in results.pop(sid) for e in per_img]
+                on_student(sid, embeddings)
+                stats.students_done += 1
+                if progress:
+                    progress(stats.as_dict())
+
+        try:
+            for sid, paths in students:
+                if not paths and not self._cancel.is_set():
+                    on_student(sid, [])
+                    stats.students_done += 1
+                for idx, path in enumerate(paths):
+                    while len(inflight) >= self.max_inflight:
+                        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            inflight.discard(fut)
+                            finish(fut)
+                    if self._cancel.is_set():
+                        break
+                    inflight.add(chain(sid, idx, path))
+                if self._cancel.is_set():
+                    break
+            while inflight and not self._cancel.is_set():
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    inflight.discard(fut)
+                    finish(fut)
+        finally:
+            stats.cancelled = self._cancel.is_set()
+            decode_pool.shutdown(wait=not stats.cancelled, cancel_futures=True)
+            embed_pool.shutdown(wait=not stats.cancelled, cancel_futures=True)
+        return stats.as_dict()
+
+
+def list_images(student_path):
+    return [os.path.join(student_path, name) for name in sorted(os.listdir(student_path))
+            if os.path.isfile(os.path.join(student_path, name))]
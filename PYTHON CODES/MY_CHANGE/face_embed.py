@@ -0,0 +1,137 @@
+import json
+
+import cv2
+import numpy as np
+
+from matcher import normalize_rows
+
+# ------------------------------
+# DETECT ONCE, EMBED FROM LANDMARKS
+# ------------------------------
+# FaceAnalysis.get runs every loaded model (detector, 2d/3d landmarks,
+# gender/age, recognition) on each call. Recognition only needs the
+# detector's 5-point landmarks: align with norm_crop and run the ArcFace
+# model alone, batched over all faces of a photo.
+#
+# Crops written with write_crop() get a "<crop>.kps.json" sidecar holding
+# those landmarks in crop coordinates, so a crop can be embedded later
+# without another detector pass.
+KPS_SUFFIX = ".kps.json"
+
+
+def detect(face_app, img, max_num=0, tiler=None, stats=None):
+    """Detector only: (bboxes (n, 5) with det_score last, kpss (n, 5, 2)).
+
+    With a tiling.TiledDetector the image is detected tile by tile and its
+    tile stats are copied into `stats` when given.
+    """
+    if tiler is not None:
+        bboxes, kpss, tile_stats = tiler.detect(img)
+        if stats is not None:
+            stats.update(tile_stats)
+        if max_num and bboxes.shape[0] > max_num:
+            top = np.argsort(-bboxes[:, 4])[:max_num]
+            bboxes, kpss = bboxes[top], kpss[top]
+        return bboxes, kpss
+    bboxes, kpss = face_app.det_model.detect(img, max_num=max_num, metric="default")
+    if kpss is None:
+        kpss = np.zeros((bboxes.shape[0], 5, 2), dtype=np.float32)
+    return bboxes, kpss
+
+
+def align(face_app, img, kpss):
+    """ArcFace-aligned crops (112x112) for faces given by their 5-point landmarks."""
+    # imported here so the crop / sidecar helpers work without insightface (bench.py)
+    from insightface.utils import face_align
+    size = face_app.models["recognition"].input_size[0]
+    return [face_align.norm_crop(img, landmark=np.asarray(kps, dtype=np.float32), image_size=size)
+            for kps in kpss]
+
+
+def embed_aligned(face_app, img, kpss):
+    """Unit embeddings for faces given by their 5-point landmarks, (n, dim)."""
+    return embed_crops(face_app, align(face_app, img, kpss))
+
+
+def embed_crops(face_app, aligned):
+    """One batched recognition call over already aligned crops, (n, dim)."""
+    if len(aligned) == 0:
+        return np.zeros((0, 512), dtype=np.float32)
+    return normalize_rows(face_app.models["recognition"].get_feat(aligned))
+
+
+def detect_and_embed(face_app, img, max_num=0, tiler=None, stats=None):
+    """One detector pass plus one batched recognition pass: (bboxes, kpss, embeddings)."""
+    bboxes, kpss = detect(face_app, img, max_num=max_num, tiler=tiler, stats=stats)
+    return bboxes, kpss, embed_aligned(face_app, img, kpss)
+
+
+def detect_and_embed_many(face_app, imgs, executor=None, tiler=None, stats=None, embed=None, select=None):
+    """detect_and_embed over several photos: detection runs per photo (in
+    parallel on `executor`), recognition runs once over every face found.
+
+    Returns [(bboxes, kpss, embeddings), ...] in the order of `imgs`; with
+    a tiler, `stats` (a list) receives each photo's tile stats. The tiler
+    must not use `executor` itself, or tiles would wait on their own pool.
+    `embed(aligned_crops)` replaces the direct recognition call (e.g. a
+    batcher.EmbedBatcher's embed). `select(img, bboxes, kpss)` returns
+    the (bboxes, kpss, info) to keep before alignment (e.g. a quality
+    gate); its info lands in the photo's stats under "quality".
+    """
+    def detect_one(img):
+        photo_stats = {}
+        bboxes, kpss = detect(face_app, img, tiler=tiler, stats=photo_stats)
+        if select is not None:
+            bboxes, kpss, photo_stats["quality"] = select(img, bboxes, kpss)
+        return bboxes, kpss, align(face_app, img, kpss), photo_stats
+
+    dets = list(executor.map(detect_one, imgs) if executor else map(detect_one, imgs))
+    crops = [crop for _, _, photo_crops, _ in dets for crop in photo_crops]
+    embs = embed(crops) if embed is not None else embed_crops(face_app, crops)
+    out, start = [], 0
+    for bboxes, kpss, crops, photo_stats in dets:
+        out.append((bboxes, kpss, embs[start:start + len(crops)]))
+        start += len(crops)
+        if stats is not None and (tiler is not None or select is not None):
+            stats.append(photo_stats)
+    return out
+
+
+# ------------------------------
+# crops + landmark sidecars
+# ------------------------------
+def write_crop(path, img, bbox, kps, size=(160, 160)):
+    """Save the bbox crop resized to `size` and its landmarks next to it; False if empty."""
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = (int(v) for v in bbox[:4])
+    x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+    crop = img[y1:y2, x1:x2]
+    if crop.size == 0:
+        return False
+    cv2.imwrite(path, cv2.resize(crop, size))
+    scale = np.array([size[0] / (x2 - x1), size[1] / (y2 - y1)], dtype=np.float32)
+    crop_kps = (np.asarray(kps, dtype=np.float32) - [x1, y1]) * scale
+    with open(path + KPS_SUFFIX, "w") as f:
+        json.dump({"kps": crop_kps.round(2).tolist(), "det_score": float(bbox[4]) if len(bbox) > 4 else None}, f)
+    return True
+
+
+def read_crop_landmarks(path):
+    """Landmarks saved by write_crop(), or None if the crop has no sidecar."""
+    try:
+        with open(path + KPS_SUFFIX) as f:
+            return np.array(json.load(f)["kps"], dtype=np.float32)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def is_sidecar(name):
+    return name.endswith(KPS_SUFFIX)
+
+
+def embed_crop(face_app, img, path):
+    """Embedding of a saved crop from its sidecar landmarks, or None if it has none."""
+    kps = read_crop_landmarks(path)
+    if kps is None:
+        return None
+    return embed_aligned(face_app, img, [kps])[0]
@@ -0,0 +1,264 @@
+"""Load the InsightFace pack with only the models this project uses.
+
+    python face_model.py quantize                       # build buffalo_l_int8 next to buffalo_l
+    python face_model.py report --image train/AD001/1.jpg --configs full slim slim-int8
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# ------------------------------
+# INFERENCE PROFILES
+# ------------------------------
+# FaceAnalysis(name=...) opens every model in the pack (detector, 2d/3d
+# landmarks, gender/age, ArcFace) and get() runs all of them per face.
+# Attendance only needs the detector and ArcFace, so the "slim" profile
+# opens just those two, with explicit ONNX Runtime session options.
+# quantized=True loads "<pack>_int8", built once by `quantize`; that pack
+# only holds the detector and ArcFace, so it is slim-only.
+PROFILES = {
+    "full": None,  # every model in the pack, like FaceAnalysis(name=...)
+    "slim": ("detection", "recognition"),
+}
+MODEL_NAME = "buffalo_l"
+MODEL_ROOT = os.path.expanduser(os.environ.get("INSIGHTFACE_ROOT", "~/.insightface"))
+FACE_PROFILE = os.environ.get("FACE_PROFILE", "slim")
+FACE_INT8 = os.environ.get("FACE_INT8", "0") == "1"
+ORT_THREADS = int(os.environ.get("ORT_THREADS", 0))  # intra-op threads per session, 0 = one per core
+INT8_SUFFIX = "_int8"
+
+
+def pack_name(name=MODEL_NAME, quantized=FACE_INT8):
+    """Model pack directory name; also what embedding caches should be keyed on."""
+    return name + INT8_SUFFIX if quantized else name
+
+
+def session_options(threads=ORT_THREADS):
+    import onnxruntime as ort
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL  # these graphs are chains, parallel mode only adds overhead
+    so.log_severity_level = 3
+    if threads:
+        so.intra_op_num_threads = threads
+        so.inter_op_num_threads = 1
+    return so
+
+
+def model_task(onnx_file):
+    """Which insightface task an .onnx file is, from its graph signature (same rules as model_zoo)."""
+    import onnx
+    graph = onnx.load(onnx_file).graph
+    initializers = {init.name for init in graph.initializer}
+    inputs = [i for i in graph.input if i.name not in initializers]
+    shape = [d.dim_value for d in inputs[0].type.tensor_type.shape.dim]
+    if len(graph.output) >= 5:
+        return "detection"
+    if shape[2:] == [192, 192]:
+        return "landmark"
+    if shape[2:] == [96, 96]:
+        return "genderage"
+    if len(inputs) == 2 and shape[2:] == [128, 128]:
+        return "inswapper"
+    if len(shape) == 4 and shape[2] == shape[3] and shape[2] >= 112 and shape[2] % 16 == 0:
+        return "recognition"
+    return None
+
+
+def pack_dir(name):
+    path = os.path.join(MODEL_ROOT, "models", name)
+    if not os.path.isdir(path) and not name.endswith(INT8_SUFFIX):
+        from insightface.utils.storage import ensure_available
+        path = ensure_available("models", name, root=MODEL_ROOT)  # downloads the pack like FaceAnalysis
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"No model pack {path}; run: python face_model.py quantize")
+    return path
+
+
+def load_face_app(name=MODEL_NAME, det_size=(640, 640), profile=FACE_PROFILE, quantized=FACE_INT8,
+                  threads=ORT_THREADS, ctx_id=0):
+    """A prepared FaceAnalysis; with the slim profile its get() runs detector + ArcFace only."""
+    from insightface.app import FaceAnalysis
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile!r}, expected one of {sorted(PROFILES)}")
+    if quantized and PROFILES[profile] is None:
+        raise ValueError(f"The INT8 pack only has {', '.join(PROFILES['slim'])}; use profile='slim' with quantized=True")
+    started = time.perf_counter()
+    pack = pack_name(name, quantized)
+    if PROFILES[profile] is None:
+        app = FaceAnalysis(name=pack, root=MODEL_ROOT)
+    else:
+        app = _slim_face_app(pack_dir(pack), session_options(threads))
+    app.prepare(ctx_id=ctx_id, det_size=det_size)
+    print(f"✅ Model {pack} [{profile}: {', '.join(sorted(app.models))}] loaded in "
+          f"{time.perf_counter() - started:.1f}s")
+    return app
+
+
+def _slim_face_app(model_dir, so):
+    """FaceAnalysis over the pack's detector and ArcFace only, each session opened once with `so`."""
+    import onnxruntime as ort
+    from insightface.app import FaceAnalysis
+    from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+    from insightface.model_zoo.retinaface import RetinaFace
+
+    class SlimFaceAnalysis(FaceAnalysis):
+        def __init__(self):
+            self.model_dir = model_dir
+            self.models = {}
+            for onnx_file in sorted(glob.glob(os.path.join(model_dir, "*.onnx"))):
+                task = model_task(onnx_file)
+                if task not in PROFILES["slim"] or task in self.models:
+                    continue
+                session = ort.InferenceSession(onnx_file, sess_options=so,
+                                               providers=ort.get_available_providers())
+                model_cls = RetinaFace if task == "detection" else ArcFaceONNX
+                self.models[task] = model_cls(model_file=onnx_file, session=session)
+            if "detection" not in self.models or "recognition" not in self.models:
+                raise FileNotFoundError(f"{model_dir} has no detector / recognition model")
+            self.det_model = self.models["detection"]
+
+    return SlimFaceAnalysis()
+
+
+# ------------------------------
+# INT8 pack
+# ------------------------------
+def quantize_pack(name=MODEL_NAME):
+    """Dynamic INT8 copy of the pack's detector and ArcFace as "<name>_int8"."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    src, dst = pack_dir(name), os.path.join(MODEL_ROOT, "models", pack_name(name, True))
+    os.makedirs(dst, exist_ok=True)
+    for onnx_file in sorted(glob.glob(os.path.join(src, "*.onnx"))):
+        if model_task(onnx_file) not in PROFILES["slim"]:
+            continue
+        out = os.path.join(dst, os.path.basename(onnx_file))
+        started = time.perf_counter()
+        quantize_dynamic(onnx_file, out, weight_type=QuantType.QInt8,
+                         op_types_to_quantize=["Conv", "MatMul", "Gemm"])
+        print(f"✅ {os.path.basename(onnx_file)}: {os.path.getsize(onnx_file) / 1e6:.0f} MB -> "
+              f"{os.path.getsize(out) / 1e6:.0f} MB in {time.perf_counter() - started:.1f}s")
+    return dst
+
+
+# ------------------------------
+# profile report
+# ------------------------------
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource  # peak, not current, off Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def measure(config, image, runs, det_size, threads, emb_out=None):
+    """Startup, RSS and per-face latency of one config ("full", "slim", "slim-int8"), in this process."""
+    import cv2
+    from face_embed import detect, embed_aligned
+    profile, _, variant = config.partition("-")
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    app = load_face_app(det_size=det_size, profile=profile, quantized=variant == "int8", threads=threads)
+    startup = time.perf_counter() - started
+    img = cv2.imread(image)
+    if img is None:
+        raise SystemExit(f"Could not read {image}")
+
+    def median_ms(fn):
+        fn()
+        times = []
+        for _ in range(runs):
+            t = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - t)
+        return 1000 * float(np.median(times)), out
+
+    get_ms, faces = median_ms(lambda: app.get(img))
+    detect_ms, (bboxes, kpss) = median_ms(lambda: detect(app, img))
+    embed_ms, embs = median_ms(lambda: embed_aligned(app, img, kpss))
+    n = max(1, len(bboxes))
+    if emb_out:
+        np.save(emb_out, embs)
+    return {"config": config, "models": sorted(app.models), "startup_seconds": round(startup, 2),
+            "rss_mb": round(rss_mb(), 1), "model_rss_mb": round(rss_mb() - rss_before, 1),
+            "faces": len(bboxes), "get_ms": round(get_ms, 2), "get_ms_per_face": round(get_ms / n, 2),
+            "detect_ms": round(detect_ms, 2), "embed_ms_per_face": round(embed_ms / n, 2)}
+
+
+def report(configs, image, runs, det_size, threads):
+    """Each config in a fresh process, so startup and RSS aren't shared."""
+    tmp = tempfile.mkdtemp(prefix="face_model_")
+    rows, reference = [], None
+    for config in configs:
+        emb_file = os.path.join(tmp, f"{config}.npy")
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "measure", config, "--image", image,
+                              "--runs", str(runs), "--det-size", str(det_size[0]), "--threads", str(threads),
+                              "--emb-out", emb_file], capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"⚠️ {config} failed:\n{out.stderr.strip()}", file=sys.stderr)
+            continue
+        row = json.loads(out.stdout.strip().splitlines()[-1])
+        embs = np.load(emb_file)
+        if reference is None:
+            reference = embs
+        elif reference.shape == embs.shape and len(embs):
+            # same detections in the same order: worst embedding drift from the first config
+            row["min_cosine"] = round(float(np.min(np.sum(reference * embs, axis=1))), 4)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    quantize = sub.add_parser("quantize", help="write the INT8 pack")
+    quantize.add_argument("--name", default=MODEL_NAME)
+    for cmd in ("report", "measure"):
+        p = sub.add_parser(cmd, help="startup / RSS / per-face latency per profile" if cmd == "report"
+                           else "one config in this process (used by report)")
+        if cmd == "report":
+            p.add_argument("--configs", nargs="+", default=["full", "slim", "slim-int8"],
+                           help="<profile>[-int8], the first is the accuracy reference")
+            p.add_argument("--json", help="also write the rows to this file")
+        else:
+            p.add_argument("config")
+            p.add_argument("--emb-out")
+        p.add_argument("--image", required=True, help="a photo with faces, e.g. a class photo")
+        p.add_argument("--runs", type=int, default=10)
+        p.add_argument("--det-size", type=int, default=640)
+        p.add_argument("--threads", type=int, default=ORT_THREADS)
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        print(f"✅ INT8 pack written to {quantize_pack(args.name)}")
+    elif args.command == "measure":
+        row = measure(args.config, args.image, args.runs, (args.det_size, args.det_size), args.threads,
+                      args.emb_out)
+        print(json.dumps(row))
+    else:
+        rows = report(args.configs, args.image, args.runs, (args.det_size, args.det_size), args.threads)
+        cols = ["config", "startup_seconds", "rss_mb", "faces", "get_ms_per_face", "detect_ms",
+                "embed_ms_per_face", "min_cosine"]
+        print("".join(f"{c:>18}" for c in cols))
+        for row in rows:
+            print("".join(f"{row.get(c, ''):>18}" for c in cols))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+# ------------------------------
+# IN-PROCESS GALLERY CACHE
+# ------------------------------
+class GallerySnapshot:
+    """Immutable view of one loaded gallery; requests keep it for their whole run."""
+
+    def __init__(self, gallery, version, mtime, loaded_at, load_seconds):
+        self.gallery = gallery
+        self.version = version
+        self.mtime = mtime
+        self.loaded_at = loaded_at
+        self.load_seconds = load_seconds
+
+    def info(self):
+        return {
+            "version": self.version,
+            "mtime": self.mtime,
+            "loaded_at": self.loaded_at,
+            "load_seconds": round(self.load_seconds, 4),
+            "students": len(self.gallery),
+            "embeddings": self.gallery.size,
+        }
+
+
+class GalleryCache:
+    """Holds the gallery for one store and reloads it only when it changes.
+
+    `path` is the file (or list of files) whose mtime marks a new version,
+    e.g. a GalleryStore's index.json, and `loader()` returns a Gallery.
+    The mtime is checked
+    on every `get()`; a reload builds a new snapshot and swaps the reference
+    in one assignment, so requests already holding the old one are unaffected.
+    """
+
+    def __init__(self, path, loader):
+        self.path = path
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = 0
+
+    def _file_mtime(self):
+        paths = self.path if isinstance(self.path, (list, tuple)) else [self.path]
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _build(self, gallery, mtime, started):
+        self._version += 1
+        return GallerySnapshot(gallery, self._version, mtime, time.time(),
+                               time.perf_counter() - started)
+
+    def get(self):
+        snap = self._snapshot
+        mtime = self._file_mtime()
+        if snap is not None and snap.mtime == mtime:
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            mtime = self._file_mtime()
+            if snap is None or snap.mtime != mtime:
+                started = time.perf_counter()
+                snap = self._build(self._loader(), mtime, started)
+                self._snapshot = snap
+                print(f"🔄 Gallery v{snap.version} loaded: {len(snap.gallery)} students, "
+                      f"{snap.gallery.size} embeddings in {snap.load_seconds:.3f}s")
+            return snap
+
+    def publish(self, gallery):
+        """Install a freshly committed gallery (e.g. after /train)."""
+        with self._lock:
+            started = time.perf_counter()
+            self._snapshot = self._build(gallery, self._file_mtime(), started)
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(path, loader):
+    """One shared cache per store, so several sections can live in one process."""
+    paths = path if isinstance(path, (list, tuple)) else [path]
+    key = tuple(os.path.abspath(p) for p in paths)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = GalleryCache(path, loader)
+        return cache
@@ -0,0 +1,153 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+# ------------------------------
+# REDUCED-PRECISION GALLERY COPIES
+# ------------------------------
+# Scoring every face against every gallery row reads the whole float32
+# matrix (2 KB per 512-d row) once per photo; at institution scale that
+# no longer fits in cache and matching is memory-bandwidth bound. A
+# coarse copy of the rows is scanned instead:
+#   float16  2 bytes per value
+#   int8     1 byte per value + one float32 scale per row
+#            (row ~= scale * codes, scale = max|row| / 127)
+# and each face's best `rerank` rows are then scored exactly against the
+# float32 matrix (Gallery.scores), so the top match uses exact scores.
+# numpy has no float16 / int8 matrix product, so the scan widens
+# SCAN_CHUNK rows at a time to float32 in cache: per-photo time stays
+# about that of float32 (bench_codec.py), the resident gallery shrinks 2x /
+# 4x and only the re-ranked float32 rows need to be paged in.
+#
+# The copy lives next to the store's emb-<gen>.f32 as emb-<gen>.f16 or
+# emb-<gen>.i8 (+ .i8s scales), raw and append-only like the data file,
+# so serve.py workers share it through the page cache. Rows the copy
+# doesn't cover yet (a /train still running) are scored in float32.
+# codec.json (codec, generation, rows) is rewritten after every update,
+# so a GalleryCache watching it reloads once the copy is complete.
+CODEC_FILE = "codec.json"
+CODECS = ("float32", "float16", "int8")
+SUFFIXES = {"float16": (".f16",), "int8": (".i8", ".i8s")}
+SCAN_CHUNK = 4096  # rows decoded at a time, so the float32 temp stays in cache
+
+
+def encode(rows, codec):
+    """(codes,) or (codes, scales) for float32 unit rows."""
+    rows = np.asarray(rows, dtype=np.float32)
+    if codec == "float16":
+        return (rows.astype(np.float16),)
+    if codec == "int8":
+        scales = np.abs(rows).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(rows / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS[1:]}")
+
+
+class CoarseRows:
+    """A float16 / int8 copy of the first `rows` gallery rows."""
+
+    def __init__(self, codec, codes, scales=None):
+        self.codec = codec
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_matrix(cls, matrix, codec):
+        return cls(codec, *encode(matrix, codec))
+
+    @property
+    def rows(self):
+        return self.codes.shape[0] if self.scales is None else min(self.codes.shape[0], self.scales.shape[0])
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
+
+    def scores(self, queries, rows=None):
+        """Approximate cosine of unit `queries` against the first `rows` rows, (faces, rows)."""
+        rows = self.rows if rows is None else min(rows, self.rows)
+        out = np.empty((len(queries), rows), dtype=np.float32)
+        for start in range(0, rows, SCAN_CHUNK):
+            stop = min(start + SCAN_CHUNK, rows)
+            out[:, start:stop] = queries @ np.asarray(self.codes[start:stop], dtype=np.float32).T
+            if self.scales is not None:
+                out[:, start:stop] *= self.scales[start:stop]
+        return out
+
+
+# ------------------------------
+# store sidecar files
+# ------------------------------
+def _paths(store, codec):
+    stem = os.path.splitext(store.data_path)[0]
+    return [stem + suffix for suffix in SUFFIXES[codec]]
+
+
+def _row_bytes(codec, dim):
+    return [2 * dim] if codec == "float16" else [dim, 4]
+
+
+def update_store_codec(store, codec):
+    """Encode the rows `store` gained since the last call; returns the CoarseRows or None for float32.
+
+    Copies for other codecs or generations (the store was compacted) are removed.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+    keep = set(_paths(store, codec)) if codec in SUFFIXES else set()
+    for suffix in {suffix for suffixes in SUFFIXES.values() for suffix in suffixes}:
+        for path in glob.glob(os.path.join(store.root, "emb-*" + suffix)):
+            if path not in keep:
+                os.remove(path)
+    if not keep or store.rows == 0:
+        _write_marker(store, None)
+        return None
+    paths, row_bytes = _paths(store, codec), _row_bytes(codec, store.dim)
+    done = min([store.rows] + [os.path.getsize(path) // n if os.path.exists(path) else 0
+                               for path, n in zip(paths, row_bytes)])
+    if done < store.rows:
+        parts = encode(store.matrix()[done:], codec)
+        for path, part, n in zip(paths, parts, row_bytes):  # codes before scales: readers take the shorter
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(done * n)
+                f.write(part.tobytes())
+                f.truncate()
+    _write_marker(store, {"codec": codec, "generation": store.index["generation"], "rows": store.rows})
+    return load_store_codec(store, codec)
+
+
+def _write_marker(store, marker):
+    """codec.json for watchers; only touched when its content changes, so idle updates don't reload."""
+    path = os.path.join(store.root, CODEC_FILE)
+    try:
+        with open(path) as f:
+            current = json.load(f)
+    except (OSError, ValueError):
+        current = None
+    if current == marker:
+        return
+    if marker is None:
+        os.remove(path)
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(marker, f)
+    os.replace(tmp, path)
+
+
+def load_store_codec(store, codec):
+    """Memory-mapped copy saved next to the store, or None for float32 / none written yet."""
+    if codec == "float32":
+        return None
+    if codec not in SUFFIXES:
+        raise ValueError(f"Unknown codec {codec!r}, expected one of {CODECS}")
+    paths = _paths(store, codec)
+    if not all(os.path.exists(path) and os.path.getsize(path) for path in paths):
+        return None
+    codes = np.memmap(paths[0], mode="r", dtype=np.float16 if codec == "float16" else np.int8)
+    codes = codes[:codes.size - codes.size % store.dim].reshape(-1, store.dim)
+    scales = np.memmap(paths[1], mode="r", dtype=np.float32) if codec == "int8" else None
+    return CoarseRows(codec, codes, scales)
@@ -0,0 +1,230 @@
+import json
+import os
+import pickle
+import threading
+
+import numpy as np
+
+from matcher import Gallery, normalize_rows
+
+# ------------------------------
+# ON-DISK GALLERY STORE
+# ------------------------------
+# <root>/index.json      ids -> {offset, count, signature} + dim/rows/version
+# <root>/emb-<gen>.f32   raw float32 unit rows, opened with np.memmap
+#
+# Replacing a student appends its new rows at the end of the data file and
+# repoints the index; the old rows become dead space until compact().
+# index.json is always replaced atomically, so a crash or a cancelled
+# /train leaves the previous gallery intact.
+INDEX_FILE = "index.json"
+DEFAULT_DIM = 512
+
+
+def _write_json_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_legacy_pickle(path):
+    """Read embeddings_db.pkl in either the hi5 list format or the older hi4_buffalo formats."""
+    with open(path, "rb") as f:
+        db_data = pickle.load(f)
+    if isinstance(db_data, dict) and "embeddings" in db_data:
+        embeddings_db = db_data["embeddings"] or {}
+        signatures = db_data.get("signatures", {}) or {}
+    elif isinstance(db_data, dict):
+        embeddings_db, signatures = db_data, {}
+    else:
+        embeddings_db, signatures = {}, {}
+    return embeddings_db, signatures
+
+
+class GalleryStore:
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self._lock = threading.RLock()
+        self._pending = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    @classmethod
+    def open(cls, root, legacy_pickle=None):
+        """Open (or create) a store, migrating `legacy_pickle` once if there is no index yet."""
+        fresh = not os.path.exists(os.path.join(root, INDEX_FILE))
+        store = cls(root)
+        if fresh and legacy_pickle and os.path.exists(legacy_pickle):
+            try:
+                store.migrate_pickle(legacy_pickle)
+            except Exception as e:
+                print(f"⚠️ Could not migrate {legacy_pickle} ({e}). Starting fresh.")
+        return store
+
+    # ------------------------------
+    # index
+    # ------------------------------
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+        else:
+            index = {"format": 1, "dim": DEFAULT_DIM, "rows": 0, "version": 0,
+                     "generation": 0, "students": {}}
+        self.index = index
+        self.students = index["students"]
+
+    def reload(self):
+        with self._lock:
+            self._load_index()
+
+    def _commit(self):
+        self.index["version"] += 1
+        _write_json_atomic(self.index_path, self.index)
+
+    @property
+    def data_path(self):
+        return os.path.join(self.root, f"emb-{self.index['generation']}.f32")
+
+    @property
+    def dim(self):
+        return self.index["dim"]
+
+    @property
+    def rows(self):
+        return self.index["rows"]
+
+    @property
+    def version(self):
+        return self.index["version"]
+
+    @property
+    def live_rows(self):
+        return sum(e["count"] for e in self.students.values())
+
+    @property
+    def signatures(self):
+        return {sid: e.get("signature") for sid, e in self.students.items()}
+
+    def __contains__(self, student_id):
+        return student_id in self.students
+
+    def __len__(self):
+        return len(self.students)
+
+    # ------------------------------
+    # reads
+    # ------------------------------
+    def matrix(self):
+        """Memory-mapped view of every written row (live and dead)."""
+        if self.rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.data_path, dtype=np.float32, mode="r",
+                         shape=(self.rows, self.dim))
+
+    def get(self, student_id):
+        e = self.students[student_id]
+        return np.array(self.matrix()[e["offset"]:e["offset"] + e["count"]])
+
+    def to_gallery(self, student_ids=None):
+        """Gallery over the memory-mapped matrix, without copying it into RAM."""
+        with self._lock:
+            items = self.students.items()
+            if student_ids is not None:
+                wanted = set(student_ids)
+                items = [(sid, e) for sid, e in items if sid in wanted]
+            items = sorted(items, key=lambda kv: kv[1]["offset"])
+            ids = [sid for sid, _ in items]
+            offsets = [e["offset"] for _, e in items]
+            counts = [e["count"] for _, e in items]
+            return Gallery(ids, self.matrix(), offsets, counts)
+
+    def to_db(self):
+        """{student_id: [emb, ...]} in the old embeddings_db layout."""
+        mat = self.matrix()
+        return {sid: list(np.array(mat[e["offset"]:e["offset"] + e["count"]]))
+                for sid, e in self.students.items()}
+
+    # ------------------------------
+    # writes
+    # ------------------------------
+    def _append_rows(self, rows):
+        offset = self.rows
+        with open(self.data_path, "r+b" if os.path.exists(self.data_path) else "wb") as f:
+            # anything past index["rows"] is an uncommitted leftover; overwrite it
+            f.seek(offset * self.dim * 4)
+            f.write(rows.tobytes())
+            f.truncate()
+        self.index["rows"] += rows.shape[0]
+        return offset
+
+    def put(self, student_id, embeddings, signature=None, commit=True):
+        """Add or replace one student's embeddings without rewriting the others."""
+        rows = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            offset = self._append_rows(rows)
+            self.students[student_id] = {"offset": offset, "count": rows.shape[0],
+                                         "signature": signature}
+            self._pending += 1
+            if commit:
+                self.commit()
+
+    def remove(self, student_id, commit=True):
+        with self._lock:
+            if self.students.pop(student_id, None) is not None:
+                self._pending += 1
+            if commit:
+                self.commit()
+
+    def commit(self):
+        """Publish pending put/remove calls in one atomic index write."""
+        with self._lock:
+            if self._pending:
+                self._pending = 0
+                if os.path.exists(self.data_path):
+                    # rows must be on disk before the index points at them
+                    with open(self.data_path, "rb+") as f:
+                        os.fsync(f.fileno())
+                self._commit()
+                if self.rows > 1024 and self.live_rows * 2 < self.rows:
+                    self.compact()
+
+    def compact(self):
+        """Rewrite the live rows into a new data file and drop the dead ones."""
+        with self._lock:
+            old_path = self.data_path
+            mat = self.matrix()
+            items = sorted(self.students.items(), key=lambda kv: kv[1]["offset"])
+            self.index["generation"] += 1
+            new_path = self.data_path
+            pos = 0
+            with open(new_path, "wb") as f:
+                for sid, e in items:
+                    f.write(np.ascontiguousarray(mat[e["offset"]:e["offset"] + e["count"]]).tobytes())
+                    e["offset"] = pos
+                    pos += e["count"]
+                f.flush()
+                os.fsync(f.fileno())
+            del mat
+            self.index["rows"] = pos
+            self._commit()
+            # readers that still map the old file keep a valid view on POSIX
+            if os.path.exists(old_path) and old_path != new_path:
+                os.remove(old_path)
+
+    def migrate_pickle(self, path):
+        """One-time import of embeddings_db.pkl (list or mean-vector entries)."""
+        embeddings_db, signatures = read_legacy_pickle(path)
+        with self._lock:
+            for sid, embs in embeddings_db.items():
+                if not isinstance(embs, list):
+                    embs = [embs]
+                if not embs:
+                    continue
+                self.put(sid, np.vstack(embs), signatures.get(sid), commit=False)
+            self.commit()
+        print(f"✅ Migrated {len(self.students)} students from {path} to {self.root}")
@@ -1,60 +1,95 @@
-from flask import Flask, request, jsonify
-import cv2
+from flask import Flask, Response, g, request, jsonify
+import json
 import os
 import re
 import numpy as np
-import pickle
 import hashlib
-import csv
-from insightface.app import FaceAnalysis
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+from matcher import Gallery, MultiGallery
+from gallery_cache import get_cache
+from gallery_store import GalleryStore
+from enroll import Enroller, list_images
+from embedding_cache import EmbeddingCache
+from ann_index import INDEX_FILE as ANN_FILE, load_store_index, update_store_index
+from gallery_codec import CODEC_FILE, load_store_codec, update_store_codec
+from sections import Sections, open_shards
+from face_embed import align, detect, detect_and_embed_many, embed_crops, write_crop
+from batcher import EmbedBatcher
+from quality import QualityGate
+from templates import TEMPLATES_K, TEMPLATES_METHOD, select_templates, signature as templates_signature
+from tiling import TiledDetector
+from image_io import decode_image
+from ledger import Ledger, TARGET_PERCENT
+from metrics import Metrics, NULL_TIMER
+from face_model import FACE_INT8, load_face_app, pack_name
+
+try:
+    import fcntl
+except ImportError:  # Windows: no serve.py workers, the thread lock alone is enough
+    fcntl = None
 
 # ------------------------------
 # CONFIG
 # ------------------------------
 DB_FOLDER = "train"
 EXTRACTED = "extracted_faces"
-EMB_FILE = "embeddings_db.pkl"
-SECTION = "ALL"  # change to A / B / C / ALL
+EMB_FILE = "embeddings_db.pkl"  # legacy pickle, migrated into GALLERY_DIR once
+GALLERY_DIR = "gallery"
+EMB_CACHE_DIR = "emb_cache"  # per-image embeddings keyed by image content
+SECTION = "ALL"  # gallery scope when a request doesn't send one (ledger writes must name theirs)
+SECTIONS_FILE = "sections.json"  # shard definitions (AD-number ranges per section)
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
-ATTENDANCE_CSV = "attendance.csv"
+LEDGER_DB = os.environ.get("LEDGER_DB", "attendance.db")  # append-only attendance history (SQLite, WAL)
+MODEL_NAME = "buffalo_l"
+DET_SIZE = (640, 640)
+TRAIN_WORKERS = int(os.environ.get("TRAIN_WORKERS", 0))  # 0 = embed in this process
+MAX_TRAIN_WORKERS = max(TRAIN_WORKERS, os.cpu_count() or 1)  # /train?workers= cap: each loads its own model
+GALLERY_INDEX = os.environ.get("GALLERY_INDEX", "exact")  # exact / ivf / ivfpq
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 8))
+GALLERY_CODEC = os.environ.get("GALLERY_CODEC", "float32")  # float32 / float16 / int8 first-pass scan (exact index only)
+GALLERY_RERANK = int(os.environ.get("GALLERY_RERANK", 64))  # rows per face re-scored in float32 after it
+DECODE_THREADS = 4
+DETECT_THREADS = int(os.environ.get("DETECT_THREADS", 4))  # photos detected at once in /recognize_batch
+MAX_BATCH_PHOTOS = 10
+TILED_DETECTION = os.environ.get("TILED_DETECTION", "0") == "1"  # default for requests without `tiled`
+TILE_THREADS = int(os.environ.get("TILE_THREADS", os.cpu_count() or 4))
+SAVE_UPLOADS = os.environ.get("SAVE_UPLOADS", "1") == "1"  # keep original photos in EXTRACTED (written in background)
+# JPEGs are decoded at 1/2..1/8 scale while the long side stays >= this (0 = always full size)
+DECODE_MIN_SIDE = int(os.environ.get("DECODE_MIN_SIDE", 2 * max(DET_SIZE)))
+# faces from concurrent requests share one recognition call: up to EMBED_BATCH crops,
+# waiting at most EMBED_BATCH_WAIT_MS for company (EMBED_BATCH=0: each request on its own)
+EMBED_BATCH = int(os.environ.get("EMBED_BATCH", 64))
+EMBED_BATCH_WAIT_MS = float(os.environ.get("EMBED_BATCH_WAIT_MS", 5))
+# faces failing these are never aligned, embedded or saved (QUALITY_GATE=0: keep every detection)
+QUALITY_GATE = os.environ.get("QUALITY_GATE", "1") == "1"
+MIN_FACE_PX = int(os.environ.get("MIN_FACE_PX", 16))  # shorter bbox side
+MIN_DET_SCORE = float(os.environ.get("MIN_DET_SCORE", 0.5))
+MAX_YAW = float(os.environ.get("MAX_YAW", 0.45))  # nose offset in eye distances, ~0.5 is a profile
+MIN_SHARPNESS = float(os.environ.get("MIN_SHARPNESS", 15))  # Laplacian variance at 64x64
+TRAIN_MIN_RELATIVE = float(os.environ.get("TRAIN_MIN_RELATIVE", 0.5))  # /train: smaller faces are background people
+METRICS = os.environ.get("METRICS", "1") == "1"  # stage timers + /metrics; 0 = no timing at all
+LOG_REQUESTS = os.environ.get("LOG_REQUESTS", "1") == "1"  # one JSON line per timed request
+DEBUG_TIMING_HEADER = "X-Debug-Timing"  # send it to get a Server-Timing stage breakdown back
 
 os.makedirs(EXTRACTED, exist_ok=True)
+os.makedirs(GALLERY_DIR, exist_ok=True)
 
 # ------------------------------
 # INIT MODEL
 # ------------------------------
 print("🔄 Loading Buffalo model...")
-face_app = FaceAnalysis(name="buffalo_l")
-face_app.prepare(ctx_id=0, det_size=(640, 640))
-print("✅ Model loaded")
+face_app = load_face_app(MODEL_NAME, det_size=DET_SIZE)  # FACE_PROFILE / FACE_INT8 / ORT_THREADS
 
 # ------------------------------
 # HELPERS
 # ------------------------------
-def parse_ad_number(folder_name: str):
-    if folder_name.strip().upper() == "NA":
-        return "NA"
-    m = re.search(r'AD\s*0*([0-9]+)', folder_name, flags=re.IGNORECASE)
-    if not m:
-        return None
-    return int(m.group(1))
+sections = Sections.load(SECTIONS_FILE)
 
 def is_valid_folder(folder_name: str, choice: str) -> bool:
-    tag = parse_ad_number(folder_name)
-    if tag == "NA":
-        return True
-    if tag is None:
-        return False
-    if choice == "ALL":
-        return True
-    if choice == "A":
-        return 1 <= tag <= 64
-    if choice == "B":
-        return 65 <= tag <= 127
-    if choice == "C":
-        return tag >= 128
-    return False
+    return sections.in_section(folder_name, choice)
 
 def compute_folder_signature(folder_path: str) -> str:
     sig = hashlib.sha1()
@@ -66,102 +101,453 @@ def compute_folder_signature(folder_path: str) -> str:
             sig.update(str(stat.st_mtime).encode())
     return sig.hexdigest()
 
+def open_stores():
+    return open_shards(GALLERY_DIR, sections, legacy_pickle=EMB_FILE)
+
+def shard_dir(shard):
+    return os.path.join(GALLERY_DIR, shard)
+
+def load_gallery(store):
+    gallery = store.to_gallery()
+    gallery.index = load_store_index(store, GALLERY_INDEX, nprobe=ANN_NPROBE)
+    gallery.coarse = load_store_codec(store, GALLERY_CODEC)
+    gallery.rerank = GALLERY_RERANK
+    return gallery
+
 def load_db():
-    if os.path.exists(EMB_FILE):
-        try:
-            with open(EMB_FILE, "rb") as f:
-                db_data = pickle.load(f)
-            embeddings_db = db_data.get("embeddings", {}) or {}
-            signatures = db_data.get("signatures", {}) or {}
-            return embeddings_db, signatures
-        except:
-            return {}, {}
-    return {}, {}
-
-def save_db(embeddings_db, signatures):
-    with open(EMB_FILE, "wb") as f:
-        pickle.dump({"embeddings": embeddings_db, "signatures": signatures}, f)
+    embeddings_db, signatures = {}, {}
+    for store in open_stores().values():
+        embeddings_db.update(store.to_db())
+        signatures.update(store.signatures)
+    return embeddings_db, signatures
 
 def recognize_face(embedding, embeddings_db, threshold=0.35):
-    best_id, best_score = "Unknown", -1
-    embedding = embedding / np.linalg.norm(embedding)
-    for sid, ref_emb_list in embeddings_db.items():
-        if not isinstance(ref_emb_list, list):
-            ref_emb_list = [ref_emb_list]
-        for ref_emb in ref_emb_list:
-            ref_emb = ref_emb / np.linalg.norm(ref_emb)
-            sim = float(np.dot(embedding, ref_emb))
-            if sim > best_score:
-                best_score = sim
-                best_id = sid
-    return (best_id if best_score >= threshold else "Unknown", best_score)
+    gallery = embeddings_db if isinstance(embeddings_db, Gallery) else Gallery.from_db(embeddings_db)
+    return gallery.match([embedding], threshold)[0]
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_attendance_csv(marked_rolls):
-    with open(ATTENDANCE_CSV, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["roll_number", "present"])
-        for roll in marked_rolls:
-            writer.writerow([roll, "Yes"])
+def save_faces(img, stem, bboxes, kpss, face_embs):
+    """Write each detected face's crop to EXTRACTED; returns (face_files, embeddings) for the kept ones."""
+    face_files, embeddings = [], []
+    for i, (bbox, kps, emb) in enumerate(zip(bboxes, kpss, face_embs), 1):
+        face_file = f"{stem}_face{i}.jpg"
+        if not write_crop(os.path.join(EXTRACTED, face_file), img, bbox, kps):
+            continue
+        face_files.append(face_file)
+        embeddings.append(emb)
+    return face_files, embeddings
+
+recognize_gate = QualityGate(MIN_FACE_PX, 0.0, MIN_DET_SCORE, MAX_YAW,
+                             min_sharpness=MIN_SHARPNESS) if QUALITY_GATE else None
+train_gate = QualityGate(MIN_FACE_PX, TRAIN_MIN_RELATIVE, MIN_DET_SCORE, MAX_YAW,
+                         min_sharpness=MIN_SHARPNESS) if QUALITY_GATE else None
+
+def gate_faces(img, bboxes, kpss):
+    """recognize_gate over one photo: (kept bboxes, kept kpss, report or None when the gate is off)."""
+    if recognize_gate is None:
+        return bboxes, kpss, None
+    keep, skipped = recognize_gate.filter(img, bboxes, kpss)
+    for reason, n in skipped.items():
+        metrics.inc("faces_skipped_total", n, reason=reason)
+    return bboxes[keep], kpss[keep], {"detected": len(bboxes), "kept": len(keep), "skipped": skipped}
+
+def quality_savings(quality, stage_seconds):
+    """Estimated ms each per-face stage would have spent on the skipped faces."""
+    skipped = sum(quality["skipped"].values())
+    if not skipped or not quality["kept"]:
+        return {}
+    return {stage: round(1000 * seconds / quality["kept"] * skipped, 1) for stage, seconds in stage_seconds.items()}
+
+def roll_number(label):
+    m = re.search(r'AD0*([0-9]+)', label)
+    return int(m.group(1)) if m else None
+
+class GalleryLock:
+    """Exclusive lock over GALLERY_DIR for threads and for serve.py's worker processes (flock)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, blocking=True):
+        if not self._thread_lock.acquire(blocking=blocking):
+            return False
+        if fcntl is not None:
+            f = open(self.path, "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except OSError:
+                f.close()
+                self._thread_lock.release()
+                return False
+            self._file = f
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()  # drops the flock
+            self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+gallery_lock = GalleryLock(os.path.join(GALLERY_DIR, ".lock"))
+
+ledger = Ledger(LEDGER_DB, sections)
+
+def wants_record():
+    """/recognize and /recognize_batch only preview unless asked to record (record=1 or a session_id).
+
+    The app shows the preview, lets the teacher fix it and saves it with
+    /mark_manual; recording the preview too would count every class twice.
+    """
+    return (request.values.get("record", "0").lower() in ("1", "true", "yes")
+            or "session_id" in request.values)
+
+def attendance_marks(matches):
+    """{roll: (roll, label, similarity)} for the recognised faces, best score per roll."""
+    marks = {}
+    for label, score in matches:
+        roll = roll_number(label)
+        if roll is not None and (roll not in marks or score > marks[roll][2]):
+            marks[roll] = (roll, label, round(float(score), 4))
+    return marks
+
+def record_attendance(section, source, matches):
+    """One ledger session (or the request's `session_id`) with a mark per recognised roll.
+
+    `section` must already be canonical (sections.canonical). A photo with
+    nobody recognised still records its (empty) session: the class was held.
+    Returns (session_id, marked_rolls); raises KeyError for an unknown
+    session_id and ValueError for one recorded under another section.
+    """
+    marks = attendance_marks(matches)
+    session_id = request.values.get("session_id", type=int)
+    session_id = ledger.record(section, source, list(marks.values()), session_id=session_id)
+    return session_id, sorted(marks)
+
+def request_section(required=False):
+    """Canonical ?section= / form section; ValueError if unknown, or missing when `required`."""
+    section = request.values.get("section")
+    if required and not (section or "").strip():
+        raise ValueError("section is required to record attendance")
+    return sections.canonical(section or SECTION)
+
+def query_section():
+    """?section= of a report query, canonical like the writes; None when absent, ValueError if unknown."""
+    section = request.args.get("section")
+    return sections.canonical(section) if section and section.strip() else None
+
+def attendance_response(section, source, matches):
+    """(session_id, marked_rolls, recorded) for a recognition request: recorded only if wants_record()."""
+    if not wants_record():
+        return None, sorted(attendance_marks(matches)), False
+    with g.timer.stage("ledger"):
+        session_id, marked_rolls = record_attendance(section, source, matches)
+    return session_id, marked_rolls, True
+
+# one-time pickle migration / shard split, ANN index and GALLERY_CODEC copy before serving
+# (under the lock: serve.py workers all start at once)
+with gallery_lock:
+    for _store in open_stores().values():
+        update_store_index(_store, GALLERY_INDEX, nprobe=ANN_NPROBE)
+        update_store_codec(_store, GALLERY_CODEC)
+
+shard_caches = {
+    shard: get_cache([os.path.join(shard_dir(shard), "index.json"),
+                      os.path.join(shard_dir(shard), ANN_FILE),
+                      os.path.join(shard_dir(shard), CODEC_FILE)],
+                     lambda shard=shard: load_gallery(GalleryStore(shard_dir(shard))))
+    for shard in sections.names
+}
+
+def section_gallery(section):
+    """Gallery over only the shards `section` needs, plus their snapshot versions."""
+    snapshots = {shard: shard_caches[shard].get() for shard in sections.shards_for(section)}
+    galleries = [snap.gallery for snap in snapshots.values()]
+    gallery = galleries[0] if len(galleries) == 1 else MultiGallery(galleries)
+    return gallery, {shard: snap.version for shard, snap in snapshots.items()}
 
 # ------------------------------
 # FLASK APP
 # ------------------------------
 app = Flask(__name__)
 
-@app.route("/train", methods=["POST"])
-def train():
-    embeddings_db, signatures = load_db()
-    updated, skipped_no_face = 0, 0
-
-    for student_id in sorted(os.listdir(DB_FOLDER)):
-        student_path = os.path.join(DB_FOLDER, student_id)
-        if not os.path.isdir(student_path):
-            continue
-        if not is_valid_folder(student_id, SECTION):
-            continue
+metrics = Metrics(enabled=METRICS, labels={"worker": os.getpid()})  # per process; see metrics.py
+metrics.describe("requests_total", "Requests by endpoint and HTTP status")
+metrics.describe("request_seconds", "Request latency in seconds")
+metrics.describe("stage_seconds", "Time spent per request stage in seconds")
+metrics.describe("faces", "Faces detected per request")
+metrics.describe("train_embedding_cache_total", "Embedding cache lookups during /train")
+metrics.describe("faces_skipped_total", "Detections dropped by the quality gate before embedding")
+metrics.gauge("gallery_embeddings", lambda: {(("shard", shard),): cache.get().gallery.size
+                                             for shard, cache in shard_caches.items()},
+              "Embeddings loaded per gallery shard")
+metrics.gauge("gallery_version", lambda: {(("shard", shard),): cache.get().version
+                                          for shard, cache in shard_caches.items()},
+              "In-process gallery snapshot version per shard")
+metrics.gauge("embed_batch_mean_crops", lambda: batcher.stats()["mean_crops"] if batcher else 0,
+              "Mean crops per recognition call of the cross-request batcher")
+metrics.gauge("embed_batch_mean_requests", lambda: batcher.stats()["mean_requests"] if batcher else 0,
+              "Mean requests sharing one recognition call")
+
+@app.before_request
+def start_timer():
+    g.timer = metrics.request(request.endpoint, force=DEBUG_TIMING_HEADER in request.headers)
+
+@app.after_request
+def finish_timer(response):
+    timer = g.pop("timer", NULL_TIMER)
+    if timer.active:
+        timer.finish(response.status_code)
+        if DEBUG_TIMING_HEADER in request.headers:
+            response.headers["Server-Timing"] = timer.server_timing()
+        if LOG_REQUESTS and request.endpoint not in ("prometheus_metrics", "health", "ready_check"):
+            print(json.dumps(timer.log_record(response.status_code)), flush=True)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-        current_sig = compute_folder_signature(student_path)
-        prev_sig = signatures.get(student_id)
-        if prev_sig == current_sig and student_id in embeddings_db:
-            continue  # unchanged
+# ------------------------------
+# WARMUP / PROBES
+# ------------------------------
+ready = threading.Event()
+
+def warmup():
+    """First inference allocates ORT buffers and maps the gallery; do it before taking traffic."""
+    started = time.perf_counter()
+    detect(face_app, np.zeros((DET_SIZE[1], DET_SIZE[0], 3), dtype=np.uint8))
+    size = face_app.models["recognition"].input_size[0]
+    embed_crops(face_app, [np.zeros((size, size, 3), dtype=np.uint8)])
+    for cache in shard_caches.values():
+        gallery = cache.get().gallery
+        gallery.match(np.zeros((1, gallery.matrix.shape[1]), dtype=np.float32))
+    ready.set()
+    print(f"✅ Warmed up in {time.perf_counter() - started:.1f}s (pid {os.getpid()})")
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Liveness: the process is up and answering."""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+@app.route("/ready", methods=["GET"])
+def ready_check():
+    """Readiness: 200 only after warmup, with the gallery versions this worker serves."""
+    if not ready.is_set():
+        return jsonify({"status": "warming up", "pid": os.getpid()}), 503
+    return jsonify({"status": "ready", "pid": os.getpid(),
+                    "gallery_version": {shard: cache.get().version for shard, cache in shard_caches.items()}})
 
-        student_embeddings = []
+# ------------------------------
+# TRAIN STATUS (shared by serve.py workers)
+# ------------------------------
+# /train runs in whichever worker got the request; /train/status and
+# /train/cancel may land on any other. The run's state lives next to the
+# gallery lock: TRAIN_STATUS_FILE is rewritten after every student, and
+# /train/cancel drops TRAIN_CANCEL_FILE, which the training worker polls.
+TRAIN_STATUS_FILE = os.path.join(GALLERY_DIR, "train.json")
+TRAIN_CANCEL_FILE = os.path.join(GALLERY_DIR, "train.cancel")
+TRAIN_CANCEL_POLL = 0.5  # seconds
+
+def write_train_status(running, progress, **extra):
+    tmp = f"{TRAIN_STATUS_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"running": running, "pid": os.getpid(), "progress": progress, **extra}, f)
+    os.replace(tmp, TRAIN_STATUS_FILE)
+
+def read_train_status():
+    try:
+        with open(TRAIN_STATUS_FILE) as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return {"running": False, "progress": {}}
+    if status.get("running"):
+        try:
+            os.kill(status["pid"], 0)
+        except (OSError, KeyError, TypeError):
+            status["running"] = False  # that worker died mid-run
+    return status
+
+def watch_train_cancel(enroller, done):
+    """Cancel `enroller` once TRAIN_CANCEL_FILE appears; stops when `done` is set."""
+    while not done.wait(TRAIN_CANCEL_POLL):
+        if os.path.exists(TRAIN_CANCEL_FILE):
+            enroller.cancel()
+            return
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-        for img_name in sorted(os.listdir(student_path)):
-            img_path = os.path.join(student_path, img_name)
-            if not os.path.isfile(img_path):
-                continue
-            img = cv2.imread(img_path)
-            if img is None:
+@app.route("/train", methods=["POST"])
+def train():
+    # one /train at a time across every worker process; the others see the
+    # new gallery on their next request (GalleryCache watches index.json)
+    if not gallery_lock.acquire(blocking=False):
+        return jsonify({"error": "Training already running"}), 409
+    done = threading.Event()
+    progress_now = None  # set once the run starts, so a rejected request leaves the last run's status
+    try:
+        _remove(TRAIN_CANCEL_FILE)  # left over from a cancel that arrived after the last run
+        try:
+            section = sections.canonical(request.values.get("section", SECTION))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        workers = request.values.get("workers", str(TRAIN_WORKERS))
+        if not workers.strip().isdigit() or int(workers) > MAX_TRAIN_WORKERS:
+            return jsonify({"error": f"workers must be 0 (in this process) to {MAX_TRAIN_WORKERS}"}), 400
+        workers = int(workers)
+        scope = sections.shards_for(section)
+        stores = open_stores()
+        todo, new_sigs, shard_of = [], {}, {}
+
+        for student_id in sorted(os.listdir(DB_FOLDER)):
+            student_path = os.path.join(DB_FOLDER, student_id)
+            if not os.path.isdir(student_path):
                 continue
-
-            faces = face_app.get(img)
-            if not faces:
+            shard = sections.shard_for(student_id)
+            if shard not in scope:
                 continue
 
-            for face in faces:
-                emb = face.embedding / np.linalg.norm(face.embedding)
-                student_embeddings.append(emb)
-
-        if student_embeddings:
-            embeddings_db[student_id] = student_embeddings
-            signatures[student_id] = current_sig
-            updated += 1
-        else:
-            embeddings_db.pop(student_id, None)
-            signatures.pop(student_id, None)
-            skipped_no_face += 1
-
-    save_db(embeddings_db, signatures)
-    return jsonify({
-        "status": "ok",
-        "updated": updated,
-        "skipped_no_face": skipped_no_face,
-        "total_students": len(embeddings_db)
-    })
+            store = stores[shard]
+            current_sig = compute_folder_signature(student_path) + templates_signature()
+            prev_sig = store.signatures.get(student_id)
+            if prev_sig == current_sig and student_id in store:
+                continue  # unchanged (same photos, same TEMPLATES_K)
+
+            new_sigs[student_id] = current_sig
+            shard_of[student_id] = shard
+            todo.append((student_id, list_images(student_path)))
+
+        # students whose folder now maps to another shard (sections.json changed)
+        for shard in scope:
+            for student_id in list(stores[shard].students):
+                if sections.shard_for(student_id) != shard:
+                    stores[shard].remove(student_id)
+
+        counts = {"updated": 0, "skipped_no_face": 0, "embeddings": 0, "templates": 0}
+
+        def on_student(student_id, student_embeddings):
+            # committed one student at a time, so a cancel keeps finished work
+            store = stores[shard_of[student_id]]
+            if student_embeddings:
+                templates = select_templates(student_embeddings, TEMPLATES_K, TEMPLATES_METHOD)
+                store.put(student_id, templates, new_sigs[student_id])
+                counts["updated"] += 1
+                counts["embeddings"] += len(student_embeddings)
+                counts["templates"] += len(templates)
+            else:
+                store.remove(student_id)
+                counts["skipped_no_face"] += 1
+
+        def on_progress(progress):
+            progress_now.update(progress)
+            write_train_status(True, progress, section=section)
+            print(f"🔄 Trained {progress['students_done']}/{progress['students_total']} students "
+                  f"({progress['images_per_second']} img/s)")
+
+        cache = EmbeddingCache(EMB_CACHE_DIR, pack_name(MODEL_NAME, FACE_INT8), DET_SIZE, mode="all",
+                               extra=train_gate.signature() if train_gate else "")
+        enroller = Enroller(face_app, workers=workers, decode_threads=DECODE_THREADS, gate=train_gate,
+                            model_name=MODEL_NAME, det_size=DET_SIZE, cache=cache)
+        progress_now = {}
+        write_train_status(True, progress_now, section=section)
+        threading.Thread(target=watch_train_cancel, args=(enroller, done), daemon=True).start()
+        with g.timer.stage("embed"):
+            stats = enroller.run(todo, on_student, on_progress)
+        progress_now.update(stats)
+        g.timer.set(images=stats["images_total"])
+        for result in ("hits", "misses"):
+            metrics.inc("train_embedding_cache_total", stats["cache"][result], result=result)
+
+        versions = {}
+        with g.timer.stage("index"):
+            for shard in scope:
+                update_store_index(stores[shard], GALLERY_INDEX, nprobe=ANN_NPROBE)
+                update_store_codec(stores[shard], GALLERY_CODEC)
+                versions[shard] = shard_caches[shard].publish(load_gallery(stores[shard])).version
+        return jsonify({
+            "status": "cancelled" if stats["cancelled"] else "ok",
+            "section": section,
+            "updated": counts["updated"],
+            "skipped_no_face": counts["skipped_no_face"],
+            "templates": {"k": TEMPLATES_K, "method": TEMPLATES_METHOD,
+                          "embeddings": counts["embeddings"], "kept": counts["templates"]},
+            "total_students": sum(len(stores[shard]) for shard in scope),
+            "gallery_version": versions,
+            "cache": stats["cache"],
+            "stats": stats
+        })
+    finally:
+        done.set()
+        if progress_now is not None:
+            write_train_status(False, progress_now)
+        _remove(TRAIN_CANCEL_FILE)
+        gallery_lock.release()
+
+@app.route("/train/status", methods=["GET"])
+def train_status():
+    status = read_train_status()
+    return jsonify({"running": status["running"], "progress": status.get("progress", {})})
+
+@app.route("/train/cancel", methods=["POST"])
+def train_cancel():
+    if not read_train_status()["running"]:
+        return jsonify({"error": "No training running"}), 409
+    with open(TRAIN_CANCEL_FILE, "w"):
+        pass
+    return jsonify({"status": "ok", "message": "Cancel requested"})
+
+@app.route("/gallery", methods=["GET"])
+def gallery_info():
+    return jsonify({shard: cache.get().info() for shard, cache in shard_caches.items()})
+
+detect_pool = ThreadPoolExecutor(DETECT_THREADS)
+tiler = TiledDetector(face_app.det_model, executor=ThreadPoolExecutor(TILE_THREADS))
+
+persist_pool = ThreadPoolExecutor(1)
+
+batcher = EmbedBatcher(lambda crops: embed_crops(face_app, crops), EMBED_BATCH,
+                       EMBED_BATCH_WAIT_MS) if EMBED_BATCH > 0 else None
+
+def embed_faces(crops):
+    """Embeddings of aligned crops, through the shared batcher when enabled."""
+    return batcher.embed(crops) if batcher is not None else embed_crops(face_app, crops)
+
+def use_tiling():
+    return request.values.get("tiled", "1" if TILED_DETECTION else "0").lower() in ("1", "true", "yes")
+
+def _write_upload(path, data):
+    tmp = f"{path}.part"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"⚠️ Could not save upload {path} ({e})")
+
+def read_upload(file, filename, tiled):
+    """Decode the upload from memory; the original is saved in the background if SAVE_UPLOADS."""
+    with g.timer.stage("upload"):
+        data = file.read()
+        if SAVE_UPLOADS:
+            persist_pool.submit(_write_upload, os.path.join(EXTRACTED, filename), data)
+    # tiling exists to see small faces, so it always gets the full-resolution image
+    with g.timer.stage("decode"):
+        img, _ = decode_image(data, None if tiled else DECODE_MIN_SIDE)
+    return img
 
 @app.route("/recognize", methods=["POST"])
 def recognize():
@@ -174,84 +560,275 @@ def recognize():
         return jsonify({"error": "File type not allowed"}), 400
 
     filename = secure_filename(file.filename)
-    save_path = os.path.join(EXTRACTED, filename)
-    file.save(save_path)
-
-    img = cv2.imread(save_path)
+    tiled = use_tiling()
+    img = read_upload(file, filename, tiled)
     if img is None:
         return jsonify({"error": "Could not read image"}), 400
 
-    embeddings_db, _ = load_db()
-    faces = face_app.get(img)
-    results = []
-    marked_rolls = []
+    unique = request.form.get("unique", "0").lower() in ("1", "true", "yes")
+    try:
+        section = request_section(required=wants_record())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    timer = g.timer
+    with timer.stage("gallery"):
+        gallery, gallery_version = section_gallery(section)
+    timer.set(section=section, tiled=tiled, gallery_embeddings=gallery.size)
+    # detector + recognition only; the landmark / gender-age models aren't needed here
+    detection = {}
+    with timer.stage("detect"):
+        bboxes, kpss = detect(face_app, img, tiler=tiler if tiled else None, stats=detection)
+    timer.count("faces", len(bboxes))
+    with timer.stage("quality"):
+        bboxes, kpss, quality = gate_faces(img, bboxes, kpss)
+    results, matches = [], []
+
+    if len(bboxes):
+        t0 = time.perf_counter()
+        with timer.stage("align"):
+            crops = align(face_app, img, kpss)
+        t1 = time.perf_counter()
+        with timer.stage("embed"):
+            face_embs = embed_faces(crops)
+        t2 = time.perf_counter()
+        with timer.stage("crops"):
+            face_files, embeddings = save_faces(img, os.path.splitext(filename)[0], bboxes, kpss, face_embs)
+        if quality is not None:
+            quality["saved_ms_est"] = quality_savings(
+                quality, {"align": t1 - t0, "embed": t2 - t1, "crops": time.perf_counter() - t2})
+
+        with timer.stage("match"):
+            matches = gallery.match(embeddings, unique=unique)
+        for face_file, (student, score) in zip(face_files, matches):
+            results.append({
+                "face_file": face_file,
+                "assigned_label": student,
+                "similarity": round(score, 3)
+            })
+
+    try:
+        session_id, marked_rolls, recorded = attendance_response(section, "recognize", matches)
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if not faces:
-        return jsonify({"status": "ok", "results": [], "marked_rolls": []})
+    return jsonify({
+        "status": "ok",
+        "session_id": session_id,
+        "recorded": recorded,
+        "results": results,
+        "marked_rolls": marked_rolls,
+        "section": section,
+        "gallery_version": gallery_version,
+        "detection": detection,
+        "quality": quality,
+        "message": f"{len(marked_rolls)} students " + ("marked present" if recorded else "recognised")
+    })
 
-    for i, face in enumerate(faces, 1):
-        x1, y1, x2, y2 = map(int, face.bbox)
-        crop = img[y1:y2, x1:x2]
-        if crop.size == 0:
-            continue
-        crop_resized = cv2.resize(crop, (160, 160))
-        face_file = f"{os.path.splitext(filename)[0]}_face{i}.jpg"
-        cv2.imwrite(os.path.join(EXTRACTED, face_file), crop_resized)
-
-        student, score = recognize_face(face.embedding, embeddings_db)
-        results.append({
-            "face_file": face_file,
-            "assigned_label": student,
-            "similarity": round(score, 3)
-        })
+@app.route("/recognize_batch", methods=["POST"])
+def recognize_batch():
+    """Several photos of one class: one merged attendance, each student's best detection kept."""
+    files = [f for f in request.files.getlist("files") + request.files.getlist("file") if f.filename]
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
+    if len(files) > MAX_BATCH_PHOTOS:
+        return jsonify({"error": f"At most {MAX_BATCH_PHOTOS} photos per batch"}), 400
+    if not all(allowed_file(f.filename) for f in files):
+        return jsonify({"error": "File type not allowed"}), 400
 
-        # extract roll number
-        m = re.search(r'AD0*([0-9]+)', student)
-        if m:
-            marked_rolls.append(int(m.group(1)))
+    unique = request.form.get("unique", "0").lower() in ("1", "true", "yes")
+    try:
+        section = request_section(required=wants_record())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    timer = g.timer
+    with timer.stage("gallery"):
+        gallery, gallery_version = section_gallery(section)
+    timer.set(section=section, photos=len(files), gallery_embeddings=gallery.size)
+
+    started = time.perf_counter()
+    tiled = use_tiling()
+    stems, imgs = [], []
+    for i, file in enumerate(files):
+        filename = secure_filename(file.filename)
+        stem = os.path.splitext(filename)[0]
+        if stem in stems:  # phones reuse names like image.jpg
+            stem = f"{stem}_{i}"
+            filename = stem + os.path.splitext(filename)[1]
+        img = read_upload(file, filename, tiled)
+        if img is None:
+            return jsonify({"error": f"Could not read image {file.filename}"}), 400
+        stems.append(stem)
+        imgs.append(img)
+
+    # detection in parallel across photos, then one recognition batch over all faces
+    detection = []
+    with timer.stage("detect_embed"):
+        detections = detect_and_embed_many(face_app, imgs, detect_pool, tiler=tiler if tiled else None,
+                                           stats=detection, embed=embed_faces,
+                                           select=gate_faces if recognize_gate else None)
+    infer_seconds = time.perf_counter() - started
+    timer.count("faces", sum(len(bboxes) for bboxes, _, _ in detections))
+
+    photos = []
+    with timer.stage("crops"):
+        for stem, img, (bboxes, kpss, face_embs) in zip(stems, imgs, detections):
+            face_files, embeddings = save_faces(img, stem, bboxes, kpss, face_embs)
+            photos.append({"photo": stem, "face_files": face_files, "embeddings": embeddings})
+
+    with timer.stage("match"):
+        if unique:
+            # one face per student within a photo; the same student may appear in several
+            matches = [m for p in photos for m in gallery.match(p["embeddings"], unique=True)]
+        else:
+            matches = gallery.match([e for p in photos for e in p["embeddings"]])
 
-    # Save attendance CSV
-    save_attendance_csv(marked_rolls)
+    best = {}
+    results = []
+    it = iter(matches)
+    for p in photos:
+        photo_results = []
+        for face_file in p["face_files"]:
+            student, score = next(it)
+            photo_results.append({"face_file": face_file, "assigned_label": student,
+                                  "similarity": round(score, 3)})
+            if student != "Unknown" and score > best.get(student, {}).get("similarity", -2.0):
+                best[student] = {"assigned_label": student, "similarity": round(score, 3),
+                                 "photo": p["photo"], "face_file": face_file}
+        results.append({"photo": p["photo"], "faces": len(photo_results), "results": photo_results})
+    for photo, photo_detection in zip(results, detection):
+        quality = photo_detection.pop("quality", None)
+        if photo_detection:
+            photo["detection"] = photo_detection
+        if quality is not None:
+            photo["quality"] = quality
+
+    students = sorted(best.values(), key=lambda r: r["assigned_label"])
+    try:
+        session_id, marked_rolls, recorded = attendance_response(
+            section, "recognize_batch", [(s["assigned_label"], s["similarity"]) for s in students])
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    elapsed = time.perf_counter() - started
 
     return jsonify({
         "status": "ok",
-        "results": results,
+        "session_id": session_id,
+        "recorded": recorded,
+        "photos": results,
+        "students": students,
         "marked_rolls": marked_rolls,
-        "message": f"{len(marked_rolls)} students marked present"
+        "section": section,
+        "gallery_version": gallery_version,
+        "timing": {"inference_seconds": round(infer_seconds, 3),
+                   "total_seconds": round(elapsed, 3),
+                   "ms_per_photo": round(1000 * elapsed / len(imgs), 1)},
+        "message": f"{len(marked_rolls)} students " + ("marked present" if recorded else "recognised")
     })
+
 @app.route("/mark_manual", methods=["POST"])
 def mark_manual():
     """
-    Receives JSON: { "rolls": [6, 11, 22], "section": "A" }
-    Saves the marked rolls to CSV, overwriting previous entries.
+    Receives JSON: { "rolls": [6, 11, 22], "section": "A", "session_id": 12 }
+    Records the rolls as a new manual session (the app's "save" after a
+    /recognize preview), or adds them to `session_id` (e.g. corrections to
+    a session recorded with record=1). `section` is required.
     """
     data = request.get_json()
     if not data or "rolls" not in data:
         return jsonify({"error": "No rolls provided"}), 400
 
-    rolls = data["rolls"]
-    section = data.get("section", "ALL")
+    try:
+        rolls = sorted({int(r) for r in data["rolls"]})
+    except (TypeError, ValueError):
+        return jsonify({"error": "rolls must be integers"}), 400
+    try:
+        if not str(data.get("section") or "").strip():
+            raise ValueError("section is required to record attendance")
+        section = sections.canonical(str(data["section"]))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     # Optional: filter rolls by section if needed
-    if section == "A":
-        rolls = [r for r in rolls if 1 <= r <= 64]
-    elif section == "B":
-        rolls = [r for r in rolls if 65 <= r <= 127]
-    elif section == "C":
-        rolls = [r for r in rolls if r >= 128]
-
-    # Save CSV
-    with open(ATTENDANCE_CSV, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["roll_number", "present"])
-        for roll in rolls:
-            writer.writerow([roll, "Yes"])
+    if section != "ALL":
+        scope = sections.shards_for(section)
+        rolls = [r for r in rolls if sections.shard_for_number(r) in scope]
+
+    try:
+        session_id = ledger.record(section, "manual", [(r, None, None) for r in rolls],
+                                   session_id=data.get("session_id"))
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     return jsonify({
         "status": "ok",
+        "session_id": session_id,
+        "marked_rolls": rolls,
         "message": f"{len(rolls)} students marked present manually"
     })
 
+# ------------------------------
+# ATTENDANCE REPORTS
+# ------------------------------
+@app.route("/sessions", methods=["GET"])
+def list_sessions():
+    try:
+        section = query_section()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(ledger.sessions(section=section, day=request.args.get("date"),
+                                   limit=request.args.get("limit", 100, type=int)))
+
+@app.route("/sessions/<int:session_id>", methods=["GET"])
+def session_report(session_id):
+    report = ledger.session_report(session_id)
+    if report is None:
+        return jsonify({"error": f"Unknown session {session_id}"}), 404
+    return jsonify(report)
+
+@app.route("/students/<int:roll>/attendance", methods=["GET"])
+def student_report(roll):
+    return jsonify(ledger.student_report(roll, since=request.args.get("since"),
+                                         until=request.args.get("until")))
+
+@app.route("/students/<int:roll>/summary", methods=["GET"])
+def student_summary(roll):
+    """Percentage, streak and shortfall vs ?target= (default 75%) from the running counters."""
+    return jsonify(ledger.student_summary(roll, target=request.args.get("target", TARGET_PERCENT, type=float)))
+
+@app.route("/reports/attendance.csv", methods=["GET"])
+def attendance_report():
+    """Streamed per-student report; ?section= (ALL: everyone), ?target=, ?below= (only students under that %)."""
+    try:
+        section = query_section()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = ledger.report_csv(section=None if section == "ALL" else section,
+                             target=request.args.get("target", TARGET_PERCENT, type=float),
+                             below=request.args.get("below", type=float))
+    return Response(rows, mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=attendance_report.csv"})
+
+@app.route("/attendance.csv", methods=["GET"])
+def export_attendance():
+    """Streamed CSV of marks, filtered by ?session=, ?section=, ?since=, ?until= (YYYY-MM-DD)."""
+    try:
+        section = query_section()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = ledger.export_csv(session_id=request.args.get("session", type=int),
+                             section=section,
+                             since=request.args.get("since"), until=request.args.get("until"))
+    return Response(rows, mimetype="text/csv",
+                    headers={"Content-Disposition": "attachment; filename=attendance.csv"})
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    # development server; `python serve.py --workers N` for several processes
+    warmup()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), threaded=True)
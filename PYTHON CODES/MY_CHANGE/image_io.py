@@ -0,0 +1,63 @@
+import struct
+
+import cv2
+import numpy as np
+
+# ------------------------------
+# IN-MEMORY DECODE
+# ------------------------------
+# Uploads are decoded straight from the request bytes. For JPEGs much
+# larger than the detector needs, libjpeg can decode at 1/2, 1/4 or 1/8
+# scale (IMREAD_REDUCED_*), which skips most of the IDCT work; the size
+# is read from the JPEG header first so the factor is chosen before any
+# pixel is decoded.
+_REDUCED = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) don't
+_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(data: bytes):
+    """(width, height) from a JPEG header, or None if `data` isn't a readable JPEG."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7):
+            i += 2
+            continue
+        (length,) = struct.unpack(">H", data[i + 2:i + 4])
+        if marker in _SOF:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def reduce_factor(size, min_side):
+    """Largest 1/2/4/8 downscale that keeps the long side at least `min_side`."""
+    if not size or not min_side:
+        return 1
+    long_side = max(size)
+    for factor in (8, 4, 2):
+        if long_side / factor >= min_side:
+            return factor
+    return 1
+
+
+def decode_image(data: bytes, min_side=None):
+    """Decode upload bytes; returns (img or None, factor the image was reduced by)."""
+    buf = np.frombuffer(data, np.uint8)
+    factor = reduce_factor(jpeg_size(data), min_side)
+    if factor > 1:
+        img = cv2.imdecode(buf, _REDUCED[factor])
+        if img is not None:
+            return img, factor
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR), 1
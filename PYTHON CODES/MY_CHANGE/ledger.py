@@ -0,0 +1,371 @@
+import csv
+import io
+import math
+import sqlite3
+import threading
+from datetime import datetime
+
+# ------------------------------
+# ATTENDANCE LEDGER (SQLite, WAL)
+# ------------------------------
+# Append-only history: every /mark_manual call (and /recognize or
+# /recognize_batch with record=1; without it they only preview) opens a
+# session (who, when, which section) and bulk-inserts one mark per student
+# in a single transaction. Nothing is overwritten; reports and
+# CSV exports are queries over this history. WAL lets report queries run
+# while recognitions are being written.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS students (
+    roll INTEGER PRIMARY KEY,
+    label TEXT,
+    name TEXT,
+    section TEXT REFERENCES sections(name)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    section TEXT NOT NULL,
+    source TEXT NOT NULL,
+    day TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    note TEXT
+);
+CREATE TABLE IF NOT EXISTS marks (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    roll INTEGER NOT NULL REFERENCES students(roll),
+    label TEXT,
+    similarity REAL,
+    marked_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS marks_by_session ON marks(session_id, roll);
+CREATE INDEX IF NOT EXISTS marks_by_student ON marks(roll, session_id);
+CREATE INDEX IF NOT EXISTS sessions_by_section_day ON sessions(section, day);
+CREATE INDEX IF NOT EXISTS sessions_by_day ON sessions(day);
+
+-- incrementally maintained counters (see "counters" below); rebuild_counters()
+-- recomputes them from sessions/marks
+CREATE TABLE IF NOT EXISTS section_counters (
+    section TEXT PRIMARY KEY,
+    held INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS session_seq (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    section TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (session_id, section)
+);
+CREATE TABLE IF NOT EXISTS student_counters (
+    roll INTEGER PRIMARY KEY REFERENCES students(roll),
+    section TEXT NOT NULL,
+    attended INTEGER NOT NULL DEFAULT 0,
+    streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    last_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS student_counters_by_section ON student_counters(section, roll);
+"""
+
+EXPORT_HEADER = ["session_id", "day", "started_at", "section", "source", "roll", "label", "similarity"]
+REPORT_HEADER = ["roll", "name", "section", "held", "attended", "percentage", "streak", "best_streak",
+                 "sessions_needed", "can_miss"]
+TARGET_PERCENT = 75.0
+NO_SECTION = ""  # counters key for rolls outside every section (only ALL sessions count for them)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Ledger:
+    def __init__(self, path, sections=None):
+        self.path = path
+        self.sections = sections
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            if sections is not None:
+                conn.executemany("INSERT OR IGNORE INTO sections(name) VALUES (?)",
+                                 [(name,) for name in sections.names])
+            stale = conn.execute("SELECT EXISTS(SELECT 1 FROM sessions) "
+                                 "AND NOT EXISTS(SELECT 1 FROM session_seq)").fetchone()[0]
+        if stale:  # ledger written before the counters existed
+            print(f"🔄 Rebuilt attendance counters from {self.rebuild_counters()} sessions")
+
+    def _conn(self):
+        """One connection per thread; used as a context manager it is one transaction."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        """The thread's connection in a write transaction taken up front: BEGIN IMMEDIATE.
+
+        A deferred transaction that reads first can't upgrade its lock when
+        another serve.py worker is writing (SQLITE_BUSY, not retried by the
+        busy timeout); IMMEDIATE waits for the write lock instead. Use as
+        `with self._write() as conn:`, which commits or rolls back.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def _section_of(self, roll):
+        return self.sections.shard_for_number(roll) if self.sections is not None else None
+
+    def _canonical(self, section):
+        """Session section as counted: sections.json spelling or ALL (older rows may say 'a', 'all')."""
+        if self.sections is None:
+            return "ALL" if section.strip().upper() == "ALL" else section
+        try:
+            return self.sections.canonical(section)
+        except ValueError:
+            return section  # a section since removed from sections.json
+
+    # ------------------------------
+    # writes
+    # ------------------------------
+    def record(self, section, source, marks, session_id=None, note=None):
+        """Store `marks` = [(roll, label, similarity), ...] in a new session
+        (or an existing `session_id` of the same section); returns the session id.
+
+        KeyError for an unknown session_id, ValueError for one of another section.
+        """
+        now = _now()
+        with self._write() as conn:
+            if session_id is None:
+                session_id = conn.execute(
+                    "INSERT INTO sessions(section, source, day, started_at, note) VALUES (?, ?, ?, ?, ?)",
+                    (section, source, now[:10], now, note)).lastrowid
+                self._count_session(conn, session_id, section)
+            else:
+                row = conn.execute("SELECT section FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                if row is None:
+                    raise KeyError(f"Unknown session {session_id}")
+                if self._canonical(row[0]) != self._canonical(section):
+                    raise ValueError(f"Session {session_id} is for section {row[0]!r}, not {section!r}")
+            conn.executemany(
+                "INSERT INTO students(roll, label, section) VALUES (?, ?, ?) "
+                "ON CONFLICT(roll) DO UPDATE SET label = COALESCE(excluded.label, students.label)",
+                [(roll, label, self._section_of(roll)) for roll, label, _ in marks])
+            first_marks = [roll for roll, _, _ in marks if conn.execute(
+                "SELECT 1 FROM marks WHERE session_id = ? AND roll = ?", (session_id, roll)).fetchone() is None]
+            conn.executemany(
+                "INSERT INTO marks(session_id, roll, label, similarity, marked_at) VALUES (?, ?, ?, ?, ?)",
+                [(session_id, roll, label, similarity, now) for roll, label, similarity in marks])
+            for roll in dict.fromkeys(first_marks):
+                self._count_mark(conn, session_id, roll)
+        return session_id
+
+    def import_students(self, rows):
+        """Names from a roster, rows = [(roll, name), ...]."""
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT INTO students(roll, name, section) VALUES (?, ?, ?) "
+                "ON CONFLICT(roll) DO UPDATE SET name = excluded.name",
+                [(roll, name, self._section_of(roll)) for roll, name in rows])
+
+    # ------------------------------
+    # counters
+    # ------------------------------
+    # A session of section S counts as held for S; an ALL session for every
+    # section. Only marks in a session held for the student's own section
+    # count as attended (a roll marked in another section's session does
+    # not), so attended never exceeds held. session_seq gives each session
+    # its position in each affected
+    # section's timeline, so a student's streak is extended when they attend
+    # the session right after their last attended one (last_seq + 1), and is
+    # current only while last_seq equals their section's held count. Marks
+    # added late to an older session update `attended` but not the streak;
+    # rebuild_counters() replays everything in order.
+    def _count_session(self, conn, session_id, section):
+        section = self._canonical(section)
+        targets = ([name for name in self.sections.names] + [NO_SECTION]
+                   if section == "ALL" and self.sections is not None else
+                   [NO_SECTION] if section == "ALL" else [section])
+        for name in targets:
+            conn.execute("INSERT INTO section_counters(section, held) VALUES (?, 1) "
+                         "ON CONFLICT(section) DO UPDATE SET held = held + 1", (name,))
+            held = conn.execute("SELECT held FROM section_counters WHERE section = ?", (name,)).fetchone()[0]
+            conn.execute("INSERT INTO session_seq(session_id, section, seq) VALUES (?, ?, ?)",
+                         (session_id, name, held))
+
+    def _count_mark(self, conn, session_id, roll):
+        section = self._section_of(roll) or NO_SECTION
+        row = conn.execute("SELECT seq FROM session_seq WHERE session_id = ? AND section = ?",
+                           (session_id, section)).fetchone()
+        conn.execute("INSERT OR IGNORE INTO student_counters(roll, section) VALUES (?, ?)", (roll, section))
+        if row is None:
+            return  # marked in another section's session: not held for this student
+        seq = row[0]
+        conn.execute("UPDATE student_counters SET attended = attended + 1 WHERE roll = ?", (roll,))
+        conn.execute(
+            "UPDATE student_counters SET "
+            "streak = CASE WHEN last_seq = ? - 1 THEN streak + 1 ELSE 1 END, "
+            "best_streak = MAX(best_streak, CASE WHEN last_seq = ? - 1 THEN streak + 1 ELSE 1 END), "
+            "last_seq = ? WHERE roll = ? AND last_seq < ?", (seq, seq, seq, roll, seq))
+
+    def rebuild_counters(self):
+        """Recompute every counter from the raw sessions and marks."""
+        with self._write() as conn:
+            conn.execute("DELETE FROM student_counters")
+            conn.execute("DELETE FROM session_seq")
+            conn.execute("DELETE FROM section_counters")
+            sessions = conn.execute("SELECT id, section FROM sessions ORDER BY id").fetchall()
+            for session in sessions:
+                self._count_session(conn, session["id"], session["section"])
+                for (roll,) in conn.execute("SELECT DISTINCT roll FROM marks WHERE session_id = ? ORDER BY roll",
+                                            (session["id"],)).fetchall():
+                    self._count_mark(conn, session["id"], roll)
+        return len(sessions)
+
+    @staticmethod
+    def _summary(row, held, target=TARGET_PERCENT):
+        attended = row["attended"] if row else 0
+        t = target / 100.0
+        needed = max(0, math.ceil((t * held - attended) / (1 - t))) if t < 1 else None
+        return {
+            "held": held,
+            "attended": attended,
+            "percentage": round(100.0 * attended / held, 1) if held else None,
+            "streak": row["streak"] if row and row["last_seq"] == held else 0,
+            "best_streak": row["best_streak"] if row else 0,
+            "sessions_needed": needed,  # consecutive attendances to reach `target`
+            "can_miss": max(0, math.floor((attended - t * held) / t)) if t > 0 else None,
+        }
+
+    def student_summary(self, roll, target=TARGET_PERCENT):
+        """Percentage, current/best streak and shortfall vs `target`% from the counters (O(1))."""
+        conn = self._conn()
+        section = self._section_of(roll) or NO_SECTION
+        row = conn.execute("SELECT * FROM student_counters WHERE roll = ?", (roll,)).fetchone()
+        held = conn.execute("SELECT held FROM section_counters WHERE section = ?", (section,)).fetchone()
+        name = conn.execute("SELECT name FROM students WHERE roll = ?", (roll,)).fetchone()
+        return {"roll": roll, "name": name[0] if name else None, "section": section or None,
+                "target_percent": target, **self._summary(row, held[0] if held else 0, target)}
+
+    def section_report_rows(self, section=None, target=TARGET_PERCENT, below=None):
+        """REPORT_HEADER rows for every known student of `section` (all if None), streamed."""
+        sql = ("SELECT st.roll, st.name, COALESCE(st.section, '') AS section, "
+               "c.attended, c.streak, c.best_streak, c.last_seq, COALESCE(sc.held, 0) AS held "
+               "FROM students st "
+               "LEFT JOIN student_counters c ON c.roll = st.roll "
+               "LEFT JOIN section_counters sc ON sc.section = COALESCE(st.section, '')")
+        args = []
+        if section is not None:
+            sql += " WHERE COALESCE(st.section, '') = ?"
+            args.append(section)
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(sql + " ORDER BY st.roll", args):
+                summary = self._summary(row if row["attended"] is not None else None, row["held"], target)
+                if below is not None and (summary["percentage"] or 0.0) >= below:
+                    continue
+                yield [row["roll"], row["name"], row["section"] or None] + [summary[k] for k in REPORT_HEADER[3:]]
+        finally:
+            conn.close()
+
+    # ------------------------------
+    # queries
+    # ------------------------------
+    def sessions(self, section=None, day=None, limit=100):
+        sql, args = "SELECT s.*, COUNT(DISTINCT m.roll) AS present FROM sessions s " \
+                    "LEFT JOIN marks m ON m.session_id = s.id WHERE 1=1", []
+        if section:
+            sql += " AND UPPER(s.section) = UPPER(?)"  # rows from before sections were canonical
+            args.append(section)
+        if day:
+            sql += " AND s.day = ?"
+            args.append(day)
+        sql += " GROUP BY s.id ORDER BY s.id DESC LIMIT ?"
+        args.append(limit)
+        return [dict(r) for r in self._conn().execute(sql, args)]
+
+    def session_report(self, session_id):
+        conn = self._conn()
+        session = conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if session is None:
+            return None
+        marks = conn.execute(
+            "SELECT m.roll, m.label, st.name, MAX(m.similarity) AS similarity, MIN(m.marked_at) AS marked_at "
+            "FROM marks m JOIN students st ON st.roll = m.roll WHERE m.session_id = ? "
+            "GROUP BY m.roll ORDER BY m.roll", (session_id,)).fetchall()
+        return {**dict(session), "present": [dict(r) for r in marks]}
+
+    def student_report(self, roll, since=None, until=None):
+        """Sessions of the student's section (and ALL) held vs attended in [since, until].
+
+        Same rule as the counters: marks in other sections' sessions don't count.
+        """
+        conn = self._conn()
+        student = conn.execute("SELECT * FROM students WHERE roll = ?", (roll,)).fetchone()
+        section = student["section"] if student else self._section_of(roll)
+        # UPPER: sessions recorded before section names were canonical ('a', 'all')
+        where, args = "(UPPER(s.section) = UPPER(?) OR UPPER(s.section) = 'ALL')", [section]
+        if since:
+            where += " AND s.day >= ?"
+            args.append(since)
+        if until:
+            where += " AND s.day <= ?"
+            args.append(until)
+        held = conn.execute(f"SELECT COUNT(*) FROM sessions s WHERE {where}", args).fetchone()[0]
+        attended = conn.execute(
+            f"SELECT s.id, s.day, s.started_at, s.source, MAX(m.similarity) AS similarity "
+            f"FROM sessions s JOIN marks m ON m.session_id = s.id AND m.roll = ? "
+            f"WHERE {where} GROUP BY s.id ORDER BY s.id", [roll] + args).fetchall()
+        return {
+            "roll": roll,
+            "name": student["name"] if student else None,
+            "section": section,
+            "sessions_held": held,
+            "sessions_attended": len(attended),
+            "percentage": round(100.0 * len(attended) / held, 1) if held else None,
+            "attended": [dict(r) for r in attended],
+        }
+
+    def export_rows(self, session_id=None, section=None, since=None, until=None):
+        """Marks joined with their session, oldest first; a generator, so exports stream."""
+        sql = ("SELECT s.id, s.day, s.started_at, s.section, s.source, m.roll, m.label, m.similarity "
+               "FROM marks m JOIN sessions s ON s.id = m.session_id WHERE 1=1")
+        args = []
+        for clause, value in (("s.id = ?", session_id), ("UPPER(s.section) = UPPER(?)", section),
+                              ("s.day >= ?", since), ("s.day <= ?", until)):
+            if value is not None:
+                sql += f" AND {clause}"
+                args.append(value)
+        # a dedicated connection: the generator may outlive the request thread's transaction
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            yield from conn.execute(sql + " ORDER BY s.id, m.roll", args)
+        finally:
+            conn.close()
+
+    def export_csv(self, **filters):
+        """CSV text in chunks (header first), for a streamed HTTP response."""
+        return stream_csv(EXPORT_HEADER, self.export_rows(**filters))
+
+    def report_csv(self, **filters):
+        return stream_csv(REPORT_HEADER, self.section_report_rows(**filters))
+
+
+def stream_csv(header, rows, chunk=1000):
+    """CSV text in chunks of `chunk` rows, header first."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % chunk == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
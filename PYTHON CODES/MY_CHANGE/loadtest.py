@@ -0,0 +1,129 @@
+"""Load test for /recognize: throughput and latency under concurrent clients.
+
+    python loadtest.py --url http://localhost:5000 --image class.jpg --concurrency 8
+    python loadtest.py --image class.jpg --scale 1 2 4     # serve.py per worker count
+
+--url runs against a server you started (requests are previews, so its
+ledger is left alone). --scale starts serve.py itself for each worker
+count, with a throwaway ledger, and prints the throughput speedup.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import requests
+
+
+def run_load(url, data, filename, concurrency, seconds, section=None):
+    """`concurrency` clients posting the same photo back to back for `seconds`."""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                r = session.post(f"{url}/recognize", files={"file": (filename, data)},
+                                 data={"section": section} if section else None, timeout=120)
+                status = r.status_code
+            except requests.RequestException:
+                status = "error"
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    ms = 1000 * np.array(latencies) if latencies else np.zeros(1)
+    return {"concurrency": concurrency, "requests": len(latencies), "seconds": round(elapsed, 1),
+            "rps": round(statuses.get(200, 0) / elapsed, 2),
+            "p50_ms": round(float(np.percentile(ms, 50)), 1), "p95_ms": round(float(np.percentile(ms, 95)), 1),
+            "p99_ms": round(float(np.percentile(ms, 99)), 1),
+            "status": {str(k): v for k, v in sorted(statuses.items(), key=str)}}
+
+
+def wait_ready(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/ready", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def scale(workers_list, port, data, filename, concurrency, seconds, section):
+    """serve.py with each worker count in turn; clients = max(concurrency, 2 x workers)."""
+    tmp = tempfile.mkdtemp(prefix="loadtest_")
+    env = dict(os.environ, LEDGER_DB=os.path.join(tmp, "attendance.db"), SAVE_UPLOADS="0", LOG_REQUESTS="0")
+    url = f"http://127.0.0.1:{port}"
+    rows = []
+    for workers in workers_list:
+        log_path = os.path.join(tmp, f"serve_{workers}.log")
+        with open(log_path, "w") as log:
+            server = subprocess.Popen([sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1",
+                                       "--port", str(port)], env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            if not wait_ready(url, 300):
+                print(f"⚠️ serve.py --workers {workers} never became ready, see {log_path}", file=sys.stderr)
+                continue
+            run_load(url, data, filename, workers, min(seconds, 5), section)  # warm every worker
+            row = run_load(url, data, filename, max(concurrency, 2 * workers), seconds, section)
+            rows.append({"workers": workers, **row})
+            print(f"✅ {workers} worker(s): {row['rps']} req/s, p95 {row['p95_ms']} ms", file=sys.stderr)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(60)
+    for row in rows:
+        row["speedup"] = round(row["rps"] / rows[0]["rps"], 2) if rows[0]["rps"] else None
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--image", required=True, help="photo to upload, e.g. a class photo")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--scale", type=int, nargs="+", help="start serve.py with each of these worker counts")
+    parser.add_argument("--port", type=int, default=5055, help="port for --scale servers")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--section")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        data = f.read()
+    filename = os.path.basename(args.image)
+    if args.scale:
+        rows = scale(args.scale, args.port, data, filename, args.concurrency, args.seconds, args.section)
+    else:
+        rows = [run_load(args.url, data, filename, args.concurrency, args.seconds, args.section)]
+
+    cols = [c for c in ("workers", "concurrency", "requests", "rps", "speedup", "p50_ms", "p95_ms", "p99_ms")
+            if any(c in row for row in rows)]
+    print("".join(f"{c:>12}" for c in cols))
+    for row in rows:
+        print("".join(f"{row.get(c, ''):>12}" for c in cols))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import numpy as np
+
+# ------------------------------
+# GALLERY MATCHING
+# ------------------------------
+def normalize_rows(x):
+    """L2-normalize each row as float32 (zero rows are left as zeros)."""
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 1:
+        x = x[None, :]
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+class Gallery:
+    """All reference embeddings as one contiguous unit-norm float32 matrix.
+
+    Rows of one student are stored together: student `i` owns rows
+    `offsets[i] : offsets[i] + counts[i]` (offsets ascending), and
+    `row_owner` maps each row back to its student index. Rows that belong
+    to nobody (dead space in a GalleryStore file) have owner -1 and are
+    never matched.
+
+    When `coarse` is set (a gallery_codec.CoarseRows copy of the rows)
+    the first pass scans it instead of `matrix`, and each face's best
+    `rerank` rows are then re-scored exactly.
+    """
+
+    def __init__(self, ids, matrix, offsets, counts):
+        self.ids = list(ids)
+        self.matrix = matrix
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.index = None
+        self.coarse = None
+        self.rerank = 64
+        owners = np.arange(len(self.ids))
+        live = int(self.counts.sum())
+        if live == matrix.shape[0]:
+            self.row_owner = np.repeat(owners, self.counts)
+            self.dead = None
+        else:
+            starts = np.cumsum(self.counts) - self.counts
+            rows = np.arange(live) + np.repeat(self.offsets - starts, self.counts)
+            self.row_owner = np.full(matrix.shape[0], -1, dtype=np.int64)
+            self.row_owner[rows] = np.repeat(owners, self.counts)
+            self.dead = self.row_owner < 0
+
+    @classmethod
+    def from_db(cls, embeddings_db):
+        """Build from {student_id: [emb, ...] or emb} (hi5 / hi4_buffalo format)."""
+        ids, blocks, counts = [], [], []
+        for sid, ref_emb_list in embeddings_db.items():
+            if not isinstance(ref_emb_list, list):
+                ref_emb_list = [ref_emb_list]
+            if not ref_emb_list:
+                continue
+            ids.append(sid)
+            blocks.append(np.asarray(ref_emb_list, dtype=np.float32).reshape(len(ref_emb_list), -1))
+            counts.append(len(ref_emb_list))
+        if blocks:
+            matrix = np.ascontiguousarray(normalize_rows(np.vstack(blocks)))
+        else:
+            matrix = np.zeros((0, 512), dtype=np.float32)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]) if counts else []
+        return cls(ids, matrix, offsets, counts)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def size(self):
+        """Number of live embeddings."""
+        return int(self.counts.sum())
+
+    def scores(self, embeddings):
+        """Cosine similarity of every query against every gallery row, (faces, rows).
+
+        With `coarse`, rows outside a face's `rerank` best keep their
+        approximate score.
+        """
+        queries = normalize_rows(embeddings)
+        if self.coarse is None:
+            sims = queries @ self.matrix.T
+        else:
+            n_rows = self.matrix.shape[0]
+            covered = min(self.coarse.rows, n_rows)
+            sims = np.empty((len(queries), n_rows), dtype=np.float32)
+            sims[:, :covered] = self.coarse.scores(queries, covered)
+            # rows added after the copy was written are scored exactly
+            sims[:, covered:] = queries @ np.asarray(self.matrix[covered:]).T
+        if self.dead is not None:
+            sims[:, self.dead] = -np.inf
+        if self.coarse is not None and self.rerank > 0:
+            self._rerank(queries, sims)
+        return sims
+
+    def _rerank(self, queries, sims):
+        """Exact float32 scores for the union of every face's `rerank` best rows, in place."""
+        k = min(self.rerank, sims.shape[1])
+        top = np.unique(np.argpartition(-sims, k - 1, axis=1)[:, :k])
+        top = top[self.row_owner[top] >= 0]
+        if top.size:
+            sims[:, top] = queries @ np.asarray(self.matrix[top], dtype=np.float32).T
+
+    def student_scores(self, embeddings):
+        """Best similarity of every query against every student, (faces, students)."""
+        return np.maximum.reduceat(self.scores(embeddings), self.offsets, axis=1)
+
+    def match(self, embeddings, threshold=0.35, unique=False):
+        """Return one (label, score) per query embedding.
+
+        With `unique=True` a student can be given to at most one face of the
+        photo: (face, student) pairs are taken best-first, and a face whose
+        student was claimed by a stronger match falls back to its next free
+        candidate above `threshold`, or to "Unknown".
+
+        When `index` is set (an ann_index.IVFIndex over the same rows) only
+        its candidate rows are scored.
+        """
+        return match_gallery(self, embeddings, threshold, unique)
+
+    def best(self, embeddings):
+        """Best student index (-1 if none) and score for every query."""
+        n_faces = len(embeddings)
+        if len(self.ids) == 0:
+            return np.full(n_faces, -1), np.full(n_faces, -1.0)
+        if self.index is not None:
+            owners, scores = np.full(n_faces, -1), np.full(n_faces, -1.0)
+            for f, (rows, sims) in enumerate(self._search(embeddings)):
+                if rows.size:
+                    j = int(np.argmax(sims))
+                    owners[f], scores[f] = self.row_owner[rows[j]], sims[j]
+            return owners, scores
+        sims = self.scores(embeddings)
+        best_rows = np.argmax(sims, axis=1)
+        return self.row_owner[best_rows], sims[np.arange(n_faces), best_rows]
+
+    def candidates(self, embeddings):
+        """(top_scores, face_idx, student_idx, scores) pairs for unique assignment."""
+        n_faces = len(embeddings)
+        if len(self.ids) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return np.full(n_faces, -1.0), empty, empty, np.zeros(0)
+        if self.index is not None:
+            return self._indexed_candidates(embeddings)
+
+        per_student = self.student_scores(embeddings)
+        top_scores = per_student.max(axis=1)
+
+        # a face can lose at most n_faces - 1 students to other faces,
+        # so its n_faces best students are enough candidates
+        k = min(n_faces, per_student.shape[1])
+        cand = np.argpartition(-per_student, k - 1, axis=1)[:, :k]
+        cand_scores = np.take_along_axis(per_student, cand, axis=1)
+        face_idx = np.repeat(np.arange(n_faces), k)
+        return top_scores, face_idx, cand.ravel(), cand_scores.ravel()
+
+    def _search(self, embeddings):
+        return self.index.search(embeddings, self.matrix, valid=lambda rows: self.row_owner[rows] >= 0)
+
+    def _indexed_candidates(self, embeddings):
+        top_scores, face_idx, cand, cand_scores = [], [], [], []
+        for f, (rows, sims) in enumerate(self._search(embeddings)):
+            top_scores.append(float(sims.max()) if sims.size else -1.0)
+            owners = self.row_owner[rows]
+            # best row per candidate student
+            order = np.lexsort((-sims, owners))
+            first = np.ones(order.size, dtype=bool)
+            first[1:] = owners[order][1:] != owners[order][:-1]
+            face_idx.append(np.full(int(first.sum()), f))
+            cand.append(owners[order][first])
+            cand_scores.append(sims[order][first])
+        return (np.array(top_scores), np.concatenate(face_idx),
+                np.concatenate(cand), np.concatenate(cand_scores))
+
+
+class MultiGallery:
+    """Several galleries (e.g. section shards) matched as if they were one."""
+
+    def __init__(self, galleries):
+        self.galleries = [g for g in galleries if len(g)]
+        self.ids = [sid for g in self.galleries for sid in g.ids]
+        self._starts = np.cumsum([0] + [len(g) for g in self.galleries])[:-1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def size(self):
+        return sum(g.size for g in self.galleries)
+
+    def match(self, embeddings, threshold=0.35, unique=False):
+        return match_gallery(self, embeddings, threshold, unique)
+
+    def best(self, embeddings):
+        n_faces = len(embeddings)
+        owners, scores = np.full(n_faces, -1), np.full(n_faces, -1.0)
+        for start, g in zip(self._starts, self.galleries):
+            g_owners, g_scores = g.best(embeddings)
+            better = (g_scores > scores) & (g_owners >= 0)
+            owners[better], scores[better] = g_owners[better] + start, g_scores[better]
+        return owners, scores
+
+    def candidates(self, embeddings):
+        top_scores = np.full(len(embeddings), -1.0)
+        parts = []
+        for start, g in zip(self._starts, self.galleries):
+            g_top, face_idx, cand, cand_scores = g.candidates(embeddings)
+            top_scores = np.maximum(top_scores, g_top)
+            parts.append((face_idx, cand + start, cand_scores))
+        if not parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return top_scores, empty, empty, np.zeros(0)
+        return (top_scores, *(np.concatenate(col) for col in zip(*parts)))
+
+
+def match_gallery(gallery, embeddings, threshold=0.35, unique=False):
+    """Shared Gallery / MultiGallery matching on top of best() and candidates()."""
+    n_faces = len(embeddings)
+    if n_faces == 0:
+        return []
+    if len(gallery.ids) == 0:
+        return [("Unknown", -1.0)] * n_faces
+
+    if not unique:
+        results = []
+        for owner, score in zip(*gallery.best(embeddings)):
+            score = float(score)
+            label = gallery.ids[owner] if owner >= 0 and score >= threshold else "Unknown"
+            results.append((label, score))
+        return results
+
+    top_scores, face_idx, cand, cand_scores = gallery.candidates(embeddings)
+    keep = cand_scores >= threshold
+    face_idx, cand, cand_scores = face_idx[keep], cand[keep], cand_scores[keep]
+    order = np.argsort(-cand_scores, kind="stable")
+
+    results = [("Unknown", float(s)) for s in top_scores]
+    assigned, taken = set(), set()
+    for j in order:
+        f, s = face_idx[j], cand[j]
+        if f in assigned or s in taken:
+            continue
+        results[f] = (gallery.ids[s], float(cand_scores[j]))
+        assigned.add(f)
+        taken.add(s)
+    return results
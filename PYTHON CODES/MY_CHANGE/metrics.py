@@ -0,0 +1,212 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# ------------------------------
+# REQUEST METRICS
+# ------------------------------
+# Per-request stage timers plus process-wide counters, histograms and
+# gauges, rendered as Prometheus text for /metrics. A request gets a
+# RequestTimer; code wraps each stage in `with timer.stage("decode"):`
+# and the timer is folded into the registry once, when the request ends.
+#
+# With metrics disabled, request() hands out NULL_TIMER, whose stage()
+# returns one shared no-op context manager: nothing is timed or locked.
+#
+# The registry is per process. Under serve.py each worker keeps its own
+# counts and a scrape reaches whichever worker accepts it, so hi5 adds a
+# worker="<pid>" label to every series: sum across `worker` in queries,
+# e.g. sum by (endpoint) (rate(attendance_requests_total[5m])).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 5, 10, 20, 40, 80, 160)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestTimer:
+    """Stage durations and values of one request."""
+    active = True
+
+    def __init__(self, metrics, endpoint):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.stages = {}
+        self.values = {}
+        self.counts = {}
+        self.started = time.perf_counter()
+        self.total = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def set(self, **values):
+        """Context for the log line only (section, gallery size, ...)."""
+        self.values.update(values)
+
+    def count(self, name, value):
+        """A per-request quantity (e.g. faces) kept as a histogram and logged."""
+        self.counts[name] = value
+
+    def finish(self, status):
+        self.total = time.perf_counter() - self.started
+        if self.metrics.enabled:
+            self.metrics.record(self, status)
+        return self.total
+
+    def breakdown(self):
+        """Stage durations in ms, plus "total" once finished."""
+        out = {name: round(1000 * seconds, 2) for name, seconds in self.stages.items()}
+        if self.total is not None:
+            out["total"] = round(1000 * self.total, 2)
+        return out
+
+    def server_timing(self):
+        """Server-Timing header value, shown per stage by browser dev tools."""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.breakdown().items())
+
+    def log_record(self, status):
+        return {"ts": round(time.time(), 3), "endpoint": self.endpoint, "status": status,
+                "ms": self.breakdown(), **self.counts, **self.values}
+
+
+class _NullTimer:
+    active = False
+    _nothing = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._nothing
+
+    def set(self, **values):
+        pass
+
+    def count(self, name, value):
+        pass
+
+    def finish(self, status):
+        return None
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Thread-safe registry; `prefix` is prepended to every metric name."""
+
+    def __init__(self, prefix="attendance", enabled=True, labels=None):
+        self.prefix = prefix
+        self.enabled = enabled
+        self.labels = tuple(sorted((labels or {}).items()))  # added to every series
+        self._lock = threading.Lock()
+        self._counters = {}    # name -> {labels: value}
+        self._histograms = {}  # name -> {labels: Histogram}
+        self._gauges = {}      # name -> fn() returning a number or {labels: number}
+        self._help = {}
+
+    def request(self, endpoint, force=False):
+        """A timer for one request; NULL_TIMER when disabled unless `force` (debug header)."""
+        if self.enabled or force:
+            return RequestTimer(self, endpoint)
+        return NULL_TIMER
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def gauge(self, name, fn, text=None):
+        """Register a gauge read at scrape time; `fn` returns a number or {((label, value), ...): number}."""
+        self._gauges[name] = fn
+        if text:
+            self._help[name] = text
+
+    def record(self, timer, status):
+        endpoint = timer.endpoint
+        self.inc("requests_total", endpoint=endpoint, status=str(status))
+        self.observe("request_seconds", timer.total, endpoint=endpoint)
+        for stage, seconds in timer.stages.items():
+            self.observe("stage_seconds", seconds, endpoint=endpoint, stage=stage)
+        for name, value in timer.counts.items():
+            self.observe(name, value, buckets=COUNT_BUCKETS, endpoint=endpoint)
+
+    # ------------------------------
+    # Prometheus text format
+    # ------------------------------
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in series.items()}
+                          for name, series in self._histograms.items()}
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{self.prefix}_{name}{_labels(self.labels + key)} {value}")
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for key, (buckets, counts, total, count) in sorted(series.items()):
+                key = self.labels + key
+                cumulative = 0
+                for le, n in zip(list(buckets) + ["+Inf"], counts):
+                    cumulative += n
+                    lines.append(f"{self.prefix}_{name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{self.prefix}_{name}_sum{_labels(key)} {total:.6f}")
+                lines.append(f"{self.prefix}_{name}_count{_labels(key)} {count}")
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:  # a broken gauge must not break the scrape
+                print(f"⚠️ Gauge {name} failed ({e})")
+                continue
+            self._header(lines, name, "gauge")
+            series = value if isinstance(value, dict) else {(): value}
+            for key, v in sorted(series.items()):
+                lines.append(f"{self.prefix}_{name}{_labels(self.labels + tuple(key))} {v}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self._help:
+            lines.append(f"# HELP {self.prefix}_{name} {self._help[name]}")
+        lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+
+# ------------------------------
+# FACE QUALITY GATE
+# ------------------------------
+# Runs on the detector's output only, cheapest check first, so a face
+# that fails is never aligned, embedded or written:
+#   small  shorter bbox side under min_size px, or under min_relative x
+#          the largest face of the same photo (background people at /train)
+#   score  det_score under min_score
+#   pose   yaw / pitch from the 5 landmarks outside max_yaw / pitch_range
+#          (profiles, heads bent over a desk)
+#   blur   variance of the Laplacian of the face at 64x64 grey under
+#          min_sharpness
+# A threshold of 0 / None turns that check off.
+REASONS = ("small", "score", "pose", "blur")
+BLUR_SIZE = 64
+
+
+def face_pose(kps):
+    """(yaw, pitch) from 5-point landmarks, roll-invariant.
+
+    yaw: nose offset from the eye midpoint along the eye line, in eye
+    distances (0 frontal, about +-0.5 near profile). pitch: nose position
+    between the eye line (0) and the mouth (1), about 0.5 when level.
+    """
+    left_eye, right_eye, nose, left_mouth, right_mouth = np.asarray(kps, dtype=np.float32)
+    eye_mid = (left_eye + right_eye) / 2
+    eye_dist = float(np.linalg.norm(right_eye - left_eye))
+    if eye_dist < 1e-3:
+        return 1.0, 0.5
+    axis = (right_eye - left_eye) / eye_dist
+    down = np.array([-axis[1], axis[0]])
+    yaw = float(np.dot(nose - eye_mid, axis)) / eye_dist
+    face_height = float(np.dot((left_mouth + right_mouth) / 2 - eye_mid, down))
+    pitch = float(np.dot(nose - eye_mid, down)) / face_height if face_height > 1e-3 else 0.0
+    return yaw, pitch
+
+
+def sharpness(img, bbox):
+    """Laplacian variance of the face region at BLUR_SIZE x BLUR_SIZE grey (size independent)."""
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = (int(v) for v in bbox[:4])
+    crop = img[max(0, y1):min(h, y2), max(0, x1):min(w, x2)]
+    if crop.size == 0:
+        return 0.0
+    grey = cv2.cvtColor(cv2.resize(crop, (BLUR_SIZE, BLUR_SIZE), interpolation=cv2.INTER_AREA),
+                        cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(grey, cv2.CV_64F).var())
+
+
+class QualityGate:
+    def __init__(self, min_size=16, min_relative=0.0, min_score=0.0, max_yaw=0.45,
+                 pitch_range=(0.15, 0.85), min_sharpness=15.0):
+        self.min_size = min_size
+        self.min_relative = min_relative
+        self.min_score = min_score
+        self.max_yaw = max_yaw
+        self.pitch_range = pitch_range
+        self.min_sharpness = min_sharpness
+
+    def signature(self):
+        """Thresholds as a string, for cache keys of gated results."""
+        return (f"q{self.min_size}/{self.min_relative}/{self.min_score}/{self.max_yaw}/"
+                f"{self.pitch_range}/{self.min_sharpness}")
+
+    def reasons(self, img, bboxes, kpss):
+        """Per face: the first failed check's name, or None if the face passes."""
+        if len(bboxes) == 0:
+            return []
+        sides = np.minimum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+        min_side = max(self.min_size or 0, (self.min_relative or 0) * float(sides.max()))
+        out = []
+        for bbox, kps, side in zip(bboxes, kpss, sides):
+            if side < min_side:
+                out.append("small")
+            elif self.min_score and len(bbox) > 4 and bbox[4] < self.min_score:
+                out.append("score")
+            elif self._bad_pose(kps):
+                out.append("pose")
+            elif self.min_sharpness and sharpness(img, bbox) < self.min_sharpness:
+                out.append("blur")
+            else:
+                out.append(None)
+        return out
+
+    def _bad_pose(self, kps):
+        if (not self.max_yaw and not self.pitch_range) or not np.any(kps):
+            return False  # detector without landmarks
+        yaw, pitch = face_pose(kps)
+        if self.max_yaw and abs(yaw) > self.max_yaw:
+            return True
+        return bool(self.pitch_range) and not self.pitch_range[0] <= pitch <= self.pitch_range[1]
+
+    def filter(self, img, bboxes, kpss):
+        """(indices of faces that pass, {reason: count} of those that don't)."""
+        keep, skipped = [], {}
+        for i, reason in enumerate(self.reasons(img, bboxes, kpss)):
+            if reason is None:
+                keep.append(i)
+            else:
+                skipped[reason] = skipped.get(reason, 0) + 1
+        return np.array(keep, dtype=np.int64), skipped
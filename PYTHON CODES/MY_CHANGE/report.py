@@ -0,0 +1,92 @@
+"""Attendance reports from the ledger (replaces map.py's full CSV rewrite).
+
+    python report.py mark --section A     # map.py's job, as a session (../students.csv, extracted_faces/)
+    python report.py report --section A --below 75 > shortfall.csv
+    python report.py student 12
+    python report.py rebuild
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+from ledger import Ledger, TARGET_PERCENT
+from sections import Sections
+
+# relative to this file, not the working directory: the roster lives one
+# level up in PYTHON CODES/, everything else next to hi5.py
+HERE = os.path.dirname(os.path.abspath(__file__))
+LEDGER_DB = os.environ.get("LEDGER_DB", os.path.join(HERE, "attendance.db"))
+SECTIONS_FILE = os.path.join(HERE, "sections.json")
+ROSTER_FILE = os.path.join(os.path.dirname(HERE), "students.csv")
+FACES_DIR = os.path.join(HERE, "extracted_faces")
+
+
+def read_roster(path):
+    """(roll, name) pairs from a USN,Name roster like students.csv."""
+    with open(path, newline="") as f:
+        return [(int(row["USN"]), row["Name"]) for row in csv.DictReader(f)]
+
+
+def present_from_faces(folder):
+    """Rolls from USN_<n>.jpg crops, as map.py read them."""
+    present = set()
+    for filename in sorted(os.listdir(folder)):
+        if filename.startswith("USN_") and filename.endswith(".jpg"):
+            try:
+                present.add(int(filename.split("_")[1].split(".")[0]))
+            except ValueError:
+                continue
+    return sorted(present)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=LEDGER_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    mark = sub.add_parser("mark", help="record USN_*.jpg crops as one attendance session")
+    mark.add_argument("--roster", default=ROSTER_FILE)
+    mark.add_argument("--faces", default=FACES_DIR)
+    mark.add_argument("--section", required=True, help="the class this session is for (ALL: every section)")
+
+    report = sub.add_parser("report", help="stream the per-student report as CSV")
+    report.add_argument("--section")
+    report.add_argument("--target", type=float, default=TARGET_PERCENT)
+    report.add_argument("--below", type=float, help="only students under this percentage")
+
+    student = sub.add_parser("student", help="one student's summary as JSON")
+    student.add_argument("roll", type=int)
+    student.add_argument("--target", type=float, default=TARGET_PERCENT)
+
+    sub.add_parser("rebuild", help="recompute all counters from the raw history")
+    args = parser.parse_args()
+
+    sections = Sections.load(SECTIONS_FILE)
+    ledger = Ledger(args.db, sections)
+    if args.command == "mark":
+        try:
+            section = sections.canonical(args.section)
+        except ValueError as e:
+            parser.error(str(e))
+        if os.path.exists(args.roster):
+            ledger.import_students(read_roster(args.roster))
+        present = present_from_faces(args.faces)
+        session_id = ledger.record(section, "faces", [(r, None, None) for r in present])
+        print(f"✅ Session {session_id}: {len(present)} students marked present", file=sys.stderr)
+    elif args.command == "report":
+        try:
+            section = sections.canonical(args.section) if args.section else None
+        except ValueError as e:
+            parser.error(str(e))
+        for chunk in ledger.report_csv(section=None if section == "ALL" else section, target=args.target, below=args.below):
+            sys.stdout.write(chunk)
+    elif args.command == "student":
+        print(json.dumps(ledger.student_summary(args.roll, target=args.target), indent=2))
+    elif args.command == "rebuild":
+        print(f"✅ Rebuilt counters from {ledger.rebuild_counters()} sessions", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
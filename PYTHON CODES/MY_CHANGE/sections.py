@@ -0,0 +1,125 @@
+import json
+import os
+import re
+import shutil
+
+from gallery_store import GalleryStore, INDEX_FILE
+
+# ------------------------------
+# SECTION SHARDS
+# ------------------------------
+# Each shard is its own GalleryStore under <gallery>/<shard>/, so a query
+# for one section only touches that section's matrix. Shards come from
+# sections.json:
+#
+#   {"A":  {"ranges": [[1, 64]]},
+#    "C":  {"ranges": [[128, null]]},      null = open-ended
+#    "NA": {"names": ["NA"], "shared": true}}
+#
+# A folder belongs to the first shard whose AD-number range or exact
+# folder name matches. "shared" shards are matched along with every
+# section (the old "NA is always valid" rule); "ALL" means every shard.
+DEFAULT_SECTIONS = {
+    "A": {"ranges": [[1, 64]]},
+    "B": {"ranges": [[65, 127]]},
+    "C": {"ranges": [[128, None]]},
+    "NA": {"names": ["NA"], "shared": True},
+}
+
+
+def parse_ad_number(folder_name: str):
+    """Return int AD number or 'NA' or None if not AD/NA."""
+    if folder_name.strip().upper() == "NA":
+        return "NA"
+    m = re.search(r'AD\s*0*([0-9]+)', folder_name, flags=re.IGNORECASE)
+    if not m:
+        return None
+    return int(m.group(1))
+
+
+class Sections:
+    def __init__(self, shards):
+        self.shards = shards
+
+    @classmethod
+    def load(cls, path):
+        if os.path.exists(path):
+            with open(path) as f:
+                return cls(json.load(f))
+        return cls(DEFAULT_SECTIONS)
+
+    @property
+    def names(self):
+        return list(self.shards)
+
+    def shard_for_number(self, number):
+        for name, spec in self.shards.items():
+            for lo, hi in spec.get("ranges", []):
+                if number >= lo and (hi is None or number <= hi):
+                    return name
+        return None
+
+    def shard_for(self, folder_name: str):
+        """Shard a student folder belongs to, or None if it matches no shard."""
+        clean = folder_name.strip().upper()
+        for name, spec in self.shards.items():
+            if clean in (n.upper() for n in spec.get("names", [])):
+                return name
+        tag = parse_ad_number(folder_name)
+        if not isinstance(tag, int):
+            return None
+        return self.shard_for_number(tag)
+
+    def canonical(self, section: str) -> str:
+        """`section` as spelled in sections.json, or "ALL"; ValueError if it is neither."""
+        clean = (section or "ALL").strip().upper()
+        if clean == "ALL":
+            return "ALL"
+        by_upper = {n.upper(): n for n in self.shards}
+        if clean not in by_upper:
+            raise ValueError(f"Unknown section {section!r}; expected ALL or one of {self.names}")
+        return by_upper[clean]
+
+    def shards_for(self, section: str):
+        """Shards a request for `section` should match against."""
+        section = self.canonical(section)
+        if section == "ALL":
+            return self.names
+        wanted = [section]
+        wanted += [n for n, spec in self.shards.items() if spec.get("shared") and n not in wanted]
+        return wanted
+
+    def in_section(self, folder_name: str, section: str) -> bool:
+        shard = self.shard_for(folder_name)
+        return shard is not None and shard in self.shards_for(section)
+
+
+def open_shards(root, sections, legacy_pickle=None):
+    """{shard: GalleryStore} under `root`, splitting an older single store once."""
+    flat_index = os.path.join(root, INDEX_FILE)
+    needs_split = os.path.exists(flat_index)
+    fresh = not needs_split and not any(
+        os.path.exists(os.path.join(root, name, INDEX_FILE)) for name in sections.names)
+    stores = {name: GalleryStore(os.path.join(root, name)) for name in sections.names}
+
+    if needs_split:
+        _split_into(GalleryStore(root), stores, sections)
+        os.replace(flat_index, flat_index + ".migrated")
+    elif fresh and legacy_pickle and os.path.exists(legacy_pickle):
+        tmp_root = os.path.join(root, "_migrate")
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        _split_into(GalleryStore.open(tmp_root, legacy_pickle=legacy_pickle), stores, sections)
+        shutil.rmtree(tmp_root, ignore_errors=True)
+    return stores
+
+
+def _split_into(source, stores, sections):
+    for sid, entry in source.students.items():
+        shard = sections.shard_for(sid)
+        if shard is None:
+            print(f"⚠️ {sid} matches no section in sections config; not migrated")
+            continue
+        stores[shard].put(sid, source.get(sid), entry.get("signature"), commit=False)
+    for store in stores.values():
+        store.commit()
+    print(f"✅ Split {len(source)} students from {source.root} into shards {list(stores)}")
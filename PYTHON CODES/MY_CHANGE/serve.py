@@ -0,0 +1,191 @@
+"""Pre-fork server for hi5: N worker processes sharing one listening socket.
+
+    python serve.py --workers 4 --port 5000
+    kill -HUP <pid>     # replace workers one at a time (new code / model), no downtime
+    kill -TERM <pid>    # finish in-flight requests, then exit
+
+Each worker imports hi5 (its own model), warms up, and only then starts
+accepting, so no request lands on a cold model. Galleries are memory-
+mapped files, so the workers share one copy in the page cache; after a
+/train in any worker the others pick up the new index.json on their next
+request; /train/status and /train/cancel work from any worker (the run's
+state is kept under gallery/). /metrics counts are per worker, labelled
+worker="<pid>". POSIX only (fork + flock).
+"""
+import argparse
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+# ------------------------------
+# CONFIG
+# ------------------------------
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 5000))
+WORKERS = int(os.environ.get("SERVE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+BACKLOG = 128
+STARTUP_TIMEOUT = 300  # seconds for a worker to load + warm its model
+GRACE_SECONDS = 30  # in-flight requests get this long on shutdown / reload
+
+
+def bind(host, port):
+    """Bound but not listening: connections are refused until the first worker is warm."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+# ------------------------------
+# worker process
+# ------------------------------
+def run_worker(sock, host, port, ready_fd):
+    import hi5  # loads the model and galleries in this process only
+
+    hi5.warmup()
+    server = make_server(host, port, hi5.app, threaded=True, fd=sock.fileno())
+    server.daemon_threads = False  # server_close() waits for in-flight requests
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    sock.listen(BACKLOG)  # no-op once any worker has done it
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+    server.serve_forever()
+    server.server_close()
+
+
+# ------------------------------
+# supervisor
+# ------------------------------
+class Supervisor:
+    def __init__(self, sock, host, port, workers):
+        self.sock, self.host, self.port, self.workers = sock, host, port, workers
+        self.children = {}  # pid -> started_at
+        self.stopping = False
+        self.reload_requested = False
+
+    def spawn(self):
+        """Fork one worker; returns (pid, read end of its ready pipe)."""
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, signal.SIG_DFL)  # not the supervisor's handlers while loading
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            code = 0
+            try:
+                run_worker(self.sock, self.host, self.port, w)
+            except BaseException as e:
+                print(f"⚠️ Worker {os.getpid()} failed: {e!r}", file=sys.stderr)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        os.close(w)
+        self.children[pid] = time.time()
+        return pid, r
+
+    def wait_ready(self, pid, fd):
+        readable, _, _ = select.select([fd], [], [], STARTUP_TIMEOUT)
+        ok = bool(readable) and os.read(fd, 1) == b"1"
+        os.close(fd)
+        if not ok:
+            print(f"⚠️ Worker {pid} did not become ready", file=sys.stderr)
+        return ok
+
+    def stop_child(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.time() + GRACE_SECONDS
+        while time.time() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                break
+            time.sleep(0.1)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children.pop(pid, None)
+
+    def rolling_reload(self):
+        """New worker up and warm before each old one is stopped."""
+        for old in list(self.children):
+            pid, fd = self.spawn()
+            if not self.wait_ready(pid, fd):
+                self.stop_child(pid)
+                print("⚠️ Reload aborted, old workers kept", file=sys.stderr)
+                return
+            self.stop_child(old)
+        print(f"✅ Reloaded {self.workers} workers")
+
+    def reap(self):
+        """Restart workers that died unexpectedly (crash-looping ones after a pause)."""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            print(f"⚠️ Worker {pid} exited ({status}), restarting", file=sys.stderr)
+            if time.time() - started < 5:
+                time.sleep(5)
+            self.spawn_ready()
+
+    def spawn_ready(self):
+        pid, fd = self.spawn()
+        self.wait_ready(pid, fd)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stopping", True))
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "reload_requested", True))
+
+        started = time.perf_counter()
+        pending = [self.spawn() for _ in range(self.workers)]  # all warm up in parallel
+        ready = sum(self.wait_ready(pid, fd) for pid, fd in pending)
+        print(f"✅ {ready}/{self.workers} workers serving on http://{self.host}:{self.port} "
+              f"after {time.perf_counter() - started:.1f}s (supervisor pid {os.getpid()})")
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_reload()
+            self.reap()
+            time.sleep(0.5)
+
+        print("🔄 Stopping workers...")
+        for pid in list(self.children):
+            os.kill(pid, signal.SIGTERM)
+        for pid in list(self.children):
+            self.stop_child(pid)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    Supervisor(bind(args.host, args.port), args.host, args.port, args.workers).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+
+from matcher import normalize_rows
+
+# ------------------------------
+# TEMPLATE COMPACTION
+# ------------------------------
+# A student enrolled from many photos doesn't need every embedding in the
+# gallery: near-duplicates (same session, same pose) add rows to score on
+# every /recognize without adding coverage. At enrollment each student is
+# reduced to at most K representative unit vectors:
+#   kmedoids  K real embeddings, each the most central one of its cluster
+#   kmeans    K spherical k-means centroids (normalised cluster means);
+#             K=1 is the old single mean vector of hi4_buffalo
+# Clusters are seeded farthest-first from the most central embedding, so
+# the result is deterministic and rare poses (a profile, glasses) get a
+# template of their own before a second copy of the common one.
+# K=0 keeps every embedding. bench_templates.py reports gallery size,
+# match latency and top-1 accuracy per K and method; on its synthetic
+# galleries kmeans K=5 matches keeping everything, at 1/6 of the rows.
+TEMPLATES_K = int(os.environ.get("TEMPLATES_K", 5))
+TEMPLATES_METHOD = os.environ.get("TEMPLATES_METHOD", "kmeans")
+METHODS = ("kmedoids", "kmeans")
+
+
+def signature(k=TEMPLATES_K, method=TEMPLATES_METHOD):
+    """Suffix for folder signatures, so changing K re-enrolls (from the embedding cache)."""
+    return f"|{method}{k}" if k > 0 else ""
+
+
+def _seeds(sims, k):
+    """Most central row, then repeatedly the row least similar to every seed so far."""
+    seeds = [int(np.argmax(sims.sum(axis=1)))]
+    closest = sims[seeds[0]].copy()
+    while len(seeds) < k:
+        nxt = int(np.argmin(closest))
+        seeds.append(nxt)
+        closest = np.maximum(closest, sims[nxt])
+    return seeds
+
+
+def select_templates(embeddings, k=TEMPLATES_K, method=TEMPLATES_METHOD, iters=20):
+    """At most `k` unit rows standing in for `embeddings`, largest cluster first."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    x = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+    if k <= 0 or len(x) <= k:
+        return x
+    sims = x @ x.T
+    medoids = _seeds(sims, k)
+    centers = x[medoids]
+    assign = None
+    for _ in range(iters):
+        new_assign = np.argmax(x @ centers.T, axis=1)
+        if assign is not None and np.array_equal(new_assign, assign):
+            break
+        assign = new_assign
+        for c in range(k):
+            members = np.flatnonzero(assign == c)
+            if members.size == 0:
+                continue  # keep the old center
+            if method == "kmedoids":
+                medoids[c] = int(members[np.argmax(sims[np.ix_(members, members)].sum(axis=1))])
+                centers[c] = x[medoids[c]]
+            else:
+                centers[c] = x[members].mean(axis=0)
+        if method == "kmeans":
+            centers = normalize_rows(centers)
+    sizes = np.bincount(assign, minlength=k)
+    order = np.argsort(-sizes, kind="stable")
+    return centers[order[sizes[order] > 0]]
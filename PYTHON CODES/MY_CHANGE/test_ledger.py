@@ -0,0 +1,73 @@
+"""Ledger counters for the app's flow: /recognize preview, then /mark_manual.
+
+    python -m pytest test_ledger.py      (or python -m unittest test_ledger)
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ledger import Ledger
+from sections import DEFAULT_SECTIONS, Sections
+
+
+class ClientFlowTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="ledger_")
+        self.ledger = Ledger(os.path.join(self.tmp, "attendance.db"), Sections(DEFAULT_SECTIONS))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def class_held(self, section, present):
+        """One class as the app runs it: the /recognize preview writes nothing,
+        the teacher's confirmed list is saved with /mark_manual."""
+        return self.ledger.record(section, "manual", [(roll, None, None) for roll in present])
+
+    def assert_counts(self, roll, held, attended, percentage):
+        summary = self.ledger.student_summary(roll)
+        self.assertEqual((summary["held"], summary["attended"], summary["percentage"]),
+                         (held, attended, percentage))
+        report = self.ledger.student_report(roll)
+        self.assertEqual((report["sessions_held"], report["sessions_attended"], report["percentage"]),
+                         (held, attended, percentage))
+
+    def test_recognize_then_mark_manual(self):
+        self.class_held("A", [3, 5])
+        self.class_held("A", [3])
+        self.class_held("A", [3, 5])
+        self.class_held("B", [70])
+
+        self.assert_counts(3, held=3, attended=3, percentage=100.0)   # every A class
+        self.assert_counts(5, held=3, attended=2, percentage=66.7)
+        self.assert_counts(70, held=1, attended=1, percentage=100.0)  # B's only class
+        self.assert_counts(71, held=1, attended=0, percentage=0.0)
+
+        self.ledger.rebuild_counters()
+        self.assert_counts(3, held=3, attended=3, percentage=100.0)
+        self.assert_counts(70, held=1, attended=1, percentage=100.0)
+
+    def test_recorded_recognition_corrected_by_mark_manual(self):
+        # /recognize with record=1, then /mark_manual adds a missed student to the same session
+        session_id = self.ledger.record("A", "recognize", [(3, "AD003", 0.61)])
+        self.ledger.record("A", "manual", [(3, None, None), (5, None, None)], session_id=session_id)
+
+        self.assert_counts(3, held=1, attended=1, percentage=100.0)
+        self.assert_counts(5, held=1, attended=1, percentage=100.0)
+
+    def test_all_session_counts_for_every_section(self):
+        self.class_held("A", [3])
+        self.class_held("ALL", [3, 70])
+
+        self.assert_counts(3, held=2, attended=2, percentage=100.0)
+        self.assert_counts(70, held=1, attended=1, percentage=100.0)
+        self.assert_counts(71, held=1, attended=0, percentage=0.0)
+
+    def test_mark_in_another_sections_session_is_not_counted(self):
+        self.class_held("A", [3, 70])  # 70 is in B
+
+        self.assert_counts(70, held=0, attended=0, percentage=None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import math
+import time
+
+import numpy as np
+
+# ------------------------------
+# TILED DETECTION FOR LARGE PHOTOS
+# ------------------------------
+# The detector sees the photo resized to det_size (640), so in a 4000x3000
+# classroom shot a back-row face of 40 px shrinks to ~6 px and is missed.
+# The photo is cut into overlapping tiles that are each downscaled at most
+# `max_scale` times, every tile is detected (in parallel), and boxes are
+# mapped back to full-image coordinates and merged with NMS. One extra
+# full-image pass keeps faces that are larger than the tile overlap.
+#
+# A tile detection touching an inner tile edge is a cut-off face; it is
+# dropped because the overlap guarantees the same face is whole in the
+# neighbouring tile.
+
+
+def _starts(length, tile, overlap):
+    if length <= tile:
+        return [0]
+    n = math.ceil((length - overlap) / (tile - overlap))
+    return [int(round(v)) for v in np.linspace(0, length - tile, n)]
+
+
+def plan_tiles(h, w, det_size=640, max_scale=2.0, overlap_frac=0.2):
+    """Tiles (x0, y0, x1, y1) covering an h x w image, plus the tile edge and overlap used."""
+    tile = int(det_size * max_scale)
+    if max(h, w) <= tile:
+        return [(0, 0, w, h)], tile, 0
+    overlap = int(tile * overlap_frac)
+    return ([(x, y, min(w, x + tile), min(h, y + tile))
+             for y in _starts(h, tile, overlap) for x in _starts(w, tile, overlap)],
+            tile, overlap)
+
+
+def nms(bboxes, thresh=0.4):
+    """Indices of boxes kept by greedy NMS; bboxes is (n, 5) with the score last."""
+    x1, y1, x2, y2, scores = bboxes.T
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.maximum(0.0, xx2 - xx1 + 1) * np.maximum(0.0, yy2 - yy1 + 1)
+        iou = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[1:][iou <= thresh]
+    return np.array(keep, dtype=np.int64)
+
+
+class TiledDetector:
+    def __init__(self, det_model, executor=None, max_scale=2.0, overlap_frac=0.2,
+                 nms_thresh=0.4, edge_margin=2):
+        self.det_model = det_model
+        self.executor = executor
+        self.max_scale = max_scale
+        self.overlap_frac = overlap_frac
+        self.nms_thresh = nms_thresh
+        self.edge_margin = edge_margin
+
+    def _detect_tile(self, img, tile):
+        x0, y0, x1, y1 = tile
+        started = time.perf_counter()
+        bboxes, kpss = self.det_model.detect(img[y0:y1, x0:x1], max_num=0, metric="default")
+        if kpss is None:
+            kpss = np.zeros((bboxes.shape[0], 5, 2), dtype=np.float32)
+        if bboxes.shape[0]:
+            h, w = img.shape[:2]
+            m = self.edge_margin
+            inner = ((x0 > 0) & (bboxes[:, 0] <= m)) | ((y0 > 0) & (bboxes[:, 1] <= m)) \
+                | ((x1 < w) & (bboxes[:, 2] >= x1 - x0 - m)) | ((y1 < h) & (bboxes[:, 3] >= y1 - y0 - m))
+            bboxes, kpss = bboxes[~inner].copy(), kpss[~inner].copy()
+            bboxes[:, [0, 2]] += x0
+            bboxes[:, [1, 3]] += y0
+            kpss += [x0, y0]
+        return bboxes, kpss, time.perf_counter() - started
+
+    def detect(self, img):
+        """(bboxes, kpss, stats) for the whole image, merged across tiles."""
+        h, w = img.shape[:2]
+        det_size = min(self.det_model.input_size)
+        tiles, tile, overlap = plan_tiles(h, w, det_size, self.max_scale, self.overlap_frac)
+        started = time.perf_counter()
+        if len(tiles) == 1:
+            bboxes, kpss, seconds = self._detect_tile(img, tiles[0])
+            return bboxes, kpss, {"tiles": 1, "tile_size": tile, "overlap": 0,
+                                  "tile_ms": [round(1000 * seconds, 1)],
+                                  "detections_full_image": int(bboxes.shape[0]),
+                                  "detections_tiled": int(bboxes.shape[0]),
+                                  "seconds": round(time.perf_counter() - started, 3)}
+
+        jobs = [(0, 0, w, h)] + tiles  # full-image pass first
+        run = lambda t: self._detect_tile(img, t)
+        parts = list(self.executor.map(run, jobs) if self.executor else map(run, jobs))
+        bboxes = np.concatenate([p[0] for p in parts])
+        kpss = np.concatenate([p[1] for p in parts])
+        if bboxes.shape[0]:
+            keep = nms(bboxes, self.nms_thresh)
+            bboxes, kpss = bboxes[keep], kpss[keep]
+        return bboxes, kpss, {"tiles": len(tiles), "tile_size": tile, "overlap": overlap,
+                              "tile_ms": [round(1000 * p[2], 1) for p in parts[1:]],
+                              "full_image_ms": round(1000 * parts[0][2], 1),
+                              "detections_full_image": int(parts[0][0].shape[0]),
+                              "detections_tiled": int(bboxes.shape[0]),
+                              "seconds": round(time.perf_counter() - started, 3)}
@@ -1,11 +1,35 @@
 from flask import Flask, request, jsonify
+import json
 import os
 import shutil
+import threading
+import uuid
+import worker
 
 app = Flask(__name__)
 
 UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+JOBS_FOLDER = worker.WORKER_JOBS_DIR  # one directory per upload; the worker writes only under it
+SAVE_UPLOADS = os.environ.get("SAVE_UPLOADS", "1") == "1"  # keep the original photo in the job dir
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+
+JOB_ID_RE = worker.JOB_ID_RE
+
+
+def job_dir(job_id):
+    return worker.job_dir(job_id)
+
+
+def save_atomic(data, path):
+    """Write to a temp name and rename, so readers never see a partial file."""
+    tmp = f"{path}.part"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"⚠️ Could not save upload {path} ({e})")
+
 
 @app.route("/", methods=["GET"])
 def home():
@@ -17,19 +41,59 @@ def upload_image():
     if not file:
         return jsonify({"error": "No file uploaded"}), 400
 
-    # --- Clear uploads folder for fresh image ---
-    if os.path.exists(UPLOAD_FOLDER):
-        shutil.rmtree(UPLOAD_FOLDER)
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    # every upload gets its own job directory, so simultaneous uploads don't collide
+    job_id = uuid.uuid4().hex
+    folder = job_dir(job_id)
+    os.makedirs(folder)
+    filepath = os.path.join(folder, "attendance.jpg")
+    data = file.read()
+
+    # the worker gets the bytes directly; keeping a copy on disk is optional and off the request path
+    try:
+        job = worker.submit(data, job_id=job_id)  # crops in <folder>/faces, status in <folder>/result.json
+    except OSError as e:
+        shutil.rmtree(folder, ignore_errors=True)
+        response = jsonify({"error": f"Worker not reachable: {e}"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+
+    if not job["accepted"]:
+        # worker queue is full: push back instead of piling up uploads
+        shutil.rmtree(folder, ignore_errors=True)
+        response = jsonify({"error": "Too many pending jobs, retry later",
+                            "queue_depth": job["queue_depth"],
+                            "retry_after": job["retry_after"]})
+        response.headers["Retry-After"] = str(job["retry_after"])
+        return response, 429
 
-    # Save the uploaded image
-    filepath = os.path.join(UPLOAD_FOLDER, "attendance.jpg")
-    file.save(filepath)
+    if SAVE_UPLOADS:
+        threading.Thread(target=save_atomic, args=(data, filepath), daemon=True).start()
 
     return jsonify({
-        "message": "Attendance image saved successfully",
-        "image_path": filepath
-    }), 200
+        "message": "Attendance image received",
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "image_path": filepath if SAVE_UPLOADS else None,
+        "queue_depth": job["queue_depth"]
+    }), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    if not JOB_ID_RE.match(job_id) or not os.path.isdir(job_dir(job_id)):
+        return jsonify({"error": "Unknown job"}), 404
+
+    result_file = worker.job_paths(job_id)[1]
+    if os.path.exists(result_file):
+        with open(result_file) as f:
+            result = json.load(f)
+    else:
+        try:
+            result = worker.job_status(job_id)
+        except OSError:
+            result = {"status": "unknown", "error": "Worker not reachable"}
+    if "faces" in result:
+        result["faces"] = [os.path.relpath(p, job_dir(job_id)) for p in result["faces"]]
+    return jsonify({"job_id": job_id, **result}), 200
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
@@ -1,14 +1,39 @@
+import argparse
+import csv
 import cv2
 import numpy as np
-import insightface
 import os
+import sys
+from insightface.utils import face_align
 from numpy.linalg import norm
+from pipeline import DROP_POLICIES, Pipeline
+from tracker import FaceTracker
+
+# face_model.py (slim / INT8 model loading) lives in MY_CHANGE
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "MY_CHANGE"))
+from face_model import FACE_INT8, FACE_PROFILE, PROFILES, load_face_app  # noqa: E402
+
+parser = argparse.ArgumentParser(description="Webcam / video face recognition")
+parser.add_argument("--source", default="0", help="webcam index or video file")
+parser.add_argument("--mode", choices=["frame", "track"], default="frame",
+                    help="frame: recognise every processed frame; track: recognise once per face track")
+parser.add_argument("--max-seconds", type=float, default=None,
+                    help="console mode run time (default 30 for a webcam, whole file for a video)")
+parser.add_argument("--drop", choices=DROP_POLICIES, default=None,
+                    help="what to do with frames while inference is busy: drop the oldest (keep the latest), "
+                         "drop the newest, or none = wait (default: oldest for a webcam, none for a video)")
+parser.add_argument("--buffer", type=int, default=1, help="frames waiting for inference")
+parser.add_argument("--profile", choices=sorted(PROFILES), default=FACE_PROFILE,
+                    help="slim: detector + ArcFace only; full: every model in the pack")
+parser.add_argument("--int8", action="store_true", default=FACE_INT8,
+                    help="use the INT8 pack built by MY_CHANGE/face_model.py quantize")
+args = parser.parse_args()
+if args.int8 and PROFILES[args.profile] is None:
+    parser.error("--int8 needs --profile slim (the INT8 pack has only the detector and ArcFace)")
 
 # Load face detector + ArcFace model
 print("Loading InsightFace model...")
-model = insightface.app.FaceAnalysis(name="buffalo_l")  # Strong model
-model.prepare(ctx_id=0, det_size=(640, 640))
-print("Model loaded successfully!")
+model = load_face_app("buffalo_l", det_size=(640, 640), profile=args.profile, quantized=args.int8)  # Strong model
 
 def get_embedding(img):
     """Extract face embedding from image"""
@@ -75,9 +100,8 @@ def load_database_from_test_folder(test_folder_path="test"):
 
     return database
 
-def recognize_face(img, database, threshold=0.8):
-    """Recognize face in image against database"""
-    emb = get_embedding(img)
+def recognize_face(emb, database, threshold=0.8):
+    """Recognize a face embedding against database"""
     if emb is None:
         return "No face detected", 1.0
 
@@ -104,16 +128,45 @@ if len(database) == 0:
     print("No valid training data found. Exiting...")
     exit()
 
-print(f"\nStarting webcam... Press 'q' to quit")
+is_file = not args.source.isdigit()
+print(f"\nStarting {'video ' + args.source if is_file else 'webcam'} ({args.mode} mode)... Press 'q' to quit")
 print("Recognition threshold: 0.8 (lower = stricter)")
 
-# Start webcam
-cap = cv2.VideoCapture(0)
+# Start webcam / video
+cap = cv2.VideoCapture(args.source if is_file else int(args.source))
 
 if not cap.isOpened():
-    print("Error: Could not open webcam")
+    print(f"Error: Could not open {'video ' + args.source if is_file else 'webcam'}")
     exit()
 
+max_seconds = args.max_seconds if args.max_seconds is not None else (0 if is_file else 30)
+
+# Track mode: detector every frame, recognition only for new / unsure tracks
+tracker = FaceTracker()
+rec_model = model.models["recognition"]
+recognitions_total = 0
+
+def track_frame(frame, frame_idx):
+    """Returns [(bbox, label, score, fresh)] for the faces tracked in this frame."""
+    global recognitions_total
+    bboxes, kpss = model.det_model.detect(frame, max_num=0, metric="default")
+    matched = tracker.update(bboxes, frame_idx)
+    todo = [(t, di) for t, di in matched if tracker.needs_recognition(t, frame_idx)]
+    if todo:
+        crops = [face_align.norm_crop(frame, landmark=kpss[di]) for _, di in todo]
+        embs = rec_model.get_feat(crops)
+        embs = embs / norm(embs, axis=1, keepdims=True)
+        for (track, _), emb in zip(todo, embs):
+            track.vote(*recognize_face(emb, database), frame_idx)
+        recognitions_total += len(todo)
+    fresh = {t.id for t, _ in todo}
+    labeled = []
+    for track, di in matched:
+        label, _, score = track.identity()
+        labeled.append((bboxes[di][:4].astype(int), label, score if score is not None else 1.0,
+                        track.id in fresh))
+    return labeled
+
 # Try to use GUI, fallback to console mode if it fails
 use_gui = True
 try:
@@ -129,97 +182,122 @@ except cv2.error:
     print("Recognition results will be printed to console and saved as images")
 
 import time
-frame_count = 0
 start_time = time.time()
+LOG_EVERY = 100  # rendered frames between fps / latency log lines
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Error: Could not read frame")
-        break
-
-    frame_count += 1
-
-    # Process every 10th frame in console mode to reduce load
-    if not use_gui and frame_count % 10 != 0:
-        continue
-
+def infer(frame, frame_idx):
+    """Inference stage: [(bbox, label, score, fresh)] for one frame."""
+    global recognitions_total
+    if args.mode == "track":
+        return track_frame(frame, frame_idx)
     # Detect faces in current frame
     faces = model.get(frame)
+    recognitions_total += len(faces)
+    # Recognize face (embedding comes from the frame detection, no second pass)
+    return [(face.bbox.astype(int), *recognize_face(face.normed_embedding, database), True)
+            for face in faces]
 
-    if len(faces) > 0 and not use_gui:
-        timestamp = time.strftime("%H:%M:%S")
-        print(f"\n[{timestamp}] Frame {frame_count}: {len(faces)} face(s) detected")
-
-    for i, face in enumerate(faces):
-        # Get bounding box coordinates
-        x1, y1, x2, y2 = face.bbox.astype(int)
-
-        # Extract face region
-        face_crop = frame[y1:y2, x1:x2]
-
-        # Recognize face
-        label, score = recognize_face(face_crop, database)
+# capture / inference run on their own threads; this loop is the render stage
+drop = args.drop or ("none" if is_file else "oldest")
+pipeline = Pipeline(cap, infer, capture_buffer=args.buffer, capture_drop=drop,
+                    render_drop="none" if drop == "none" else "oldest").start()
+processed = 0
 
-        # Choose color based on recognition result
-        if label == "Unknown" or label == "No face detected":
-            color = (0, 0, 255)  # Red for unknown
-            display_text = f"{label}"
-        else:
-            color = (0, 255, 0)  # Green for recognized
-            display_text = f"{label} ({score:.2f})"
-
-        # Draw bounding box and label
-        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-
-        # Add background for text
-        text_size = cv2.getTextSize(display_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-        cv2.rectangle(frame, (x1, y1 - text_size[1] - 10),
-                     (x1 + text_size[0], y1), color, -1)
-
-        # Add text
-        cv2.putText(frame, display_text, (x1, y1 - 5),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-
-        # Print results in console mode
-        if not use_gui:
-            print(f"  Face {i+1}: {label} (distance: {score:.3f})")
-
-            # Save detection image
-            if label != "Unknown":
-                output_folder = "detections"
-                os.makedirs(output_folder, exist_ok=True)
-                filename = f"detection_{timestamp.replace(':', '-')}_{label}.jpg"
-                filepath = os.path.join(output_folder, filename)
-                cv2.imwrite(filepath, frame)
-                print(f"    Saved: {filepath}")
-
-    if use_gui:
-        # Display frame (only if GUI is available)
-        try:
-            cv2.imshow("Face Recognition - Press 'q' to quit", frame)
-
-            # Check for quit key
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                break
-        except cv2.error:
-            print("GUI display failed, switching to console mode")
-            use_gui = False
-    else:
-        # In console mode, run for 30 seconds or until Ctrl+C
-        if time.time() - start_time > 30:
-            print("\n30 seconds completed. Stopping...")
-            break
-
-        # Check for keyboard interrupt
-        try:
-            time.sleep(0.1)
-        except KeyboardInterrupt:
-            print("\nStopping due to keyboard interrupt...")
+try:
+    for item in pipeline.results():
+        frame, frame_count, labeled = item["frame"], item["idx"], item["result"]
+        processed += 1
+        if processed % LOG_EVERY == 0:
+            elapsed = time.time() - start_time
+            print(f"⏱️ {processed / elapsed:.1f} fps, {recognitions_total / processed:.2f} recognitions/frame"
+                  + (f", {len(tracker.tracks)} active tracks" if args.mode == "track" else ""))
+            print(f"   {pipeline.describe()}")
+
+        if any(fresh for *_, fresh in labeled) and not use_gui:
+            timestamp = time.strftime("%H:%M:%S")
+            print(f"\n[{timestamp}] Frame {frame_count}: {len(labeled)} face(s) detected")
+
+        for i, (bbox, label, score, fresh) in enumerate(labeled):
+            # Get bounding box coordinates
+            x1, y1, x2, y2 = bbox
+
+            # Choose color based on recognition result
+            if label == "Unknown" or label == "No face detected":
+                color = (0, 0, 255)  # Red for unknown
+                display_text = f"{label}"
+            else:
+                color = (0, 255, 0)  # Green for recognized
+                display_text = f"{label} ({score:.2f})"
+
+            # Draw bounding box and label
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+
+            # Add background for text
+            text_size = cv2.getTextSize(display_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+            cv2.rectangle(frame, (x1, y1 - text_size[1] - 10),
+                         (x1 + text_size[0], y1), color, -1)
+
+            # Add text
+            cv2.putText(frame, display_text, (x1, y1 - 5),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+
+            # Print results in console mode
+            if not use_gui and fresh:
+                print(f"  Face {i+1}: {label} (distance: {score:.3f})")
+
+                # Save detection image
+                if label != "Unknown":
+                    output_folder = "detections"
+                    os.makedirs(output_folder, exist_ok=True)
+                    filename = f"detection_{timestamp.replace(':', '-')}_{label}.jpg"
+                    filepath = os.path.join(output_folder, filename)
+                    cv2.imwrite(filepath, frame)
+                    print(f"    Saved: {filepath}")
+
+        if use_gui:
+            # Display frame (only if GUI is available)
+            try:
+                cv2.imshow("Face Recognition - Press 'q' to quit", frame)
+
+                # Check for quit key
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+            except cv2.error:
+                print("GUI display failed, switching to console mode")
+                use_gui = False
+        pipeline.rendered(item)
+
+        # In console mode, run for max_seconds (0 = whole video) or until Ctrl+C
+        if not use_gui and max_seconds and time.time() - start_time > max_seconds:
+            print(f"\n{max_seconds:g} seconds completed. Stopping...")
             break
+    else:
+        print("End of video" if is_file else "Error: Could not read frame")
+except KeyboardInterrupt:
+    print("\nStopping due to keyboard interrupt...")
+finally:
+    pipeline.stop()
 
 # Cleanup
 cap.release()
 if use_gui:
     cv2.destroyAllWindows()
-print("Webcam closed.")
\ No newline at end of file
+print("Webcam closed.")
+
+elapsed = time.time() - start_time
+if processed:
+    print(f"⏱️ {processed} frames in {elapsed:.1f}s ({processed / elapsed:.1f} fps), "
+          f"{recognitions_total} recognitions ({recognitions_total / processed:.2f}/frame)")
+    print(f"   {pipeline.describe()}")
+
+if args.mode == "track":
+    present = tracker.attendance()
+    print(f"Session attendance ({len(present)} students):")
+    for label, score in sorted(present.items()):
+        print(f"  {label} (best distance {score:.3f})")
+    with open("video_attendance.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["student", "best_distance"])
+        for label, score in sorted(present.items()):
+            writer.writerow([label, round(score, 3)])
+    print("Saved video_attendance.csv")
\ No newline at end of file
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Three-stage runtime for hi.py: a capture thread, an inference thread and
+# the caller's render loop (cv2.imshow must stay on the main thread),
+# connected by small bounded buffers. Each buffer has a drop policy so a
+# slow stage sheds frames instead of letting them pile up:
+#
+#   "oldest"  keep the newest `size` items (size 1 = always the latest frame)
+#   "newest"  keep what is queued and discard incoming items while full
+#   "none"    block the producer (no drops; right for video files)
+DROP_POLICIES = ("oldest", "newest", "none")
+
+
+class Buffer:
+    def __init__(self, size=1, drop="oldest"):
+        if drop not in DROP_POLICIES:
+            raise ValueError(f"drop must be one of {DROP_POLICIES}")
+        self.size = max(1, size)
+        self.drop = drop
+        self.items = deque()
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, item):
+        with self.cond:
+            while self.drop == "none" and len(self.items) >= self.size and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return
+            if len(self.items) >= self.size:
+                self.dropped += 1
+                if self.drop == "newest":
+                    return
+                self.items.popleft()
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def get(self):
+        """Next item, or None once the buffer is closed and drained."""
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Pipeline:
+    """capture -> inference -> render, with per-stage latency stats.
+
+    `infer(frame, frame_idx)` runs on the inference thread; iterate
+    `results()` on the render thread and call `rendered(item)` after
+    drawing each one.
+    """
+
+    STAGES = ("capture_wait", "inference", "render_wait", "render", "glass_to_label")
+
+    def __init__(self, cap, infer, capture_buffer=1, capture_drop="oldest",
+                 render_buffer=2, render_drop="oldest", window=500):
+        self.cap = cap
+        self.infer = infer
+        self.captured = Buffer(capture_buffer, capture_drop)
+        self.inferred = Buffer(render_buffer, render_drop)
+        self.latency = {stage: deque(maxlen=window) for stage in self.STAGES}
+        self.frames_read = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for target in (self._capture, self._inference):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.captured.close()
+        self.inferred.close()
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join(timeout=1.0)
+
+    def _capture(self):
+        while not self._stop.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            self.frames_read += 1
+            self.captured.put({"idx": self.frames_read, "frame": frame, "captured": time.perf_counter()})
+        self.captured.close()
+
+    def _inference(self):
+        try:
+            while True:
+                item = self.captured.get()
+                if item is None:
+                    break
+                item["infer_start"] = time.perf_counter()
+                item["result"] = self.infer(item["frame"], item["idx"])
+                item["infer_end"] = time.perf_counter()
+                self.inferred.put(item)
+        except Exception as e:  # surface to the render loop instead of hanging it
+            self.error = e
+            self.stop()
+        self.inferred.close()
+
+    def results(self):
+        while True:
+            item = self.inferred.get()
+            if item is None:
+                if self.error is not None:
+                    raise self.error
+                return
+            item["render_start"] = time.perf_counter()
+            yield item
+
+    def rendered(self, item):
+        done = time.perf_counter()
+        for stage, value in (("capture_wait", item["infer_start"] - item["captured"]),
+                             ("inference", item["infer_end"] - item["infer_start"]),
+                             ("render_wait", item["render_start"] - item["infer_end"]),
+                             ("render", done - item["render_start"]),
+                             ("glass_to_label", done - item["captured"])):
+            self.latency[stage].append(value)
+
+    def stats(self):
+        """p50 / p95 per stage in ms over the last `window` frames, plus drop counts."""
+        out = {}
+        for stage, values in self.latency.items():
+            if values:
+                p50, p95 = np.percentile(np.fromiter(values, float), [50, 95]) * 1000
+                out[stage] = {"p50_ms": round(p50, 1), "p95_ms": round(p95, 1)}
+        out["frames_read"] = self.frames_read
+        out["dropped"] = {"capture": self.captured.dropped, "render": self.inferred.dropped}
+        return out
+
+    def describe(self):
+        s = self.stats()
+        parts = [f"{stage} {s[stage]['p50_ms']}/{s[stage]['p95_ms']}ms" for stage in self.STAGES if stage in s]
+        return (", ".join(parts) + f" (p50/p95); dropped {s['dropped']['capture']} captured, "
+                f"{s['dropped']['render']} inferred of {s['frames_read']} frames")
@@ -1,43 +1,63 @@
 import os
 import cv2
-from ultralytics import YOLO
+import numpy as np
 import shutil
 
 UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "extracted_faces"
-
-# Ensure output folder exists
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-# Load YOLO model
-facemodel = YOLO("yolov8n-face.pt")
-
-# Get the latest uploaded image
-files = sorted(os.listdir(UPLOAD_FOLDER))
-if not files:
-    print("No uploaded image found in uploads/")
-    exit()
-
-filepath = os.path.join(UPLOAD_FOLDER, files[-1])  # take the latest file
-image = cv2.imread(filepath)
-if image is None:
-    print("Failed to read the uploaded image")
-    exit()
-
-# --- Clear previous extracted faces ---
-if os.path.exists(OUTPUT_FOLDER):
-    shutil.rmtree(OUTPUT_FOLDER)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-# --- Extract faces ---
-results = facemodel.predict(image, conf=0.4)
-counter = 0
-for result in results[0].boxes.xyxy:
-    x1, y1, x2, y2 = map(int, result)
-    face_crop = image[y1:y2, x1:x2]
-    if face_crop.size > 0:
-        face_path = os.path.join(OUTPUT_FOLDER, f"face_{counter}.jpg")
-        cv2.imwrite(face_path, face_crop)
-        counter += 1
-
-print(f"Processed {files[-1]}, extracted {counter} face(s)")
+MODEL_WEIGHTS = "yolov8n-face.pt"
+
+
+def load_model(weights=MODEL_WEIGHTS):
+    """Load the YOLO face detector (slow: keep the result around, see worker.py)."""
+    from ultralytics import YOLO
+    return YOLO(weights)
+
+
+def read_image(source):
+    """A file path, encoded image bytes, or an already decoded image -> BGR array or None."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+    if isinstance(source, str):
+        return cv2.imread(source)
+    return source
+
+
+def extract_faces(facemodel, source, output_folder=OUTPUT_FOLDER, clear=True, conf=0.4):
+    """Detect faces in one image and save the crops; returns crop paths or None if unreadable."""
+    image = read_image(source)
+    if image is None:
+        return None
+
+    # --- Clear previous extracted faces ---
+    if clear and os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+
+    # --- Extract faces ---
+    results = facemodel.predict(image, conf=conf, verbose=False)
+    face_paths = []
+    for result in results[0].boxes.xyxy:
+        x1, y1, x2, y2 = map(int, result)
+        face_crop = image[max(0, y1):y2, max(0, x1):x2]
+        if face_crop.size > 0:
+            face_path = os.path.join(output_folder, f"face_{len(face_paths)}.jpg")
+            cv2.imwrite(face_path, face_crop)
+            face_paths.append(face_path)
+    return face_paths
+
+
+if __name__ == "__main__":
+    # one-shot run on the latest upload (worker.py keeps the model loaded instead)
+    # only files: the job API keeps its per-job folders under uploads/jobs/
+    files = sorted(f for f in os.listdir(UPLOAD_FOLDER)
+                   if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))) if os.path.isdir(UPLOAD_FOLDER) else []
+    if not files:
+        print("No uploaded image found in uploads/")
+        exit()
+
+    faces = extract_faces(load_model(), os.path.join(UPLOAD_FOLDER, files[-1]))
+    if faces is None:
+        print("Failed to read the uploaded image")
+        exit()
+    print(f"Processed {files[-1]}, extracted {len(faces)} face(s)")
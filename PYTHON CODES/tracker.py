@@ -0,0 +1,162 @@
+import numpy as np
+from collections import defaultdict
+
+# Lightweight SORT-style tracker for the hi.py video mode: a constant-velocity
+# Kalman filter per face box and greedy IoU association between predicted
+# tracks and the frame's detections. Each track collects identity votes from
+# the (rare) recognitions run on it, so a seated student is recognised a few
+# times per session instead of on every frame.
+
+
+def iou_matrix(a, b):
+    """IoU between every box in a (n, 4) and b (m, 4), as (n, m)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+class KalmanBox:
+    """Constant-velocity Kalman filter over (cx, cy, w, h)."""
+
+    def __init__(self, bbox):
+        self.x = np.zeros(8)
+        self.x[:4] = self._to_z(bbox)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1000.0, 1000.0, 1000.0, 1000.0])
+        self.F = np.eye(8)
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8)
+        self.Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.01, 0.01])
+        self.R = np.diag([1.0, 1.0, 10.0, 10.0])
+
+    @staticmethod
+    def _to_z(bbox):
+        x1, y1, x2, y2 = bbox[:4]
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+
+    def predict(self):
+        self.x = self.F @ self.x
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        return self.bbox
+
+    def update(self, bbox):
+        y = self._to_z(bbox) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+
+    @property
+    def bbox(self):
+        cx, cy, w, h = self.x[:4]
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+
+class Track:
+    def __init__(self, track_id, bbox, frame_idx):
+        self.id = track_id
+        self.kf = KalmanBox(bbox)
+        self.hits = 1
+        self.misses = 0
+        self.first_frame = frame_idx
+        self.last_recognized = None
+        self.recognitions = 0
+        self.votes = defaultdict(int)
+        self.best_score = {}
+
+    @property
+    def bbox(self):
+        return self.kf.bbox
+
+    def vote(self, label, score, frame_idx):
+        self.votes[label] += 1
+        self.recognitions += 1
+        self.last_recognized = frame_idx
+        # hi.py scores are distances: lower is better
+        self.best_score[label] = min(score, self.best_score.get(label, float("inf")))
+
+    def identity(self):
+        """(label, share of votes, best distance); known labels win ties over Unknown."""
+        if not self.votes:
+            return "Unknown", 0.0, None
+        label = max(self.votes, key=lambda k: (self.votes[k], k != "Unknown"))
+        return label, self.votes[label] / sum(self.votes.values()), self.best_score[label]
+
+
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, max_misses=15, min_hits=2,
+                 recheck_every=15, max_recognitions=5, min_share=0.6):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses          # frames a track survives without a detection
+        self.min_hits = min_hits              # detections before a track is reported
+        self.recheck_every = recheck_every    # frames between re-recognitions of an unsure track
+        self.max_recognitions = max_recognitions
+        self.min_share = min_share            # vote share that counts as a confident identity
+        self.tracks = []
+        self.finished = []
+        self._next_id = 1
+
+    def update(self, bboxes, frame_idx):
+        """Associate this frame's detections; returns [(track, det_index)] for matched/new tracks."""
+        predicted = np.array([t.kf.predict() for t in self.tracks]).reshape(-1, 4)
+        dets = np.asarray(bboxes, dtype=np.float64).reshape(-1, 5)[:, :4] if len(bboxes) else np.zeros((0, 4))
+        iou = iou_matrix(predicted, dets)
+
+        matched, used_tracks, used_dets = [], set(), set()
+        for flat in np.argsort(-iou, axis=None):
+            ti, di = np.unravel_index(flat, iou.shape)
+            if iou[ti, di] < self.iou_threshold:
+                break
+            if ti in used_tracks or di in used_dets:
+                continue
+            used_tracks.add(ti)
+            used_dets.add(di)
+            track = self.tracks[ti]
+            track.kf.update(dets[di])
+            track.hits += 1
+            track.misses = 0
+            matched.append((track, int(di)))
+
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks:
+                track.misses += 1
+        for di in range(len(dets)):
+            if di not in used_dets:
+                track = Track(self._next_id, dets[di], frame_idx)
+                self._next_id += 1
+                self.tracks.append(track)
+                matched.append((track, di))
+
+        alive = []
+        for track in self.tracks:
+            (alive if track.misses <= self.max_misses else self.finished).append(track)
+        self.tracks = alive
+        return matched
+
+    def needs_recognition(self, track, frame_idx):
+        if track.recognitions == 0:
+            return True
+        if track.recognitions >= self.max_recognitions:
+            return False
+        label, share, _ = track.identity()
+        unsure = label == "Unknown" or share < self.min_share
+        return unsure and frame_idx - track.last_recognized >= self.recheck_every
+
+    def attendance(self):
+        """{label: best distance} over all tracks seen long enough, finished or not."""
+        present = {}
+        for track in self.finished + self.tracks:
+            if track.hits < self.min_hits:
+                continue
+            label, share, score = track.identity()
+            if label == "Unknown" or share < self.min_share:
+                continue
+            present[label] = min(score, present.get(label, float("inf")))
+        return present
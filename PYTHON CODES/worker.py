@@ -1,22 +1,274 @@
-import time
+import base64
+import json
+import math
 import os
-import subprocess
+import queue
+import re
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+
+import process
+
+# Long-lived detection worker: the YOLO model is loaded once per slot and
+# jobs arrive over a local socket (multiprocessing.connection) instead of
+# polling uploads/ and starting a fresh `python3 process.py` per image.
+# Messages are JSON (image bytes base64), never pickles, and the socket's
+# authkey is WORKER_AUTHKEY or a random key generated into a 0600 file
+# that app.py and the daemon both read. A job names no paths: the worker
+# writes its crops and result under WORKER_JOBS_DIR/<job_id>/ only.
+#
+#   python3 worker.py                     # start the daemon
+#   from worker import submit; submit("uploads/attendance.jpg")
+WORKER_HOST = os.environ.get("WORKER_HOST", "127.0.0.1")
+WORKER_PORT = int(os.environ.get("WORKER_PORT", 6001))
+WORKER_AUTHKEY_FILE = os.environ.get("WORKER_AUTHKEY_FILE",
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".worker_authkey"))
+WORKER_JOBS_DIR = os.environ.get("WORKER_JOBS_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), process.UPLOAD_FOLDER, "jobs"))  # app.py's job folders
+JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+MAX_MESSAGE = 64 * 1024 * 1024  # bytes; larger messages drop the connection
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 1))  # jobs at once, one model each
+WORKER_MAX_QUEUE = int(os.environ.get("WORKER_MAX_QUEUE", 32))     # waiting jobs before rejecting
+KEEP_RESULTS = 1000  # finished jobs remembered for status queries
+
+
+def authkey():
+    """WORKER_AUTHKEY, else the key in WORKER_AUTHKEY_FILE (created 0600 with a random key on first use)."""
+    if os.environ.get("WORKER_AUTHKEY"):
+        return os.environ["WORKER_AUTHKEY"].encode()
+    try:
+        fd = os.open(WORKER_AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        if os.stat(WORKER_AUTHKEY_FILE).st_mode & 0o077:
+            raise PermissionError(f"{WORKER_AUTHKEY_FILE} is readable by other users; chmod 600 it")
+        for _ in range(50):  # the other process may still be writing it
+            with open(WORKER_AUTHKEY_FILE, "rb") as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.1)
+        raise RuntimeError(f"{WORKER_AUTHKEY_FILE} is empty")
+    key = secrets.token_hex(32).encode()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def job_dir(job_id):
+    """WORKER_JOBS_DIR/<job_id>; ValueError unless `job_id` is 32 hex digits (no path tricks)."""
+    if not isinstance(job_id, str) or not JOB_ID_RE.match(job_id):
+        raise ValueError(f"invalid job_id {job_id!r}")
+    return os.path.join(WORKER_JOBS_DIR, job_id)
+
+def job_paths(job_id):
+    """(faces folder, result file) the worker writes for `job_id`."""
+    folder = job_dir(job_id)
+    return os.path.join(folder, "faces"), os.path.join(folder, "result.json")
+
+
+def send_json(conn, message):
+    conn.send_bytes(json.dumps(message).encode())
+
+def recv_json(conn):
+    message = json.loads(conn.recv_bytes(MAX_MESSAGE))
+    if not isinstance(message, dict):
+        raise ValueError("expected a JSON object")
+    return message
+
+
+# ------------------------------
+# client side (app.py, scripts)
+# ------------------------------
+def request(message):
+    with Client((WORKER_HOST, WORKER_PORT), authkey=authkey()) as conn:
+        send_json(conn, message)
+        return recv_json(conn)
+
+def submit(image, job_id=None):
+    """Queue one image; returns {"accepted", "job_id", "queue_depth"} (+ "retry_after" if rejected).
+
+    `image` is a path (read here) or the encoded image bytes; either way
+    the bytes go over the socket. Crops land in job_paths(job_id)[0] and
+    the final status in job_paths(job_id)[1], so it survives a worker restart.
+    """
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            image = f.read()
+    reply = request({"op": "submit", "job_id": job_id or uuid.uuid4().hex,
+                     "image_b64": base64.b64encode(bytes(image)).decode("ascii")})
+    if "error" in reply:
+        raise ValueError(reply["error"])
+    return reply
+
+def job_status(job_id):
+    return request({"op": "status", "job_id": job_id})
+
+def worker_stats():
+    return request({"op": "stats"})
+
+
+# ------------------------------
+# daemon side
+# ------------------------------
+class InferenceWorker:
+    def __init__(self, concurrency=WORKER_CONCURRENCY, max_queue=WORKER_MAX_QUEUE):
+        self.concurrency = max(1, concurrency)
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.done = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.process_total = 0.0
+        self.ready = threading.Event()
+
+    def start(self):
+        loaded = []
+        for i in range(self.concurrency):
+            threading.Thread(target=self._run, args=(i, loaded), daemon=True).start()
+
+    def _remember(self, job_id, result):
+        with self.lock:
+            self.results[job_id] = result
+            self.results.move_to_end(job_id)
+            while len(self.results) > KEEP_RESULTS:
+                self.results.popitem(last=False)
+
+    def submit(self, job):
+        job["queued_at"] = time.perf_counter()
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return {"accepted": False, "job_id": job["job_id"], "queue_depth": self.jobs.qsize(),
+                    "retry_after": self.retry_after()}
+        self._remember(job["job_id"], {"status": "queued"})
+        return {"accepted": True, "job_id": job["job_id"], "queue_depth": self.jobs.qsize()}
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely free, from the average processing time."""
+        with self.lock:
+            avg = self.process_total / self.done if self.done else 5.0
+        return max(1, math.ceil(avg / self.concurrency))
+
+    def _write_result(self, path, result):
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Could not write {path} ({e})")
+
+    def _run(self, slot, loaded):
+        started = time.perf_counter()
+        facemodel = process.load_model()
+        print(f"✅ Slot {slot}: YOLO loaded in {time.perf_counter() - started:.1f}s")
+        loaded.append(slot)
+        if len(loaded) == self.concurrency:
+            self.ready.set()
+
+        while True:
+            job = self.jobs.get()
+            picked = time.perf_counter()
+            waited = picked - job["queued_at"]
+            with self.lock:
+                self.running += 1
+            self._remember(job["job_id"], {"status": "running", "wait_seconds": round(waited, 3)})
+            output, result_file = job_paths(job["job_id"])
+            try:
+                faces = process.extract_faces(facemodel, job["image"], output)
+                error = None if faces is not None else "Failed to read the uploaded image"
+            except Exception as e:
+                faces, error = None, str(e)
+            seconds = time.perf_counter() - picked
+            with self.lock:
+                self.running -= 1
+                if error:
+                    self.failed += 1
+                else:
+                    self.done += 1
+                    self.latency_total += waited + seconds
+                    self.process_total += seconds
+            result = {"status": "failed" if error else "done",
+                      "wait_seconds": round(waited, 3), "process_seconds": round(seconds, 3)}
+            if error:
+                result["error"] = error
+                print(f"❌ {job['job_id']}: {error}")
+            else:
+                result["faces"] = faces
+                print(f"✅ {job['job_id']}: {len(faces)} face(s) in {seconds:.2f}s "
+                      f"(waited {waited:.2f}s, queue depth {self.jobs.qsize()})")
+            self._remember(job["job_id"], result)
+            self._write_result(result_file, result)
+
+    def status(self, job_id):
+        with self.lock:
+            return self.results.get(job_id, {"status": "unknown"})
 
-UPLOAD_FOLDER = "uploads"
-processed_mtime = None
+    def stats(self):
+        with self.lock:
+            return {
+                "ready": self.ready.is_set(),
+                "concurrency": self.concurrency,
+                "queue_depth": self.jobs.qsize(),
+                "queue_max": self.jobs.maxsize,
+                "running": self.running,
+                "done": self.done,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_latency_seconds": round(self.latency_total / self.done, 3) if self.done else None,
+            }
 
-print("Worker started, monitoring uploads/ ...")
+    def handle(self, conn):
+        with conn:
+            try:
+                while True:
+                    message = recv_json(conn)
+                    op = message.get("op")
+                    if op == "submit":
+                        # only these fields: every path is derived from job_id (job_paths)
+                        extra = set(message) - {"op", "job_id", "image_b64"}
+                        try:
+                            if extra:
+                                raise ValueError(f"unexpected fields {sorted(extra)}")
+                            os.makedirs(job_dir(message["job_id"]), exist_ok=True)
+                            image = base64.b64decode(message["image_b64"], validate=True)
+                        except (ValueError, TypeError) as e:
+                            send_json(conn, {"error": str(e)})
+                            continue
+                        send_json(conn, self.submit({"job_id": message["job_id"], "image": image}))
+                    elif op == "status":
+                        send_json(conn, self.status(message["job_id"]))
+                    elif op == "stats":
+                        send_json(conn, self.stats())
+                    else:
+                        send_json(conn, {"error": f"unknown op {op!r}"})
+            except (EOFError, OSError, ValueError, KeyError) as e:
+                if not isinstance(e, EOFError):
+                    print(f"⚠️ Dropped connection: {e!r}")
 
-while True:
-    files = os.listdir(UPLOAD_FOLDER)
-    if files:
-        latest_file = files[0]  # assuming only 1 file
-        filepath = os.path.join(UPLOAD_FOLDER, latest_file)
-        mtime = os.path.getmtime(filepath)
+    def serve(self, address=(WORKER_HOST, WORKER_PORT), key=None):
+        key = key or authkey()  # before loading models: fail fast on a bad key file
+        self.start()
+        with Listener(address, authkey=key) as listener:
+            print(f"Worker listening on {address[0]}:{address[1]} "
+                  f"(concurrency {self.concurrency}, queue {self.jobs.maxsize})")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:  # bad authkey / dropped handshake
+                    print(f"⚠️ Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
 
-        if processed_mtime is None or mtime != processed_mtime:
-            print(f"New or updated image detected: {latest_file}. Running process.py ...")
-            subprocess.run(["python3", "process.py"])
-            processed_mtime = mtime  # update last processed time
 
-    time.sleep(1)  # check every 1 second
+if __name__ == "__main__":
+    InferenceWorker().serve()